@@ -0,0 +1,62 @@
+"""Gunicorn configuration for serving cghousing in production.
+
+Used by run.sh::
+
+    gunicorn -c cghousing/cghousing/gunicorn_conf.py cghousing.wsgi:application
+
+The values come from the WEB_* settings in settings.py (and hence from the
+CG_WEB_* environment variables), so that they are documented and overridden in
+one place.
+
+Each of the pre-forked workers runs a pool of threads (the "gthread" worker),
+so a request that waits on the database, on a slow client, or on a file
+download only occupies one thread. The slow work itself happens off the
+request threads: the members PDF is built in the background (coop.pdfbuild)
+and file downloads are capped per worker (settings.MAX_FILE_STREAMS) or handed
+off to the front-end server (settings.FILE_SERVE_MODE).
+
+Send the master process SIGHUP to reload the code and configuration
+gracefully: new workers are started and the old ones finish their requests
+before they exit.
+
+"""
+
+import os
+import sys
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_DIR not in sys.path:
+    sys.path.insert(0, PROJECT_DIR)
+
+from cghousing import settings
+
+chdir = PROJECT_DIR
+bind = settings.WEB_BIND
+workers = settings.WEB_WORKERS
+worker_class = 'gthread'
+threads = settings.WEB_THREADS
+timeout = settings.WEB_TIMEOUT
+graceful_timeout = settings.WEB_GRACEFUL_TIMEOUT
+keepalive = settings.WEB_KEEPALIVE
+
+# Each worker would have a cache of its own, and a change saved through one
+# worker would not invalidate the entries cached by the others.
+if (workers > 1 and
+        settings.CACHES['default']['BACKEND'] == settings.LOCMEM_CACHE_BACKEND):
+    sys.stderr.write('WARNING: %d workers with a local-memory cache serve'
+        ' stale pages; set CG_CACHE_BACKEND to a shared'
+        ' backend (see settings.py).\n' % workers)
+
+# Replace workers now and then (at staggered times) so that leaks cannot
+# accumulate.
+max_requests = settings.WEB_MAX_REQUESTS
+max_requests_jitter = settings.WEB_MAX_REQUESTS // 10
+
+# The application is imported by each worker after the fork, rather than by
+# the master, so that a reload picks up new code, and so that the background
+# threads and database connections of one worker are never shared with
+# another.
+preload_app = False
+
+accesslog = '-'
+errorlog = '-'
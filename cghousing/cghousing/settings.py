@@ -9,6 +9,7 @@
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 import os
+import multiprocessing
 BASE_DIR = os.path.dirname(os.path.dirname(__file__))
 
 # SECURITY WARNING: keep the secret key used in production secret!
@@ -49,6 +50,7 @@ INSTALLED_APPS = (
 )
 
 MIDDLEWARE_CLASSES = (
+    'coop.instrumentation.RequestInstrumentationMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -64,15 +66,41 @@ WSGI_APPLICATION = 'cghousing.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/1.6/ref/settings/#databases
+# The prod database uses coop.db.postgresql: Django's PostgreSQL backend plus
+# health checks and an optional connection pool.
+#
+# - CG_DB_CONN_MAX_AGE: seconds that a thread keeps its connection open
+#   between requests (0 to close it after each request).
+# - CG_DB_HEALTH_CHECKS: check that a kept connection still works before it
+#   is used in a new request, and reconnect if it does not.
+# - CG_DB_POOL_SIZE: if not 0, the threads of each process share a pool of up
+#   to this many connections, which they check out for the length of a
+#   request (CG_DB_CONN_MAX_AGE is then ignored). Threads wait up to
+#   CG_DB_POOL_TIMEOUT seconds for a free connection. Pooled connections are
+#   closed once they are CG_DB_MAX_LIFETIME seconds old.
+
+DB_POOL_SIZE = int(os.getenv('CG_DB_POOL_SIZE', 0))
+DB_POOL = None
+if DB_POOL_SIZE:
+    DB_POOL = {
+        'SIZE': DB_POOL_SIZE,
+        'TIMEOUT': float(os.getenv('CG_DB_POOL_TIMEOUT', 10)),
+        'MAX_LIFETIME': int(os.getenv('CG_DB_MAX_LIFETIME', 1800)),
+    }
 
 DATABASES = {
     'prod': {
-        'ENGINE': 'django.db.backends.postgresql_psycopg2',
+        'ENGINE': 'coop.db.postgresql',
         'NAME': os.getenv('CG_DB_NAME', 'cghousing'),
         'USER': os.getenv('CG_DB_USER', 'cghousing'),
         'PASSWORD': os.getenv('CG_DB_PASSWORD', 'choose-a-better-password-a.}uBcZed?gz'),
         'HOST': os.getenv('CG_DB_HOST', ''),
         'PORT': os.getenv('CG_DB_PORT', ''),
+        'CONN_MAX_AGE': 0 if DB_POOL else int(os.getenv('CG_DB_CONN_MAX_AGE',
+            60)),
+        'HEALTH_CHECKS': os.getenv('CG_DB_HEALTH_CHECKS', '1') not in (
+            '0', 'false', 'False', ''),
+        'POOL': DB_POOL,
     },
     'dev': {
          'ENGINE': 'django.db.backends.sqlite3',
@@ -124,6 +152,128 @@ MARKDOWN_DEUX_STYLES = {
 
 UPLOADS_PATH = os.getenv('CG_UPLOADS_PATH', '/uploads/')
 
+# Uploads are streamed into the upload store, sniffed and hashed in one pass,
+# and rejected as soon as they exceed MAX_UPLOAD_SIZE bytes; see coop.uploads.
+FILE_UPLOAD_HANDLERS = ('coop.uploads.UploadHandler',)
+MAX_UPLOAD_SIZE = int(os.getenv('CG_MAX_UPLOAD_SIZE', 20000000))
+
+# How uploaded files are sent to clients: 'django' streams them from Django;
+# 'x-accel-redirect' (nginx) and 'x-sendfile' (Apache, lighttpd) have Django
+# check permissions only and let the front-end server send the bytes. For
+# nginx, FILE_ACCEL_REDIRECT_PREFIX must be an `internal` location aliased to
+# UPLOADS_PATH.
+FILE_SERVE_MODE = os.getenv('CG_FILE_SERVE_MODE', 'django')
+FILE_ACCEL_REDIRECT_PREFIX = os.getenv('CG_FILE_ACCEL_REDIRECT_PREFIX',
+    '/protected-uploads/')
+
+# Production serving: run.sh starts gunicorn with cghousing/gunicorn_conf.py,
+# which takes these values. WEB_WORKERS pre-forked processes each handle
+# WEB_THREADS requests at a time. A worker that does not respond for
+# WEB_TIMEOUT seconds is killed and replaced; on a graceful reload (SIGHUP) or
+# shutdown (SIGTERM), workers get WEB_GRACEFUL_TIMEOUT seconds to finish their
+# requests. Idle keep-alive connections are closed after WEB_KEEPALIVE seconds,
+# and each worker is replaced after about WEB_MAX_REQUESTS requests (0 for
+# never). Static files are not served; point the front-end server at
+# STATIC_ROOT.
+WEB_BIND = os.getenv('CG_WEB_BIND', '0.0.0.0:8000')
+WEB_WORKERS = int(os.getenv('CG_WEB_WORKERS',
+    multiprocessing.cpu_count() * 2 + 1))
+WEB_THREADS = int(os.getenv('CG_WEB_THREADS', 4))
+WEB_TIMEOUT = int(os.getenv('CG_WEB_TIMEOUT', 60))
+WEB_GRACEFUL_TIMEOUT = int(os.getenv('CG_WEB_GRACEFUL_TIMEOUT', 30))
+WEB_KEEPALIVE = int(os.getenv('CG_WEB_KEEPALIVE', 5))
+WEB_MAX_REQUESTS = int(os.getenv('CG_WEB_MAX_REQUESTS', 1000))
+
+# The number of files that each process may stream from Django at once; see
+# coop.serving. Further downloads get 503 Service Unavailable, so that slow
+# downloads cannot tie up all of a worker's WEB_THREADS and starve page views.
+MAX_FILE_STREAMS = int(os.getenv('CG_MAX_FILE_STREAMS',
+    max(1, WEB_THREADS // 2)))
+
+# Thread view counts are buffered in each process and written to the database
+# this often (in seconds) by a background thread, or on every view if 0; see
+# coop.viewcounts.
+VIEW_COUNT_FLUSH_INTERVAL = int(os.getenv('CG_VIEW_COUNT_FLUSH_INTERVAL', 60))
+
+# Number of background threads (per process) that build the membership list
+# PDF; see coop.pdfbuild.
+PDF_BUILD_WORKERS = int(os.getenv('CG_PDF_BUILD_WORKERS', 1))
+
+# Where the built membership list PDFs are kept, and how many of them (and how
+# many bytes' worth) to keep; the least recently used are deleted first.
+PDF_BUILDS_PATH = os.getenv('CG_PDF_BUILDS_PATH',
+    os.path.join(BASE_DIR, 'latex', 'builds'))
+PDF_CACHE_MAX_FILES = int(os.getenv('CG_PDF_CACHE_MAX_FILES', 20))
+PDF_CACHE_MAX_BYTES = int(os.getenv('CG_PDF_CACHE_MAX_BYTES', 50000000))
+
+# pdflatex loads the membership list's preamble from a format file that is
+# precompiled once and kept in LATEX_FORMATS_PATH (set
+# CG_PDF_PRECOMPILED_PREAMBLE=0 to parse it every time), and is killed after
+# PDF_BUILD_TIMEOUT seconds; see coop.latex.
+PDF_PRECOMPILED_PREAMBLE = os.getenv('CG_PDF_PRECOMPILED_PREAMBLE', '1') not in (
+    '0', 'false', 'False', '')
+LATEX_FORMATS_PATH = os.getenv('CG_LATEX_FORMATS_PATH',
+    os.path.join(BASE_DIR, 'latex', 'formats'))
+PDF_BUILD_TIMEOUT = int(os.getenv('CG_PDF_BUILD_TIMEOUT', 120))
+
+# Number of background threads (per process) that make the thumbnails and
+# previews of uploaded images and PDFs, and the seconds after which rendering
+# a PDF's first page is given up; see coop.derivatives.
+DERIVATIVE_WORKERS = int(os.getenv('CG_DERIVATIVE_WORKERS', 1))
+DERIVATIVE_TIMEOUT = int(os.getenv('CG_DERIVATIVE_TIMEOUT', 30))
+
+# The PostgreSQL text search configuration (i.e., language) that search
+# queries and the search index use; see coop.search.
+SEARCH_CONFIG = os.getenv('CG_SEARCH_CONFIG', 'english')
+
+# Caching
+# https://docs.djangoproject.com/en/1.7/topics/cache/
+# The default local-memory cache is per-process, so it only suits a single
+# process (e.g., runserver). When running more than one worker process, point
+# this at a shared backend so that cache invalidations are seen by all
+# workers: the Dockerfile uses the database cache (CG_CACHE_BACKEND=
+# django.core.cache.backends.db.DatabaseCache, CG_CACHE_LOCATION=coop_cache,
+# whose table run.sh creates); memcached also does. gunicorn_conf.py warns
+# if WEB_WORKERS > 1 with a local-memory cache.
+LOCMEM_CACHE_BACKEND = 'django.core.cache.backends.locmem.LocMemCache'
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CG_CACHE_BACKEND', LOCMEM_CACHE_BACKEND),
+        'LOCATION': os.getenv('CG_CACHE_LOCATION', 'cghousing'),
+    }
+}
+
+# Cache the rendered member directory until a person, committee, phone number,
+# unit or user changes. Set CG_CACHE_MEMBER_DIRECTORY=0 to render it on every
+# request.
+CACHE_MEMBER_DIRECTORY = os.getenv('CG_CACHE_MEMBER_DIRECTORY', '1') not in (
+    '0', 'false', 'False', '')
+
+# Likewise, cache the rendered committee list until a committee, its
+# membership or a person changes.
+CACHE_COMMITTEE_LIST = os.getenv('CG_CACHE_COMMITTEE_LIST', '1') not in (
+    '0', 'false', 'False', '')
+
+# Record the query count and timings of each request, log them to the 'coop'
+# logger, and aggregate them for superusers at /request-stats/. See
+# coop.instrumentation. QUERY_BUDGETS maps URL names to the maximum number of
+# queries their views should issue; requests over budget are logged as
+# warnings. DEFAULT_QUERY_BUDGET (None for no limit) applies to all others.
+REQUEST_INSTRUMENTATION = os.getenv('CG_REQUEST_INSTRUMENTATION', '0') not in (
+    '0', 'false', 'False', '')
+DEFAULT_QUERY_BUDGET = None
+QUERY_BUDGETS = {
+    'coop:index': 10,
+    'coop:members': 10,
+    'coop:forums': 10,
+    'coop:forum': 10,
+    'coop:forum_by_url_name': 10,
+    'coop:thread': 12,
+    'coop:thread_view_by_url_subject': 12,
+    'coop:participation_requirements': 15,
+}
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
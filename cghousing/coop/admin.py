@@ -415,15 +415,12 @@ class ForumAdmin(MyModelAdmin):
     readonly_fields = READONLY_FIELDS_
 
     def get_thread_count(self, obj):
-        return len(obj.threads.all())
+        return obj.thread_count
 
     get_thread_count.short_description = "Threads"
 
     def get_post_count(self, obj):
-        post_count = 0
-        for thread in obj.threads.all():
-            post_count += thread.posts.count()
-        return post_count
+        return obj.post_count
 
     get_post_count.short_description = "Posts"
 
@@ -453,12 +450,12 @@ class ThreadAdmin(MyModelAdmin):
     list_filter = ['forum']
 
     def get_replies(self, obj):
-        return obj.posts.count()
+        return obj.post_count
 
     get_replies.short_description = u'Replies'
 
     def get_last_post(self, obj):
-        last_post = obj.posts.order_by('datetime_created').last()
+        last_post = obj.last_post
         if last_post:
             return last_post
         else:
@@ -0,0 +1,10 @@
+from django.apps import AppConfig
+
+
+class CoopConfig(AppConfig):
+    name = 'coop'
+    verbose_name = 'Co-op'
+
+    def ready(self):
+        # Connect the signal receivers that keep cached data fresh.
+        import coop.signals
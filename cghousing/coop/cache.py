@@ -0,0 +1,134 @@
+"""Caching utilities for the Co-op App.
+
+Cached values live in two layers:
+
+- a process-local dict, which avoids unpickling the same value over and over
+  in a long-lived worker process, and
+- the shared Django cache (see `CACHES` in settings), which is visible to all
+  worker processes when a shared backend (e.g., memcached) is configured.
+
+Keys are namespaced and versioned. Invalidating a namespace simply bumps its
+version (see `invalidate_namespace`), which orphans all of the keys built
+with the old version in both layers. Signal receivers in `coop.signals` do the
+bumping when the underlying models change.
+
+"""
+
+import time
+import threading
+
+from django.core.cache import cache
+
+KEY_PREFIX = 'coop'
+
+# Namespaces
+GLOBAL_CONTEXT_NAMESPACE = 'global_context'
+MEMBER_DIRECTORY_NAMESPACE = 'member_directory'
+COMMITTEE_LIST_NAMESPACE = 'committee_list'
+UNIT_OCCUPANTS_NAMESPACE = 'unit_occupants'
+
+# Process-local layer: maps a versioned key to its cached value.
+_local_cache = {}
+_local_cache_lock = threading.Lock()
+
+
+def get_version_key(namespace):
+    return '%s:version:%s' % (KEY_PREFIX, namespace)
+
+
+def get_initial_version():
+    """Return a fresh version number. We use the current time (in ms) rather
+    than 1 so that a version key that has been evicted from the shared cache
+    can never resurrect stale values that were stored under an old version.
+
+    """
+
+    return int(time.time() * 1000)
+
+
+def get_namespace_version(namespace):
+    """Return the current version of `namespace` from the shared cache,
+    initializing it if necessary.
+
+    """
+
+    version_key = get_version_key(namespace)
+    version = cache.get(version_key)
+    if version is None:
+        cache.add(version_key, get_initial_version(), None)
+        version = cache.get(version_key)
+    return version
+
+
+def invalidate_namespace(namespace):
+    """Bump the version of `namespace` so that all values cached under it are
+    ignored from now on, in this process and in all others that share the
+    cache.
+
+    """
+
+    version_key = get_version_key(namespace)
+    try:
+        cache.incr(version_key)
+    except ValueError:
+        cache.set(version_key, get_initial_version(), None)
+    with _local_cache_lock:
+        for key in [k for k in _local_cache if k[0] == namespace]:
+            del _local_cache[key]
+
+
+def get_versioned_key(namespace, *parts):
+    """Return a 2-tuple: a key for the process-local layer and a string key for
+    the shared cache. Both embed the current version of `namespace`.
+
+    """
+
+    version = get_namespace_version(namespace)
+    local_key = (namespace, version) + tuple(parts)
+    shared_key = ':'.join([KEY_PREFIX, namespace, str(version)] +
+        [unicode(p) for p in parts])
+    return local_key, shared_key
+
+
+def get_or_build(namespace, build, *parts, **kwargs):
+    """Return the value cached under `namespace` (and `parts`), calling
+    `build()` to compute and cache it on a miss. `timeout` (in seconds) may be
+    passed as a keyword argument; it defaults to never expiring, since
+    invalidation is signal-driven.
+
+    """
+
+    timeout = kwargs.get('timeout')
+    local_key, shared_key = get_versioned_key(namespace, *parts)
+    try:
+        return _local_cache[local_key]
+    except KeyError:
+        pass
+    value = cache.get(shared_key)
+    if value is None:
+        value = build()
+        cache.set(shared_key, value, timeout)
+    with _local_cache_lock:
+        # Drop entries for stale versions of this namespace first.
+        for key in [k for k in _local_cache
+                    if k[0] == namespace and k[1] != local_key[1]]:
+            del _local_cache[key]
+        _local_cache[local_key] = value
+    return value
+
+
+def memoize_on_request(request, attr, build):
+    """Return `getattr(request, attr)`, setting it to `build()` first if it is
+    not there yet. This lets several helpers called during one request share a
+    single computation. If `request` is `None`, just return `build()`.
+
+    """
+
+    if request is None:
+        return build()
+    try:
+        return getattr(request, attr)
+    except AttributeError:
+        value = build()
+        setattr(request, attr, value)
+        return value
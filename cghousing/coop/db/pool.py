@@ -0,0 +1,253 @@
+"""An in-process pool of psycopg2 connections.
+
+Each process keeps up to `size` open connections to the database, which its
+request threads check out when they first need the database and check back
+in when Django closes its connection at the end of the request (see
+coop/db/postgresql/base.py). Checking out a connection from the pool is much
+cheaper than opening one, and the pool caps the number of connections a
+process holds, however many threads it has. When all of them are in use, a
+thread waits up to `timeout` seconds for one to be checked in, then gives up
+with `PoolTimeout`.
+
+Connections are closed instead of being reused once they are `max_lifetime`
+seconds old, or if they are broken. A connection that has sat idle for more
+than `HEALTH_CHECK_IDLE` seconds is checked with ``SELECT 1`` before it is
+handed out.
+
+Every pool counts its checkouts, waits, timeouts and the connections that it
+opened and closed; `get_all_stats` returns these figures for the
+instrumentation (see `coop.instrumentation`).
+
+"""
+
+import os
+import time
+import threading
+
+try:
+    from psycopg2 import extensions
+except ImportError:
+    extensions = None
+
+# Connections that were checked in less than this many seconds ago are handed
+# out without a health check.
+HEALTH_CHECK_IDLE = 5
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+def get_pool(key, connect, size, timeout, max_lifetime):
+    """Return the pool of connections for `key` (e.g., a database alias and
+    its connection parameters), creating it with `connect` (a callable that
+    opens a connection) and the other arguments if this process does not
+    have one yet.
+
+    """
+
+    with _pools_lock:
+        pool = _pools.get(key)
+        # A pool that was inherited from a parent process shares its sockets;
+        # start afresh.
+        if pool is None or pool.pid != os.getpid():
+            pool = _pools[key] = ConnectionPool(connect, size, timeout,
+                max_lifetime)
+        return pool
+
+
+def get_all_stats():
+    """Return a dict from the key of each pool in this process to its
+    statistics.
+
+    """
+
+    with _pools_lock:
+        pools = _pools.items()
+    return dict((str(key[0]), pool.get_stats()) for key, pool in pools)
+
+
+class ConnectionPool(object):
+    """A pool of at most `size` connections, opened by calling `connect`."""
+
+    def __init__(self, connect, size, timeout, max_lifetime):
+        self.connect = connect
+        self.size = max(1, size)
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.pid = os.getpid()
+        # (connection, time opened, time checked in), most recent last.
+        self._idle = []
+        # Maps the ids of the connections that are checked out to the time
+        # they were opened.
+        self._opened_at = {}
+        # The number of open connections, idle or not, including those that
+        # are being opened.
+        self._open = 0
+        self._condition = threading.Condition()
+        self._stats = {
+            'checkouts': 0,
+            'waits': 0,
+            'wait_time': 0.0,
+            'timeouts': 0,
+            'connections_created': 0,
+            'connections_closed': 0,
+            'health_check_failures': 0
+        }
+
+    def checkout(self):
+        """Return an open connection, waiting for one if they are all in
+        use. Raise `PoolTimeout` if none is checked in within `timeout`
+        seconds.
+
+        """
+
+        started = time.time()
+        while True:
+            with self._condition:
+                connection, opened_at, checked_in_at = self._take(started)
+            if connection is None:
+                return self._create()
+            if self._is_expired(opened_at):
+                self._discard(connection)
+                continue
+            if (time.time() - checked_in_at > HEALTH_CHECK_IDLE and
+                    not is_usable(connection)):
+                with self._condition:
+                    self._stats['health_check_failures'] += 1
+                self._discard(connection)
+                continue
+            with self._condition:
+                self._opened_at[id(connection)] = opened_at
+                self._stats['checkouts'] += 1
+            return connection
+
+    def _take(self, started):
+        """Return the most recently used idle connection, with the times it
+        was opened and checked in, or reserve room for a new connection and
+        return (`None`, `None`, `None`). The caller must hold the condition.
+
+        """
+
+        wait_started = None
+        try:
+            while True:
+                if self._idle:
+                    return self._idle.pop()
+                if self._open < self.size:
+                    self._open += 1
+                    return None, None, None
+                if wait_started is None:
+                    wait_started = time.time()
+                    self._stats['waits'] += 1
+                remaining = self.timeout - (time.time() - started)
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    raise PoolTimeout('No database connection became free'
+                        ' within %s seconds.' % self.timeout)
+                self._condition.wait(remaining)
+        finally:
+            if wait_started is not None:
+                self._stats['wait_time'] += time.time() - wait_started
+
+    def _create(self):
+        try:
+            connection = self.connect()
+        except Exception:
+            with self._condition:
+                self._open -= 1
+                self._condition.notify()
+            raise
+        with self._condition:
+            self._opened_at[id(connection)] = time.time()
+            self._stats['connections_created'] += 1
+            self._stats['checkouts'] += 1
+        return connection
+
+    def checkin(self, connection, discard=False):
+        """Return `connection` to the pool, rolling back any transaction it
+        is in, or close it if `discard` is true or it is broken or too old.
+
+        """
+
+        with self._condition:
+            opened_at = self._opened_at.pop(id(connection), None)
+        if opened_at is None:
+            # Not one of ours (e.g., it was opened before a fork).
+            connection.close()
+            return
+        if discard or self._is_expired(opened_at) or not reset(connection):
+            self._discard(connection)
+            return
+        with self._condition:
+            self._idle.append((connection, opened_at, time.time()))
+            self._condition.notify()
+
+    def _discard(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+        with self._condition:
+            self._open -= 1
+            self._stats['connections_closed'] += 1
+            self._condition.notify()
+
+    def _is_expired(self, opened_at):
+        return (self.max_lifetime is not None and
+            time.time() - opened_at >= self.max_lifetime)
+
+    def get_stats(self):
+        """Return a dict of the pool's size and counters. Times are in
+        milliseconds.
+
+        """
+
+        with self._condition:
+            stats = dict(self._stats)
+            stats['size'] = self.size
+            stats['open'] = self._open
+            stats['idle'] = len(self._idle)
+            stats['in_use'] = len(self._opened_at)
+        stats['wait_ms'] = stats.pop('wait_time') * 1000
+        return stats
+
+
+def is_usable(connection):
+    try:
+        cursor = connection.cursor()
+        try:
+            cursor.execute('SELECT 1')
+        finally:
+            cursor.close()
+        if not connection.autocommit:
+            connection.rollback()
+    except Exception:
+        return False
+    return True
+
+
+def reset(connection):
+    """Roll back the transaction that `connection` is in, if any. Return
+    `False` if the connection is broken.
+
+    """
+
+    if connection.closed:
+        return False
+    if extensions is None:
+        return True
+    status = connection.get_transaction_status()
+    if status == extensions.TRANSACTION_STATUS_IDLE:
+        return True
+    if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+        return False
+    try:
+        connection.rollback()
+    except Exception:
+        return False
+    return connection.get_transaction_status() == \
+        extensions.TRANSACTION_STATUS_IDLE
@@ -0,0 +1,81 @@
+"""The PostgreSQL database backend, with health checks and pooling.
+
+This is Django's postgresql_psycopg2 backend with two additions, configured
+by extra keys in the database's settings (see `DATABASES` in settings.py):
+
+- `HEALTH_CHECKS`: before a persistent connection (see `CONN_MAX_AGE`) is
+  used in a new request, check that it still works, and reconnect if it does
+  not, rather than failing the request.
+- `POOL`: a dict with `SIZE`, `TIMEOUT` and `MAX_LIFETIME` (see
+  `coop.db.pool`). Connections are then checked out of a per-process pool
+  instead of being opened, and checked back in instead of being closed.
+
+"""
+
+from django.db.backends.postgresql_psycopg2.base import (
+    Database, DatabaseWrapper as PostgreSQLDatabaseWrapper)
+
+from coop.db import pool
+
+
+def connect(conn_params, isolation_level):
+    connection = Database.connect(**conn_params)
+    if isolation_level is not None:
+        connection.set_session(isolation_level=isolation_level)
+    return connection
+
+
+class DatabaseWrapper(PostgreSQLDatabaseWrapper):
+
+    def __init__(self, *args, **kwargs):
+        super(DatabaseWrapper, self).__init__(*args, **kwargs)
+        self.pool = None
+        self.health_check_due = False
+
+    def get_pool(self, conn_params):
+        """Return this process's pool of connections for `conn_params`, or
+        `None` if pooling is off.
+
+        """
+
+        options = self.settings_dict.get('POOL')
+        if not options:
+            return None
+        isolation_level = self.settings_dict['OPTIONS'].get('isolation_level')
+        key = (self.alias, tuple(sorted(conn_params.items())))
+        return pool.get_pool(key,
+            lambda: connect(conn_params, isolation_level),
+            options.get('SIZE', 1), options.get('TIMEOUT', 10),
+            options.get('MAX_LIFETIME'))
+
+    def get_new_connection(self, conn_params):
+        self.pool = self.get_pool(conn_params)
+        if self.pool is None:
+            return super(DatabaseWrapper, self).get_new_connection(
+                conn_params)
+        connection = self.pool.checkout()
+        self.isolation_level = self.settings_dict['OPTIONS'].get(
+            'isolation_level', connection.isolation_level)
+        return connection
+
+    def _close(self):
+        if self.connection is None or self.pool is None:
+            return super(DatabaseWrapper, self)._close()
+        # Django keeps its reference to a connection that is closed inside an
+        # atomic block, so that connection must not be handed out again.
+        with self.wrap_database_errors:
+            self.pool.checkin(self.connection, discard=self.in_atomic_block)
+
+    def close_if_unusable_or_obsolete(self):
+        super(DatabaseWrapper, self).close_if_unusable_or_obsolete()
+        if self.connection is not None and self.settings_dict.get(
+                'HEALTH_CHECKS'):
+            self.health_check_due = True
+
+    def ensure_connection(self):
+        if (self.health_check_due and self.connection is not None and
+                not self.in_atomic_block):
+            self.health_check_due = False
+            if not self.is_usable():
+                self.close()
+        super(DatabaseWrapper, self).ensure_connection()
@@ -0,0 +1,236 @@
+"""Thumbnails and previews of uploaded images and PDFs.
+
+Each stored upload (see coop/storage.py) can have two derivatives, PNG images
+bounded by the sizes in `SIZES`: a thumbnail for the file list and a preview
+for the file's page. Images are scaled with Pillow; PDFs have their first page
+rendered by `pdftoppm` (from Poppler), which is killed if it takes longer
+than `settings.DERIVATIVE_TIMEOUT` seconds. Without Pillow, only PDFs get
+derivatives; without `pdftoppm`, only images do.
+
+Derivatives are stored next to their upload (e.g., 3a/7f/3a7f....thumbnail.png)
+and, like uploads, are named by the hash of the upload's content, so they
+never change and can be cached by browsers forever. Building them takes too
+long to do within a request, so `request_derivatives` (called when a file is
+uploaded, and whenever a file without derivatives is displayed) queues the
+build on a small pool of worker threads. Until the derivatives exist, the
+templates show the file type's icon instead.
+
+"""
+
+import os
+import errno
+import signal
+import logging
+import tempfile
+import threading
+import subprocess
+import Queue
+from collections import OrderedDict
+from distutils.spawn import find_executable
+
+from django.conf import settings
+from django.core.urlresolvers import reverse
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+from coop.storage import upload_storage, get_content_hash, get_hash_name
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL = 'thumbnail'
+PREVIEW = 'preview'
+
+# Maps each kind of derivative to the size, in pixels, of the square that
+# its image fits into.
+SIZES = OrderedDict([
+    (THUMBNAIL, 160),
+    (PREVIEW, 800),
+])
+
+IMAGE_TYPES = ('image/gif', 'image/png', 'image/jpeg')
+PDF_TYPE = 'application/pdf'
+
+# Whether PDFs can be rendered.
+HAS_PDFTOPPM = find_executable('pdftoppm') is not None
+
+_queue = Queue.Queue()
+_queued = set()
+# The uploads whose derivatives could not be built, which are not retried
+# until the process restarts.
+_failed = set()
+_queued_lock = threading.Lock()
+_workers = []
+
+
+def can_derive(type_):
+    """Return `True` if derivatives can be made of files of MIME type
+    `type_`.
+
+    """
+
+    if type_ in IMAGE_TYPES:
+        return Image is not None
+    return type_ == PDF_TYPE and HAS_PDFTOPPM
+
+
+def get_derivative_path(content_hash, kind):
+    return '%s.%s.png' % (upload_storage.path(get_hash_name(content_hash)),
+        kind)
+
+
+def get_derivative_url(file, kind):
+    """Return the URL of the `kind` derivative of `file`, or `None` if it
+    does not exist (yet), in which case it is requested.
+
+    """
+
+    content_hash = get_content_hash(file.upload.name)
+    if not (content_hash and can_derive(file.type)):
+        return None
+    if not os.path.isfile(get_derivative_path(content_hash, kind)):
+        request_derivatives(content_hash, file.type)
+        return None
+    return reverse('coop:file_derivative', kwargs={
+        'content_hash': content_hash, 'kind': kind})
+
+
+def request_derivatives(content_hash, type_):
+    """Queue the building of the missing derivatives of the upload with
+    SHA-256 `content_hash` and MIME type `type_`, unless it is already
+    queued or failed before.
+
+    """
+
+    if not (content_hash and can_derive(type_)):
+        return
+    with _queued_lock:
+        if content_hash in _queued or content_hash in _failed:
+            return
+        _queued.add(content_hash)
+        start_workers()
+    _queue.put((content_hash, type_))
+
+
+def start_workers():
+    """Start the worker threads, if they are not running yet. The caller must
+    hold `_queued_lock`.
+
+    """
+
+    if _workers:
+        return
+    for index in range(getattr(settings, 'DERIVATIVE_WORKERS', 1)):
+        worker = threading.Thread(target=work,
+            name='coop-derivatives-%d' % index)
+        worker.daemon = True
+        worker.start()
+        _workers.append(worker)
+
+
+def work():
+    """Build the derivatives in the queue, one upload at a time, forever."""
+    while True:
+        content_hash, type_ = _queue.get()
+        try:
+            build(content_hash, type_)
+        except Exception:
+            logger.exception('Building the derivatives of %s failed.',
+                content_hash)
+            with _queued_lock:
+                _failed.add(content_hash)
+        finally:
+            with _queued_lock:
+                _queued.discard(content_hash)
+            _queue.task_done()
+
+
+def build(content_hash, type_):
+    """Make each missing derivative of the upload with SHA-256
+    `content_hash` and MIME type `type_` in a temporary file and rename it
+    into place, so that it is never served half-written.
+
+    """
+
+    source = upload_storage.path(get_hash_name(content_hash))
+    if not os.path.isfile(source):
+        return
+    for kind, size in SIZES.items():
+        path = get_derivative_path(content_hash, kind)
+        if os.path.isfile(path):
+            continue
+        fd, temp_path = tempfile.mkstemp(prefix='.%s-' % kind,
+            suffix='.png', dir=os.path.dirname(path))
+        os.close(fd)
+        try:
+            if type_ == PDF_TYPE:
+                render_pdf_page(source, temp_path, size)
+            else:
+                scale_image(source, temp_path, size)
+            os.chmod(temp_path, upload_storage.file_permissions_mode or
+                0o644)
+            os.rename(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+
+def scale_image(source, destination, size):
+    image = Image.open(source)
+    image.thumbnail((size, size), Image.ANTIALIAS)
+    if image.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+        image = image.convert('RGBA')
+    image.save(destination, 'PNG', optimize=True)
+
+
+def render_pdf_page(source, destination, size):
+    """Render the first page of the PDF at `source` as a PNG at
+    `destination`, scaled to fit a square of `size` pixels. `pdftoppm` is
+    killed after `settings.DERIVATIVE_TIMEOUT` seconds.
+
+    """
+
+    # pdftoppm adds the extension to the name it is given.
+    prefix = os.path.splitext(destination)[0]
+    # As with pdflatex (see coop.latex.run_pdflatex), pdftoppm runs in a
+    # process group of its own, which is killed as a whole.
+    process = subprocess.Popen(['pdftoppm', '-png', '-f', '1', '-l', '1',
+        '-singlefile', '-scale-to', str(size), source, prefix],
+        shell=False, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+        preexec_fn=os.setsid)
+    timed_out = []
+
+    def kill():
+        timed_out.append(True)
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+    timer = threading.Timer(getattr(settings, 'DERIVATIVE_TIMEOUT', 30), kill)
+    timer.start()
+    try:
+        output = process.communicate()[0]
+    finally:
+        timer.cancel()
+    if timed_out:
+        raise RuntimeError('pdftoppm timed out on %s' % source)
+    if process.returncode != 0:
+        raise RuntimeError('pdftoppm failed: %s' % output)
+    if '%s.png' % prefix != destination:
+        os.rename('%s.png' % prefix, destination)
+
+
+def delete_derivatives(name):
+    """Delete the derivatives of the stored upload called `name`."""
+    content_hash = get_content_hash(name)
+    if not content_hash:
+        return
+    for kind in SIZES:
+        try:
+            os.remove(get_derivative_path(content_hash, kind))
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
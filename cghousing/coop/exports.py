@@ -0,0 +1,286 @@
+"""Exports of the membership list that do not need LaTeX.
+
+The LaTeX membership list (see `get_latex_membership_doc` in coop/views.py)
+takes `pdflatex` seconds to build, in the background. The exports here are
+rendered from the same data, in Python, as the response is streamed:
+
+- pdf: a PDF with one table per block, made with `coop.pdfwriter`,
+- html: a web page, which prints with one block per page, and
+- csv: one row per unit.
+
+Each export is registered in `EXPORT_FORMATS` by `register_export`, under the
+name that selects it in the URL. Its `render` function takes the membership
+list that `get_membership_list` (in coop/views.py) returns, a dict with
+`coop_name`, `date`, `participation_chair` and `blocks`. Each block has a
+`number`, a `maintenance_rep`, a `roof_monitor` and `rows`, one per unit, with
+the unicode strings `unit`, `members`, `children`, `phone_numbers`,
+`committees` and `chairships` and the list `emails` of (address, first name)
+pairs (the first names are `None` if the unit shares one address). `render`
+returns an iterable of byte strings.
+
+"""
+
+import csv
+from collections import OrderedDict, namedtuple
+
+from django.utils.html import escape
+
+from coop import pdfwriter
+from coop.pdfwriter import PdfWriter, Canvas, wrap, text_width, BOLD
+
+Export = namedtuple('Export', 'content_type extension attachment render')
+
+# Maps the names of the export formats to `Export`s.
+EXPORT_FORMATS = OrderedDict()
+
+
+def register_export(name, content_type, extension, render, attachment=False):
+    """Make `render` available as the export format `name`. Its output has
+    the MIME type `content_type`; it is downloaded as a file with the
+    extension `extension`, instead of being displayed, if `attachment` is
+    true.
+
+    """
+
+    EXPORT_FORMATS[name] = Export(content_type, extension, attachment, render)
+
+
+def get_export(name):
+    """Return the `Export` registered as `name`, or `None`."""
+    return EXPORT_FORMATS.get(name)
+
+
+def format_emails(emails):
+    return u', '.join(u'%s (%s)' % (address, first_name) if first_name else
+        address for address, first_name in emails)
+
+
+################################################################################
+# PDF
+################################################################################
+
+PDF_PAGE_SIZE = pdfwriter.A4_LANDSCAPE
+PDF_MARGIN = 36
+PDF_TITLE_SIZE = 14
+PDF_FONT_SIZE = 8
+PDF_LEADING = 10
+PDF_PADDING = 3
+
+# The columns of the table of units: headings and fractions of its width.
+PDF_COLUMNS = (
+    (u'UNIT #', 0.06),
+    (u'MEMBERS', 0.19),
+    (u'CHILDREN', 0.11),
+    (u'PHONE #', 0.18),
+    (u'E-MAIL ADDRESS', 0.20),
+    (u'COMMITTEE', 0.16),
+    (u'CHAIR', 0.10)
+)
+
+
+def get_row_cells(row):
+    return (row['unit'], row['members'], row['children'],
+        row['phone_numbers'], format_emails(row['emails']),
+        row['committees'], row['chairships'])
+
+
+def render_pdf(membership_list):
+    writer = PdfWriter(PDF_PAGE_SIZE)
+    yield writer.start()
+    for block in membership_list['blocks']:
+        for canvas in draw_block(membership_list, block):
+            yield writer.page(canvas)
+    yield writer.finish()
+
+
+def draw_block(membership_list, block):
+    """Draw the table of units of `block`, breaking it across pages as need
+    be, and the block's representatives beneath it. Yield each page's
+    `Canvas` as it is filled.
+
+    """
+
+    page_width, page_height = PDF_PAGE_SIZE
+    table_width = page_width - 2 * PDF_MARGIN
+    widths = [table_width * fraction for _, fraction in PDF_COLUMNS]
+    headings = [heading for heading, _ in PDF_COLUMNS]
+    canvas = Canvas()
+    top = draw_block_heading(canvas, membership_list, block)
+    top = draw_row(canvas, top, [[heading] for heading in headings], widths,
+        BOLD)
+    for row in block['rows']:
+        cells = [wrap(text, width - 2 * PDF_PADDING, PDF_FONT_SIZE) for
+            text, width in zip(get_row_cells(row), widths)]
+        if top - get_row_height(cells) < PDF_MARGIN:
+            yield canvas
+            canvas = Canvas()
+            top = draw_block_heading(canvas, membership_list, block)
+            top = draw_row(canvas, top, [[heading] for heading in headings],
+                widths, BOLD)
+        top = draw_row(canvas, top, cells, widths)
+    footer = (
+        (u'MAINTENANCE FOR BLOCK %s:' % block['number'],
+            block['maintenance_rep']),
+        (u'ROOF MONITOR FOR BLOCK %s:' % block['number'],
+            block['roof_monitor']),
+        (u'***To make changes to this list or submit excuse notes (i.e.,'
+            u' missing a meeting), please contact:***', None),
+        (u'PARTICIPATION COMMITTEE:', membership_list['participation_chair'])
+    )
+    top -= 2 * PDF_LEADING
+    if top - len(footer) * PDF_LEADING < PDF_MARGIN:
+        yield canvas
+        canvas = Canvas()
+        top = draw_block_heading(canvas, membership_list, block)
+    for label, value in footer:
+        top -= PDF_LEADING
+        canvas.text(PDF_MARGIN, top, label, PDF_FONT_SIZE, BOLD)
+        if value is not None:
+            canvas.text(PDF_MARGIN + 150, top, value, PDF_FONT_SIZE)
+    yield canvas
+
+
+def draw_block_heading(canvas, membership_list, block):
+    """Draw the title and date at the top of a page of `block`. Return the
+    height beneath them.
+
+    """
+
+    page_width, page_height = PDF_PAGE_SIZE
+    top = page_height - PDF_MARGIN
+    for title in (u'%s Membership List' % membership_list['coop_name'],
+            u'Block: %s' % block['number']):
+        top -= PDF_TITLE_SIZE + 2
+        canvas.text((page_width - text_width(title, PDF_TITLE_SIZE, BOLD)) / 2,
+            top, title, PDF_TITLE_SIZE, BOLD)
+    top -= PDF_LEADING + 4
+    date = membership_list['date']
+    canvas.text(page_width - PDF_MARGIN - text_width(date, PDF_FONT_SIZE),
+        top, date, PDF_FONT_SIZE)
+    return top - 6
+
+
+def get_row_height(cells):
+    return max(len(lines) for lines in cells) * PDF_LEADING + 2 * PDF_PADDING
+
+
+def draw_row(canvas, top, cells, widths, font=pdfwriter.REGULAR):
+    """Draw a row of the table whose top is at `top`; `cells` are lists of
+    lines. Return the height of the row's bottom.
+
+    """
+
+    height = get_row_height(cells)
+    x = PDF_MARGIN
+    for lines, width in zip(cells, widths):
+        canvas.rect(x, top - height, width, height)
+        for index, line in enumerate(lines):
+            canvas.text(x + PDF_PADDING,
+                top - PDF_PADDING - PDF_FONT_SIZE - index * PDF_LEADING, line,
+                PDF_FONT_SIZE, font)
+        x += width
+    return top - height
+
+
+register_export('pdf', 'application/pdf', 'pdf', render_pdf)
+
+
+################################################################################
+# HTML
+################################################################################
+
+HTML_HEAD = u'''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>%s Membership List</title>
+<style>
+body { font-family: Helvetica, Arial, sans-serif; font-size: 10pt; }
+h1 { font-size: 14pt; text-align: center; }
+.date { text-align: right; font-size: 8pt; }
+table { border-collapse: collapse; width: 100%%; }
+th, td { border: 1px solid #000; padding: 3px; text-align: left;
+  vertical-align: top; }
+.committees { font-variant: small-caps; font-size: 8pt; }
+.block { page-break-after: always; }
+.representatives { font-weight: bold; font-size: 8pt; }
+</style>
+</head>
+<body>
+'''
+
+HTML_TABLE_HEAD = u'''<thead><tr><th>Unit #</th><th>Members</th>\
+<th>Children</th><th>Phone #</th><th>E-mail Address</th><th>Committee</th>\
+<th>Chair</th></tr></thead>'''
+
+
+def format_html_emails(emails):
+    return u', '.join(
+        u'<a href="mailto:%s">%s</a>%s' % (escape(address), escape(address),
+            u' (%s)' % escape(first_name) if first_name else u'')
+        for address, first_name in emails)
+
+
+def render_html(membership_list):
+    yield (HTML_HEAD % escape(membership_list['coop_name'])).encode('utf8')
+    participation_chair = escape(membership_list['participation_chair'])
+    for block in membership_list['blocks']:
+        parts = [
+            u'<div class="block">\n<h1>%s Membership List<br>Block: %s</h1>'
+                % (escape(membership_list['coop_name']), block['number']),
+            u'<p class="date">%s</p>' % escape(membership_list['date']),
+            u'<table>%s<tbody>' % HTML_TABLE_HEAD
+        ]
+        for row in block['rows']:
+            parts.append(u'<tr><td>%s</td><td>%s</td><td>%s</td><td>%s</td>'
+                u'<td>%s</td><td class="committees">%s</td>'
+                u'<td class="committees">%s</td></tr>' % (
+                    escape(row['unit']), escape(row['members']),
+                    escape(row['children']), escape(row['phone_numbers']),
+                    format_html_emails(row['emails']),
+                    escape(row['committees']), escape(row['chairships'])))
+        parts.append(u'</tbody></table>')
+        parts.append(u'<p class="representatives">MAINTENANCE FOR BLOCK %s:'
+            u' <u>%s</u><br>ROOF MONITOR FOR BLOCK %s: <u>%s</u></p>' % (
+                block['number'], escape(block['maintenance_rep']),
+                block['number'], escape(block['roof_monitor'])))
+        parts.append(u'<p class="representatives">***To make changes to this'
+            u' list or submit excuse notes (i.e., missing a meeting), please'
+            u' contact:***<br>PARTICIPATION COMMITTEE: <u>%s</u></p>\n</div>\n'
+            % participation_chair)
+        yield u'\n'.join(parts).encode('utf8')
+    yield b'</body>\n</html>\n'
+
+
+register_export('html', 'text/html; charset=utf-8', 'html', render_html)
+
+
+################################################################################
+# CSV
+################################################################################
+
+CSV_HEADER = ('Block #', 'Unit #', 'Members', 'Children', 'Phone #',
+    'E-mail Address', 'Committee', 'Chair')
+
+
+class Echo(object):
+    """A file-like object that returns what is written to it, so that a
+    `csv.writer` can be made to produce one row at a time.
+
+    """
+
+    def write(self, value):
+        return value
+
+
+def render_csv(membership_list):
+    writer = csv.writer(Echo())
+    yield writer.writerow(CSV_HEADER)
+    for block in membership_list['blocks']:
+        for row in block['rows']:
+            yield writer.writerow([unicode(block['number']).encode('utf8')] +
+                [cell.encode('utf8') for cell in get_row_cells(row)])
+
+
+register_export('csv', 'text/csv; charset=utf-8', 'csv', render_csv,
+    attachment=True)
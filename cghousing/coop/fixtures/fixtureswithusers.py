@@ -84,44 +84,48 @@ def name2url(name):
     url = url.replace(' ','-').lower()
     return url
 
-member_ids = []
-users = []
-committees = []
-forums = []
-new_fixtures = []
-coop_committee_fixture = None
-
-# Loop through the fixtures, creating new ones and storing information.
-fixtures = json.load(open(fixtures_path, 'rb'))
-for fixture in fixtures:
-
-    # Create auth.user fixtures and store the pks of the members.
-    if fixture['model'] == 'coop.person' and fixture['fields']['member']:
-        fixture['fields']['user'] = memberid2userid(fixture['pk'])
-        users.append(generate_user(fixture))
-        member_ids.append(fixture['pk'])
-
-    if fixture['model'] == 'coop.forum':
-        fixture['fields']['url_name'] = name2url(fixture['fields']['name'])
-
-    # Get the Coop Committee fixture.
-    if fixture['model'] == 'coop.committee':
-        if fixture.get('fields', {}).get('name') == u'Co-op':
-            coop_committee_fixture = fixture
+def main():
+    member_ids = []
+    users = []
+    committees = []
+    forums = []
+    new_fixtures = []
+    coop_committee_fixture = None
+
+    # Loop through the fixtures, creating new ones and storing information.
+    fixtures = json.load(open(fixtures_path, 'rb'))
+    for fixture in fixtures:
+
+        # Create auth.user fixtures and store the pks of the members.
+        if fixture['model'] == 'coop.person' and fixture['fields']['member']:
+            fixture['fields']['user'] = memberid2userid(fixture['pk'])
+            users.append(generate_user(fixture))
+            member_ids.append(fixture['pk'])
+
+        if fixture['model'] == 'coop.forum':
+            fixture['fields']['url_name'] = name2url(fixture['fields']['name'])
+
+        # Get the Coop Committee fixture.
+        if fixture['model'] == 'coop.committee':
+            if fixture.get('fields', {}).get('name') == u'Co-op':
+                coop_committee_fixture = fixture
+            else:
+                new_fixtures.append(fixture)
+                forums.append(committee2forum(fixture))
         else:
             new_fixtures.append(fixture)
-            forums.append(committee2forum(fixture))
-    else:
-        new_fixtures.append(fixture)
 
 
-# All co-op members are members of the "Co-op Committee"
-coop_committee_fixture['fields']['members'] = member_ids
+    # All co-op members are members of the "Co-op Committee"
+    coop_committee_fixture['fields']['members'] = member_ids
 
-new_fixtures = forums + \
-    [generate_superuser(), coop_committee_fixture] + \
-    users + \
-    new_fixtures
+    new_fixtures = forums + \
+        [generate_superuser(), coop_committee_fixture] + \
+        users + \
+        new_fixtures
 
-json.dump(new_fixtures, open(new_fixtures_path, 'wb'), indent=2)
+    json.dump(new_fixtures, open(new_fixtures_path, 'wb'), indent=2)
 
+
+if __name__ == '__main__':
+    main()
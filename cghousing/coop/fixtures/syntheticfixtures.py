@@ -0,0 +1,286 @@
+"""Generate a large, synthetic but realistic set of fixtures: units full of
+members (with users, phone numbers and children), committees with forums,
+threads and posts, block representatives, pages and years of monthly
+participation requirements.
+
+The benchmark suite in coop/tests.py loads these directly. To write them to
+disk for `manage.py loaddata`, run:
+
+    $ python coop/fixtures/syntheticfixtures.py [small|large] [seed]
+
+which creates ./fixtures_synthetic_<scale>.json. Afterwards, run the
+`rebuild_forum_stats`, `render_markdown` and `rebuild_search_index` management
+commands, since loading fixtures bypasses `save`.
+
+"""
+
+import os
+import sys
+import json
+import random
+import datetime
+
+# When this is run as a script, the project directory must be importable.
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+if PROJECT_DIR not in sys.path:
+    sys.path.insert(0, PROJECT_DIR)
+
+from coop.fixtures.fixtureswithusers import (this_path, generate_user,
+    generate_superuser, committee2forum, memberid2userid, name2url)
+
+# The number of objects of each kind to generate. "large" approximates a big
+# co-op with a busy forum; "small" is quick enough to load on every test run.
+SCALES = {
+    'small': {
+        'blocks': 4,
+        'units_per_block': 10,
+        'max_members_per_unit': 3,
+        'max_children_per_unit': 3,
+        'threads_per_forum': 12,
+        'max_posts_per_thread': 12,
+        'years': 2
+    },
+    'large': {
+        'blocks': 12,
+        'units_per_block': 25,
+        'max_members_per_unit': 6,
+        'max_children_per_unit': 5,
+        'threads_per_forum': 100,
+        'max_posts_per_thread': 60,
+        'years': 6
+    }
+}
+
+COMMITTEE_NAMES = [u'Finance', u'Maintenance', u'Grounds', u'Membership',
+    u'Participation', u'Social', u'Newsletter', u'Pets', u'Security',
+    u'Landscaping', u'Board of Directors']
+
+WORDS = (u'co-op meeting garden roof repair budget fees members unit block'
+    u' committee agenda minutes volunteer parking laundry cleanup fall spring'
+    u' pets children playground paint fence plumbing notice vote proposal'
+    u' schedule maintenance inspection quote contractor').split()
+
+# The date that the generated data leads up to, so that runs are repeatable.
+END_DATE = datetime.datetime(2016, 6, 1, 12, 0)
+
+
+def read_names(filename, count, rng):
+    """Return `count` distinct names drawn from one of the census name files
+    in this directory.
+
+    """
+
+    with open(os.path.join(this_path, filename)) as f:
+        names = [line.split()[0].title() for line in f if line.strip()]
+    return rng.sample(names, count)
+
+
+def get_sentence(rng, min_words=4, max_words=14):
+    words = [rng.choice(WORDS) for _ in range(rng.randint(min_words,
+        max_words))]
+    return u' '.join(words).capitalize()
+
+
+def get_paragraphs(rng, max_paragraphs=3):
+    return u'\n\n'.join(
+        u'. '.join(get_sentence(rng) for _ in range(rng.randint(1, 4))) + u'.'
+        for _ in range(rng.randint(1, max_paragraphs)))
+
+
+def get_timestamp(when):
+    return when.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def fixture(model, pk, **fields):
+    return {'model': model, 'pk': pk, 'fields': fields}
+
+
+def generate_fixtures(scale='small', seed=0):
+    """Return a list of fixtures (dicts in Django's serialization format) of
+    the size given by `scale`, a key of `SCALES`. The same `seed` always
+    yields the same fixtures.
+
+    """
+
+    config = SCALES[scale]
+    rng = random.Random(seed)
+    blocks = [1701 + 2 * index for index in range(config['blocks'])]
+    unit_count = len(blocks) * config['units_per_block']
+    last_names = read_names('names_last.txt', unit_count, rng)
+    first_names = (read_names('names_female_first.txt', 1000, rng) +
+        read_names('names_male_first.txt', 1000, rng))
+
+    units = []
+    persons = []
+    users = []
+    phone_numbers = []
+    member_ids = []
+    for block in blocks:
+        for unit_number in range(101, 101 + config['units_per_block']):
+            unit = fixture('coop.unit', len(units) + 1, block_number=block,
+                unit_number=unit_number, bedrooms=rng.randint(1, 4),
+                bathrooms=rng.randint(1, 2),
+                page_content=get_paragraphs(rng, 1))
+            units.append(unit)
+            last_name = last_names[len(units) - 1]
+            names = rng.sample(first_names, config['max_members_per_unit'] +
+                config['max_children_per_unit'])
+            home_phone = None
+            if rng.random() < 0.5:
+                home_phone = fixture('coop.phonenumber',
+                    len(phone_numbers) + 1, phone_type=u'home',
+                    number=u'604-%03d-%04d' % (rng.randint(200, 999),
+                        rng.randint(0, 9999)))
+                phone_numbers.append(home_phone)
+            children = []
+            for _ in range(rng.randint(0, config['max_children_per_unit'])):
+                child = fixture('coop.person', len(persons) + 1,
+                    first_name=names.pop(), last_name=last_name,
+                    email=u'', member=False, unit=unit['pk'], children=[],
+                    phone_numbers=[])
+                persons.append(child)
+                children.append(child['pk'])
+            for _ in range(rng.randint(1, config['max_members_per_unit'])):
+                first_name = names.pop()
+                phones = [home_phone['pk']] if home_phone else []
+                if rng.random() < 0.8:
+                    cell_phone = fixture('coop.phonenumber',
+                        len(phone_numbers) + 1, phone_type=u'cell',
+                        number=u'778-%03d-%04d' % (rng.randint(200, 999),
+                            rng.randint(0, 9999)))
+                    phone_numbers.append(cell_phone)
+                    phones.append(cell_phone['pk'])
+                member = fixture('coop.person', len(persons) + 1,
+                    first_name=first_name, last_name=last_name,
+                    email=u'%s.%s@example.com' % (first_name.lower(),
+                        last_name.lower()),
+                    member=True, unit=unit['pk'], children=children,
+                    phone_numbers=phones,
+                    committee_excused=rng.random() < 0.03,
+                    user=memberid2userid(len(persons) + 1),
+                    page_content=get_paragraphs(rng, 1))
+                persons.append(member)
+                users.append(generate_user(member))
+                member_ids.append(member['pk'])
+
+    # The superuser ("a", with password "a") gets the first user id after
+    # those of the members.
+    superuser = generate_superuser()
+    superuser['pk'] = memberid2userid(len(persons) + 1)
+    users.append(superuser)
+
+    forums = []
+    committees = []
+    for name in COMMITTEE_NAMES:
+        committee = fixture('coop.committee', len(committees) + 1, name=name,
+            url_name=name2url(name), description=get_sentence(rng),
+            page_content=get_paragraphs(rng),
+            members=sorted(rng.sample(member_ids,
+                rng.randint(5, max(5, len(member_ids) // 8)))))
+        committee['fields']['chair'] = rng.choice(
+            committee['fields']['members'])
+        forum = committee2forum(committee)
+        committee['fields']['forum'] = forum['pk']
+        committees.append(committee)
+        forums.append(forum)
+    forums.append(fixture('coop.forum', len(forums) + 1,
+        name=u'General Discussion', url_name=u'general-discussion',
+        description=u'Forum for all co-op members'))
+    committees.append(fixture('coop.committee', len(committees) + 1,
+        name=u'Co-op', url_name=u'co-op', chair=None, members=member_ids,
+        description=u'This is the committee that all members belong to.'))
+
+    block_representatives = []
+    for block in blocks:
+        for role, committee in ((u'maintenance', 2), (u'roof monitor', 2)):
+            block_representatives.append(fixture('coop.blockrepresentative',
+                len(block_representatives) + 1, block_number=block,
+                role=role, committee=committee,
+                person=rng.choice(member_ids)))
+
+    threads = []
+    posts = []
+    start = END_DATE - datetime.timedelta(days=365 * config['years'])
+    span = (END_DATE - start).total_seconds()
+    user_ids = [user['pk'] for user in users]
+    for forum in forums:
+        for _ in range(config['threads_per_forum']):
+            created = start + datetime.timedelta(
+                seconds=rng.random() * span * 0.95)
+            subject = get_sentence(rng, 2, 6)
+            thread = fixture('coop.thread', len(threads) + 1,
+                subject=subject, forum=forum['pk'],
+                url_subject=u'%s-%d' % (name2url(subject), len(threads) + 1),
+                views=rng.randint(0, 500), creator=rng.choice(user_ids),
+                datetime_created=get_timestamp(created),
+                datetime_modified=get_timestamp(created),
+                last_activity_at=get_timestamp(created))
+            threads.append(thread)
+            thread_post_ids = []
+            when = created
+            for _ in range(rng.randint(1, config['max_posts_per_thread'])):
+                post = fixture('coop.post', len(posts) + 1, subject=subject,
+                    post=get_paragraphs(rng), thread=thread['pk'],
+                    reply_to=(rng.choice(thread_post_ids)
+                        if thread_post_ids else None),
+                    creator=rng.choice(user_ids),
+                    datetime_created=get_timestamp(when),
+                    datetime_modified=get_timestamp(when))
+                posts.append(post)
+                thread_post_ids.append(post['pk'])
+                when += datetime.timedelta(hours=rng.randint(1, 72))
+
+    pages = [
+        fixture('coop.page', 1, title=u'Welcome', url_title=u'welcome',
+            content=u'# Welcome\n\n%s' % get_paragraphs(rng), public=True,
+            trusted=True),
+        fixture('coop.page', 2, title=u'About Us', url_title=u'about-us',
+            content=get_paragraphs(rng), public=True),
+        fixture('coop.page', 3, title=u'Rules', url_title=u'rules',
+            content=get_paragraphs(rng), public=False),
+        fixture('coop.page', 4, title=u'Minutes', url_title=u'minutes',
+            content=get_paragraphs(rng), public=False),
+        fixture('coop.page', 5, title=u'Help', url_title=u'help',
+            content=get_paragraphs(rng), public=False)
+    ]
+    application_settings = fixture('coop.applicationsettings', 1,
+        coop_name=u'Synthetic Co-op', news=get_paragraphs(rng), home_page=1,
+        public_pages=u'[1, 2]', member_pages=u'[]')
+
+    participation_requirements = []
+    month = datetime.date(start.year, start.month, 1)
+    while month < END_DATE.date():
+        fulfillers = []
+        shirkers = []
+        excusees = []
+        for member_id in member_ids:
+            roll = rng.random()
+            if roll < 0.7:
+                fulfillers.append(member_id)
+            elif roll < 0.85:
+                shirkers.append(member_id)
+            elif roll < 0.95:
+                excusees.append(member_id)
+        participation_requirements.append(fixture(
+            'coop.participationrequirement',
+            len(participation_requirements) + 1,
+            name=u'Members\' meeting, %s' % month.strftime('%B %Y'),
+            description=get_sentence(rng), date=month.isoformat(),
+            fulfillers=fulfillers, shirkers=shirkers, excusees=excusees))
+        month = (month + datetime.timedelta(days=32)).replace(day=1)
+
+    return (users + forums + units + phone_numbers + persons + committees +
+        block_representatives + threads + posts + pages +
+        [application_settings] + participation_requirements)
+
+
+def main():
+    scale = sys.argv[1] if len(sys.argv) > 1 else 'small'
+    seed = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+    path = os.path.join(this_path, 'fixtures_synthetic_%s.json' % scale)
+    json.dump(generate_fixtures(scale, seed), open(path, 'wb'), indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+"""Per-request performance instrumentation.
+
+When `settings.REQUEST_INSTRUMENTATION` is true, `RequestInstrumentationMiddleware`
+records, for each request:
+
+- the number of SQL queries and the total time that the database reported
+  for them,
+- the time spent rendering templates, and
+- the wall time,
+
+tagged by the URL name of the view (e.g., "coop:units"). Each request is
+logged to the `coop` logger, and the figures are aggregated per URL name
+(in this process) for `request_stats_view`.
+
+`settings.QUERY_BUDGETS` maps URL names to the maximum number of queries that
+the view should issue; `settings.DEFAULT_QUERY_BUDGET` applies to the other
+views. A request that goes over its budget is logged as a warning.
+
+The statistics also count the database connections that Django opened, per
+database alias, and include the checkouts, waits, timeouts and connection
+creations of this process's connection pools, if any (see `coop.db.pool`).
+
+"""
+
+import os
+import time
+import logging
+import threading
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.template.base import Template
+
+from coop.db import pool
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+_stats = {}
+_connects = {}
+_stats_lock = threading.Lock()
+_started_at = time.time()
+
+
+################################################################################
+# Template Render Timing
+################################################################################
+
+_original_template_render = Template.render
+
+
+def timed_template_render(self, context):
+    """Replacement for `Template.render` that adds the time spent rendering
+    the outermost template (which includes its parents and includes) to the
+    current request's total.
+
+    """
+
+    if not getattr(_local, 'active', False) or _local.template_depth:
+        return _original_template_render(self, context)
+    _local.template_depth += 1
+    start = time.time()
+    try:
+        return _original_template_render(self, context)
+    finally:
+        _local.template_time += time.time() - start
+        _local.template_depth -= 1
+
+
+def patch_template_render():
+    if Template.render is not timed_template_render:
+        Template.render = timed_template_render
+
+
+################################################################################
+# Middleware
+################################################################################
+
+class RequestInstrumentationMiddleware(object):
+    """Record query counts and timings for each request. This should be the
+    first middleware in `MIDDLEWARE_CLASSES`, so that it measures all of the
+    others as well.
+
+    """
+
+    def __init__(self):
+        if not getattr(settings, 'REQUEST_INSTRUMENTATION', False):
+            raise MiddlewareNotUsed
+        patch_template_render()
+        connection_created.connect(count_connect,
+            dispatch_uid='coop.instrumentation.count_connect')
+
+    def process_request(self, request):
+        debug_cursors = {}
+        query_offsets = {}
+        for connection in connections.all():
+            debug_cursors[connection.alias] = connection.use_debug_cursor
+            connection.use_debug_cursor = True
+            query_offsets[connection.alias] = len(connection.queries)
+        request._instrumentation = (time.time(), debug_cursors, query_offsets)
+        _local.active = True
+        _local.template_depth = 0
+        _local.template_time = 0.0
+
+    def process_response(self, request, response):
+        try:
+            start, debug_cursors, query_offsets = request._instrumentation
+        except AttributeError:
+            return response
+        del request._instrumentation
+        wall_time = time.time() - start
+        query_count = 0
+        sql_time = 0.0
+        for connection in connections.all():
+            queries = connection.queries[query_offsets.get(connection.alias,
+                0):]
+            query_count += len(queries)
+            sql_time += sum(float(q.get('time') or 0) for q in queries)
+            connection.use_debug_cursor = debug_cursors.get(connection.alias,
+                False)
+        template_time = getattr(_local, 'template_time', 0.0)
+        _local.active = False
+        resolver_match = getattr(request, 'resolver_match', None)
+        view_name = (resolver_match and resolver_match.view_name) or \
+            'unresolved'
+        record(view_name, query_count, sql_time, template_time, wall_time)
+        logger.info('%s %s [%s] %d: %d queries, %.1f ms SQL, %.1f ms'
+            ' templates, %.1f ms total', request.method, request.path,
+            view_name, response.status_code, query_count, sql_time * 1000,
+            template_time * 1000, wall_time * 1000)
+        budget = get_query_budget(view_name)
+        if budget is not None and query_count > budget:
+            logger.warning('%s [%s] issued %d queries, which exceeds its'
+                ' budget of %d.', request.path, view_name, query_count, budget)
+        return response
+
+
+def get_query_budget(view_name):
+    budgets = getattr(settings, 'QUERY_BUDGETS', {})
+    return budgets.get(view_name, getattr(settings, 'DEFAULT_QUERY_BUDGET',
+        None))
+
+
+################################################################################
+# Aggregated Statistics
+################################################################################
+
+def record(view_name, query_count, sql_time, template_time, wall_time):
+    with _stats_lock:
+        stats = _stats.get(view_name)
+        if stats is None:
+            stats = _stats[view_name] = {
+                'requests': 0,
+                'queries': 0,
+                'max_queries': 0,
+                'sql_time': 0.0,
+                'template_time': 0.0,
+                'wall_time': 0.0,
+                'max_wall_time': 0.0,
+                'over_budget': 0
+            }
+        stats['requests'] += 1
+        stats['queries'] += query_count
+        stats['max_queries'] = max(stats['max_queries'], query_count)
+        stats['sql_time'] += sql_time
+        stats['template_time'] += template_time
+        stats['wall_time'] += wall_time
+        stats['max_wall_time'] = max(stats['max_wall_time'], wall_time)
+        budget = get_query_budget(view_name)
+        if budget is not None and query_count > budget:
+            stats['over_budget'] += 1
+
+
+def count_connect(sender, connection, **kwargs):
+    """Count a connection (or, with pooling, a checkout) made by Django."""
+    with _stats_lock:
+        _connects[connection.alias] = _connects.get(connection.alias, 0) + 1
+
+
+def get_stats():
+    """Return a dict summarizing the requests that this process has served
+    since it started, with per-view averages. Times are in milliseconds.
+
+    """
+
+    views = {}
+    with _stats_lock:
+        for view_name, stats in _stats.items():
+            requests = stats['requests']
+            views[view_name] = {
+                'requests': requests,
+                'query_budget': get_query_budget(view_name),
+                'over_budget': stats['over_budget'],
+                'avg_queries': float(stats['queries']) / requests,
+                'max_queries': stats['max_queries'],
+                'avg_sql_ms': stats['sql_time'] * 1000 / requests,
+                'avg_template_ms': stats['template_time'] * 1000 / requests,
+                'avg_wall_ms': stats['wall_time'] * 1000 / requests,
+                'max_wall_ms': stats['max_wall_time'] * 1000
+            }
+        db_connects = dict(_connects)
+    return {
+        'pid': os.getpid(),
+        'since': _started_at,
+        'enabled': getattr(settings, 'REQUEST_INSTRUMENTATION', False),
+        'views': views,
+        'db_connects': db_connects,
+        'db_pools': pool.get_all_stats()
+    }
+
+
+def reset_stats():
+    with _stats_lock:
+        _stats.clear()
+        _connects.clear()
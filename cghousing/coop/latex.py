@@ -0,0 +1,263 @@
+"""Running `pdflatex`, with a precompiled preamble.
+
+Much of the time that `pdflatex` takes to typeset a short document goes into
+starting up and loading the packages of its preamble, which (as in the
+membership list) is the same every time. So `compile_pdf` splits the source
+in two:
+
+- the part of the preamble that can be precompiled: everything up to the
+  loading of hyperref (which must be loaded at run time) or the start of the
+  document, and
+- the rest.
+
+The first part is dumped, once, into a format file (see `get_format`) named by
+its hash and kept in `settings.LATEX_FORMATS_PATH`. Every later run loads that
+format (with -fmt) and is only given the rest. If the format cannot be dumped
+or loaded (e.g., because TeX was upgraded since it was dumped), the whole
+source is compiled the ordinary way.
+
+Each run of `pdflatex` is killed if it takes longer than
+`settings.PDF_BUILD_TIMEOUT` seconds. When a run fails, the end of its .log
+file (or, failing that, its output) is logged.
+
+"""
+
+import os
+import re
+import shutil
+import signal
+import hashlib
+import logging
+import tempfile
+import threading
+import subprocess
+
+from django.conf import settings
+
+from coop.storage import makedirs
+
+logger = logging.getLogger(__name__)
+
+# How many lines at the end of a failed run's .log file are logged.
+LOG_TAIL_LINES = 60
+
+# How many format files are kept; the least recently used go first.
+MAX_FORMATS = 3
+
+# A complete PDF ends with this marker (give or take some whitespace).
+PDF_EOF = b'%%EOF'
+
+# The end of the part of a preamble that can be precompiled.
+preamble_end_regex = re.compile(
+    r'^[ \t]*\\usepackage(\[[^\]]*\])?\{hyperref\}|^[ \t]*\\begin\{document\}',
+    re.M)
+
+_formats_lock = threading.Lock()
+# The formats that could not be dumped, which are not tried again until the
+# process restarts.
+_failed_formats = set()
+
+
+def get_formats_dir():
+    return getattr(settings, 'LATEX_FORMATS_PATH', os.path.join('latex',
+        'formats'))
+
+
+def run_pdflatex(args, cwd, env=None):
+    """Run `pdflatex` with the arguments `args` in the directory `cwd`,
+    killing it after `settings.PDF_BUILD_TIMEOUT` seconds. Return a 3-tuple:
+    its exit status (negative if it was killed), its output and whether it
+    timed out.
+
+    """
+
+    # pdflatex runs in a process group of its own, so that the helpers that
+    # it may start (e.g., mktexpk) are killed along with it.
+    process = subprocess.Popen(['pdflatex'] + args, shell=False,
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT, cwd=cwd, env=env, preexec_fn=os.setsid)
+    timed_out = []
+
+    def kill():
+        timed_out.append(True)
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+    timer = threading.Timer(getattr(settings, 'PDF_BUILD_TIMEOUT', 120), kill)
+    timer.start()
+    try:
+        output = process.communicate(b'')[0]
+    finally:
+        timer.cancel()
+    return process.returncode, output, bool(timed_out)
+
+
+def split_preamble(source):
+    """Return a 2-tuple: the part of the preamble of the LaTeX `source` that
+    can be precompiled and the rest of `source`. The first is `None` if
+    `source` has no such part.
+
+    """
+
+    match = preamble_end_regex.search(source)
+    if not match or b'\\documentclass' not in source[:match.start()]:
+        return None, source
+    return source[:match.start()], source[match.start():]
+
+
+def get_format_path(format_name):
+    return os.path.join(get_formats_dir(), '%s.fmt' % format_name)
+
+
+def get_format(preamble):
+    """Return the name of the format that has `preamble` precompiled, dumping
+    it first if need be, or `None` if it cannot be dumped.
+
+    """
+
+    format_name = 'preamble-%s' % hashlib.sha1(preamble).hexdigest()[:16]
+    path = get_format_path(format_name)
+    with _formats_lock:
+        if os.path.isfile(path):
+            try:
+                os.utime(path, None)
+            except OSError:
+                pass
+            return format_name
+        if format_name in _failed_formats:
+            return None
+        formats_dir = get_formats_dir()
+        makedirs(formats_dir)
+        scratch_dir = tempfile.mkdtemp(prefix='.dump-', dir=formats_dir)
+        try:
+            with open(os.path.join(scratch_dir, 'preamble.tex'), 'wb') as f:
+                f.write(preamble)
+                f.write(b'\n\\dump\n')
+            returncode, output, timed_out = run_pdflatex(['-ini',
+                '-interaction=nonstopmode', '-jobname=%s' % format_name,
+                '&pdflatex', 'preamble.tex'], scratch_dir)
+            dumped_path = os.path.join(scratch_dir, '%s.fmt' % format_name)
+            if returncode != 0 or not os.path.isfile(dumped_path):
+                logger.error('Could not precompile the preamble %s (exit'
+                    ' status %s):\n%s', format_name, returncode,
+                    read_log(scratch_dir, format_name) or output)
+                _failed_formats.add(format_name)
+                return None
+            os.rename(dumped_path, path)
+        finally:
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+        remove_old_formats(formats_dir)
+        return format_name
+
+
+def remove_old_formats(formats_dir):
+    """Delete all but the `MAX_FORMATS` most recently used formats."""
+    formats = []
+    for name in os.listdir(formats_dir):
+        if name.endswith('.fmt'):
+            path = os.path.join(formats_dir, name)
+            try:
+                formats.append((os.path.getmtime(path), path))
+            except OSError:
+                pass
+    for _, path in sorted(formats, reverse=True)[MAX_FORMATS:]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def compile_pdf(source, directory, jobname, precompiled=True):
+    """Typeset the LaTeX `source` into `directory`/`jobname`.pdf, with the
+    precompiled preamble, if `precompiled` is true and that works. Return the
+    path of the PDF, or `None` if `pdflatex` did not produce a complete one.
+
+    """
+
+    if isinstance(source, unicode):
+        source = source.encode('utf8')
+    if precompiled:
+        preamble, rest = split_preamble(source)
+        format_name = preamble and get_format(preamble)
+        if format_name:
+            pdf_path, timed_out = run_job(rest, directory, jobname,
+                format_name)
+            if pdf_path or timed_out:
+                return pdf_path
+            logger.warning('Compiling %s with the precompiled preamble %s'
+                ' failed; compiling it as is.', jobname, format_name)
+            pdf_path, _ = run_job(source, directory, jobname)
+            if pdf_path:
+                # So the format was at fault; dump it afresh next time.
+                with _formats_lock:
+                    try:
+                        os.remove(get_format_path(format_name))
+                    except OSError:
+                        pass
+            return pdf_path
+    return run_job(source, directory, jobname)[0]
+
+
+def run_job(source, directory, jobname, format_name=None):
+    """Run `pdflatex` once on `source`, loading the format `format_name`, if
+    given. Return a 2-tuple: the path of the PDF (or `None`) and whether
+    `pdflatex` timed out.
+
+    """
+
+    with open(os.path.join(directory, '%s.tex' % jobname), 'wb') as f:
+        f.write(source)
+    args = ['-interaction=nonstopmode']
+    env = None
+    if format_name:
+        args.append('-fmt=%s' % format_name)
+        # The trailing separator keeps the default search path as well.
+        env = dict(os.environ, TEXFORMATS=get_formats_dir() + os.pathsep)
+    returncode, output, timed_out = run_pdflatex(args + ['%s.tex' % jobname],
+        directory, env)
+    pdf_path = os.path.join(directory, '%s.pdf' % jobname)
+    # A pdflatex that was killed may have left a truncated PDF.
+    if returncode < 0 or not is_complete_pdf(pdf_path):
+        logger.error('pdflatex did not produce a PDF for %s (exit status %s%s):'
+            '\n%s', jobname, returncode, ', timed out' if timed_out else '',
+            read_log(directory, jobname) or output)
+        if os.path.exists(pdf_path):
+            os.remove(pdf_path)
+        return None, timed_out
+    if returncode:
+        logger.warning('pdflatex reported errors for %s:\n%s', jobname,
+            read_log(directory, jobname) or output)
+    return pdf_path, False
+
+
+def read_log(directory, jobname):
+    """Return the last `LOG_TAIL_LINES` lines of the .log file of the
+    `pdflatex` run `jobname` in `directory`, or `None` if there is none.
+
+    """
+
+    try:
+        with open(os.path.join(directory, '%s.log' % jobname), 'rb') as f:
+            lines = f.readlines()
+    except IOError:
+        return None
+    return ''.join(lines[-LOG_TAIL_LINES:])
+
+
+def is_complete_pdf(path):
+    """Return `True` if the file at `path` is a PDF that was written to the
+    end.
+
+    """
+
+    try:
+        with open(path, 'rb') as f:
+            if f.read(5) != b'%PDF-':
+                return False
+            f.seek(0, os.SEEK_END)
+            f.seek(max(0, f.tell() - 1024))
+            return PDF_EOF in f.read()
+    except IOError:
+        return False
@@ -0,0 +1,45 @@
+import os
+
+from django.core.management.base import BaseCommand
+
+from coop.models import File
+from coop.storage import upload_storage, get_content_hash
+
+
+class Command(BaseCommand):
+    """Move the uploads that were stored under their names into the
+    content-addressed store (see coop/storage.py), in place: each one is
+    hashed and renamed, not copied. Files with the same content end up
+    sharing one copy. The URLs of the files do not change. It is safe to run
+    this more than once.
+
+    """
+
+    help = ('Store the uploaded files under the hashes of their content,'
+        ' removing duplicates.')
+
+    def handle(self, *args, **options):
+        verbosity = int(options.get('verbosity', 1))
+        converted = missing = duplicates = 0
+        saved_bytes = 0
+        names = set(File.objects.values_list('upload', flat=True))
+        for old_name in sorted(names):
+            if not old_name or get_content_hash(old_name):
+                continue
+            old_path = upload_storage.path(old_name)
+            if not os.path.isfile(old_path):
+                missing += 1
+                if verbosity > 0:
+                    self.stderr.write('%s is missing.' % old_path)
+                continue
+            size = os.path.getsize(old_path)
+            new_name = upload_storage.adopt(old_path)
+            if File.objects.filter(upload=new_name).exists():
+                duplicates += 1
+                saved_bytes += size
+            File.objects.filter(upload=old_name).update(upload=new_name)
+            converted += 1
+        if verbosity > 0:
+            self.stdout.write('Converted %d uploads, %d of them duplicates'
+                ' (%d bytes freed); %d missing.' % (converted, duplicates,
+                saved_bytes, missing))
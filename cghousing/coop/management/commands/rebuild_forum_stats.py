@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from coop.models import Forum, Thread
+
+
+class Command(BaseCommand):
+    """Recompute the denormalized statistics (thread/post counts and last
+    posts) of every forum and thread. Run this after loading fixtures or
+    after editing posts directly in the database.
+
+    """
+
+    help = ('Recompute the thread counts, post counts and last posts of all'
+        ' forums and threads.')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            threads = Thread.objects.all()
+            for thread in threads:
+                thread.refresh_stats()
+            forums = Forum.objects.all()
+            for forum in forums:
+                forum.refresh_stats()
+        if int(options.get('verbosity', 1)) > 0:
+            self.stdout.write('Rebuilt statistics for %d forums and %d'
+                ' threads.' % (len(forums), len(threads)))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from coop import search
+
+
+class Command(BaseCommand):
+    """Rebuild the full-text search index from scratch. Run this after
+    loading fixtures or after editing searchable objects directly in the
+    database.
+
+    """
+
+    help = ('Re-index all posts, pages, files, meeting minutes, committees'
+        ' and members for search.')
+
+    def handle(self, *args, **options):
+        count = search.rebuild_index()
+        if int(options.get('verbosity', 1)) > 0:
+            self.stdout.write('Indexed %d documents (%s backend).' % (
+                count, search.get_backend()))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from coop.models import (ApplicationSettings, Committee, Page, Person, Post,
+    Unit)
+
+RENDERED_MARKDOWN_MODELS = (ApplicationSettings, Committee, Page, Person,
+    Post, Unit)
+
+
+class Command(BaseCommand):
+    """Store the rendered HTML of every model with Markdown content whose
+    stored rendering is missing or out of date. Only the rendering columns
+    are written, so modification times are left alone.
+
+    """
+
+    help = ('Render and store the Markdown of all posts, pages, units,'
+        ' committees, people and application settings that need it.')
+
+    def handle(self, *args, **options):
+        for model in RENDERED_MARKDOWN_MODELS:
+            rendered = 0
+            for obj in model.objects.all().iterator():
+                if obj.refresh_rendered_markdown():
+                    model.objects.filter(pk=obj.pk).update(
+                        rendered_html=obj.rendered_html,
+                        rendered_hash=obj.rendered_hash)
+                    rendered += 1
+            if int(options.get('verbosity', 1)) > 0:
+                self.stdout.write('Rendered %d of the %s objects.' % (
+                    rendered, model.__name__))
@@ -0,0 +1,50 @@
+import os
+
+from django.core.management.base import BaseCommand
+
+from coop.derivatives import delete_derivatives
+from coop.models import File
+from coop.storage import upload_storage, get_content_hash, release_now
+
+
+class Command(BaseCommand):
+    """Delete the stored uploads (see coop/storage.py) that no `File`
+    references, with their derivatives. A deleted `File`'s upload is released
+    by a background thread of the process that deleted it, which a restart
+    interrupts, so run this now and then (e.g., daily, from cron; run.sh runs
+    it on start). Uploads stored in the last `storage.RELEASE_DELAY` seconds
+    are kept, since their `File` may not be saved yet. It is safe to run this
+    while the site is serving.
+
+    """
+
+    help = 'Delete the stored uploads that no file references.'
+
+    def handle(self, *args, **options):
+        verbosity = int(options.get('verbosity', 1))
+        deleted = freed_bytes = 0
+        referenced = set(File.objects.values_list('upload', flat=True))
+        for name in self.get_stored_names():
+            if name in referenced:
+                continue
+            size = os.path.getsize(upload_storage.path(name))
+            if release_now(name, upload_storage):
+                delete_derivatives(name)
+                deleted += 1
+                freed_bytes += size
+                if verbosity > 1:
+                    self.stdout.write('Deleted %s.' % name)
+        if verbosity > 0:
+            self.stdout.write('Deleted %d unreferenced uploads (%d bytes'
+                ' freed).' % (deleted, freed_bytes))
+
+    def get_stored_names(self):
+        """Yield the content-addressed names of the stored uploads."""
+        root = upload_storage.location
+        for dir_path, dir_names, file_names in os.walk(root):
+            dir_names.sort()
+            for file_name in sorted(file_names):
+                name = os.path.relpath(os.path.join(dir_path, file_name),
+                    root).replace(os.sep, '/')
+                if get_content_hash(name):
+                    yield name
@@ -0,0 +1,58 @@
+"""Markdown rendering for the Co-op App.
+
+Rendering Markdown is by far the most expensive part of displaying posts,
+pages and the like, so it is done as rarely as possible:
+
+- Models with user-supplied Markdown (see `RenderedMarkdown` in
+  `coop.models`) store the rendered HTML, along with a hash of the source
+  text and style it was rendered from, whenever they are saved.
+- Renderings are also kept in the shared cache, keyed by that same hash, so
+  identical text is only rendered once no matter which object it belongs to.
+
+The `rendered_markdown` template filter (see `coop_extras`) reads the stored
+HTML and only re-renders if the source has changed behind the model's back,
+e.g., via `QuerySet.update` or before the `render_markdown` management
+command has been run.
+
+"""
+
+import hashlib
+
+from django.core.cache import cache
+from markdown_deux import markdown
+
+# Renderings are content-addressed, so they never go stale; expire them after
+# a week so that rarely viewed text does not linger in the cache.
+MARKDOWN_CACHE_TIMEOUT = 60 * 60 * 24 * 7
+
+MARKDOWN_STYLES = ('default', 'trusted')
+
+
+def get_markdown_hash(text, style='default'):
+    """Return a hex digest that identifies the rendering of Markdown `text` in
+    `style`.
+
+    """
+
+    text = text or u''
+    if isinstance(text, unicode):
+        text = text.encode('utf-8')
+    return hashlib.sha1('%s\0%s' % (style, text)).hexdigest()
+
+
+def render_markdown(text, style='default', text_hash=None):
+    """Return Markdown `text` rendered as HTML in `style` (one of
+    `MARKDOWN_STYLES`, as configured in `settings.MARKDOWN_DEUX_STYLES`),
+    using the shared cache.
+
+    """
+
+    if not text:
+        return u''
+    text_hash = text_hash or get_markdown_hash(text, style)
+    key = 'coop:markdown:%s' % text_hash
+    html = cache.get(key)
+    if html is None:
+        html = markdown(text, style)
+        cache.set(key, html, MARKDOWN_CACHE_TIMEOUT)
+    return html
@@ -0,0 +1,102 @@
+"""A snapshot of the membership, from which the membership list is built.
+
+`MembershipSnapshot.load` fetches everything that the membership list shows
+in a fixed number of queries, however many members there are: one each for
+
+- the members, with their units,
+- the block representatives, with their persons,
+- the children of the members,
+- the phone numbers of the members and the block representatives,
+- the committee memberships of the members, with the committees' names and
+  chairs, and
+- the participation committee, with its chair and the chair's unit.
+
+The related rows are kept in dicts keyed by person id, as plain tuples, so
+the helpers that format the list (e.g., `get_children_for_latex_row` in
+coop/views.py) only look things up in memory.
+
+"""
+
+from collections import namedtuple, defaultdict
+
+from django.db.models import Q
+
+from coop.models import Person, Committee, BlockRepresentative
+
+Child = namedtuple('Child', 'id first_name')
+Phone = namedtuple('Phone', 'number phone_type')
+Membership = namedtuple('Membership', 'name chair_id')
+
+PARTICIPATION_COMMITTEE = 'Participation'
+
+
+class MembershipSnapshot(object):
+    """The members of the co-op and the things about them that the
+    membership list shows.
+
+    """
+
+    def __init__(self, members, children, phone_numbers, committees,
+            block_reps, participation_committee):
+        # `Person`s, with their units.
+        self.members = members
+        # Dicts from person ids to lists of `Child`, `Phone` and `Membership`
+        # tuples, respectively.
+        self.children = children
+        self.phone_numbers = phone_numbers
+        self.committees = committees
+        # `BlockRepresentative`s, with their persons.
+        self.block_reps = block_reps
+        # The participation `Committee` (with its chair and the chair's unit),
+        # or `None`.
+        self.participation_committee = participation_committee
+
+    @classmethod
+    def load(cls, members):
+        """Return the snapshot of `members`, a queryset of `Person`s."""
+        member_list = list(members.select_related('unit'))
+        block_reps = list(BlockRepresentative.objects.select_related('person')
+            .order_by('pk'))
+
+        children = defaultdict(list)
+        for parent_id, child_id, first_name in Person.children.through\
+                .objects.filter(from_person__in=members)\
+                .order_by('pk')\
+                .values_list('from_person_id', 'to_person_id',
+                    'to_person__first_name'):
+            children[parent_id].append(Child(child_id, first_name))
+
+        rep_ids = set(rep.person_id for rep in block_reps if rep.person_id)
+        phone_numbers = defaultdict(list)
+        for person_id, number, phone_type in Person.phone_numbers.through\
+                .objects.filter(Q(person__in=members) |
+                    Q(person_id__in=rep_ids))\
+                .order_by('pk')\
+                .values_list('person_id', 'phonenumber__number',
+                    'phonenumber__phone_type'):
+            phone_numbers[person_id].append(Phone(number, phone_type))
+
+        committees = defaultdict(list)
+        for person_id, name, chair_id in Committee.members.through.objects\
+                .filter(person__in=members)\
+                .order_by('pk')\
+                .values_list('person_id', 'committee__name',
+                    'committee__chair_id'):
+            committees[person_id].append(Membership(name, chair_id))
+
+        participation_committee = Committee.objects\
+            .filter(name=PARTICIPATION_COMMITTEE)\
+            .select_related('chair__unit').first()
+        return cls(member_list, children, phone_numbers, committees,
+            block_reps, participation_committee)
+
+    def get_block_rep(self, block_number, role):
+        """Return the person who has `role` (e.g., 'maintenance') for block
+        `block_number`, or `None`.
+
+        """
+
+        for rep in self.block_reps:
+            if rep.block_number == block_number and rep.role == role:
+                return rep.person
+        return None
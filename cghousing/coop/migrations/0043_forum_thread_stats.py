@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.db.models.deletion
+
+
+def populate_stats(apps, schema_editor):
+    """Compute the initial values of the denormalized forum and thread
+    statistics. See also the `rebuild_forum_stats` management command.
+
+    """
+
+    Forum = apps.get_model('coop', 'Forum')
+    Thread = apps.get_model('coop', 'Thread')
+    Post = apps.get_model('coop', 'Post')
+    for thread in Thread.objects.all():
+        posts = Post.objects.filter(thread=thread)
+        last_post = posts.order_by('-datetime_created', '-id').first()
+        Thread.objects.filter(pk=thread.pk).update(
+            post_count=posts.count(),
+            last_post=last_post,
+            last_post_at=last_post and last_post.datetime_created)
+    for forum in Forum.objects.all():
+        posts = Post.objects.filter(thread__forum=forum)
+        last_post = posts.order_by('-datetime_created', '-id').first()
+        Forum.objects.filter(pk=forum.pk).update(
+            thread_count=Thread.objects.filter(forum=forum).count(),
+            post_count=posts.count(),
+            last_post=last_post,
+            last_post_at=last_post and last_post.datetime_created)
+
+
+def noop(apps, schema_editor):
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coop', '0042_auto_20201214_0123'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='forum',
+            name='last_post',
+            field=models.ForeignKey(related_name='+', on_delete=django.db.models.deletion.SET_NULL, default=None, blank=True, editable=False, to='coop.Post', null=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='forum',
+            name='last_post_at',
+            field=models.DateTimeField(default=None, null=True, editable=False, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='forum',
+            name='post_count',
+            field=models.IntegerField(default=0, editable=False),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='forum',
+            name='thread_count',
+            field=models.IntegerField(default=0, editable=False),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='thread',
+            name='last_post',
+            field=models.ForeignKey(related_name='+', on_delete=django.db.models.deletion.SET_NULL, default=None, blank=True, editable=False, to='coop.Post', null=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='thread',
+            name='last_post_at',
+            field=models.DateTimeField(default=None, null=True, editable=False, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='thread',
+            name='post_count',
+            field=models.IntegerField(default=0, editable=False),
+            preserve_default=True,
+        ),
+        migrations.RunPython(populate_stats, noop),
+    ]
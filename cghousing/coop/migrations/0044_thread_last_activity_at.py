@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.utils.timezone
+
+
+def populate_last_activity_at(apps, schema_editor):
+    Thread = apps.get_model('coop', 'Thread')
+    for thread in Thread.objects.all():
+        last_activity_at = thread.last_post_at or thread.datetime_created
+        if last_activity_at:
+            Thread.objects.filter(pk=thread.pk).update(
+                last_activity_at=last_activity_at)
+
+
+def noop(apps, schema_editor):
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coop', '0043_forum_thread_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='thread',
+            name='last_activity_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+            preserve_default=True,
+        ),
+        migrations.RunPython(populate_last_activity_at, noop),
+        migrations.AlterIndexTogether(
+            name='thread',
+            index_together=set([('forum', 'last_activity_at')]),
+        ),
+    ]
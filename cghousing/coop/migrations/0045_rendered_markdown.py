@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coop', '0044_thread_last_activity_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='applicationsettings',
+            name='rendered_hash',
+            field=models.CharField(default='', max_length=40, editable=False, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='applicationsettings',
+            name='rendered_html',
+            field=models.TextField(default='', editable=False, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='committee',
+            name='rendered_hash',
+            field=models.CharField(default='', max_length=40, editable=False, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='committee',
+            name='rendered_html',
+            field=models.TextField(default='', editable=False, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='page',
+            name='rendered_hash',
+            field=models.CharField(default='', max_length=40, editable=False, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='page',
+            name='rendered_html',
+            field=models.TextField(default='', editable=False, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='person',
+            name='rendered_hash',
+            field=models.CharField(default='', max_length=40, editable=False, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='person',
+            name='rendered_html',
+            field=models.TextField(default='', editable=False, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='rendered_hash',
+            field=models.CharField(default='', max_length=40, editable=False, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='rendered_html',
+            field=models.TextField(default='', editable=False, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='unit',
+            name='rendered_hash',
+            field=models.CharField(default='', max_length=40, editable=False, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='unit',
+            name='rendered_html',
+            field=models.TextField(default='', editable=False, blank=True),
+            preserve_default=True,
+        ),
+    ]
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations, DatabaseError
+
+
+# The database-specific full-text index of coop_searchdocument; see
+# coop/search.py. Other databases get no index, and search falls back to
+# LIKE queries.
+
+def create_text_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute('ALTER TABLE coop_searchdocument'
+            ' ADD COLUMN search_vector tsvector')
+        schema_editor.execute('CREATE INDEX coop_searchdocument_search_vector'
+            ' ON coop_searchdocument USING GIN (search_vector)')
+    elif vendor == 'sqlite':
+        try:
+            schema_editor.execute('CREATE VIRTUAL TABLE'
+                ' coop_searchdocument_fts USING fts5(title, body,'
+                ' tokenize = "porter unicode61")')
+        except DatabaseError:
+            # This SQLite was built without FTS5.
+            pass
+
+
+def drop_text_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute('ALTER TABLE coop_searchdocument'
+            ' DROP COLUMN search_vector')
+    elif vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS coop_searchdocument_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coop', '0045_rendered_markdown'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('kind', models.CharField(max_length=20, choices=[(b'post', b'Forum post'), (b'page', b'Page'), (b'file', b'File'), (b'minutes', b'Meeting minutes'), (b'committee', b'Committee'), (b'person', b'Member')])),
+                ('object_id', models.IntegerField()),
+                ('title', models.CharField(max_length=255)),
+                ('body', models.TextField(blank=True)),
+                ('url', models.CharField(max_length=500)),
+                ('public', models.BooleanField(default=False)),
+                ('datetime_indexed', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AlterUniqueTogether(
+            name='searchdocument',
+            unique_together=set([('kind', 'object_id')]),
+        ),
+        migrations.RunPython(create_text_index, drop_text_index),
+    ]
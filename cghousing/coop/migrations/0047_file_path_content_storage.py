@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import os
+import coop.storage
+
+
+def populate_path(apps, schema_editor):
+    """Existing files keep their URLs, which use the base name of their
+    upload.
+
+    """
+
+    File = apps.get_model('coop', 'File')
+    for file in File.objects.all():
+        File.objects.filter(pk=file.pk).update(
+            path=os.path.basename(file.upload.name))
+
+
+def noop(apps, schema_editor):
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coop', '0046_search_document'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='path',
+            field=models.CharField(null=True, default=None, editable=False, max_length=255, blank=True, unique=True),
+            preserve_default=True,
+        ),
+        migrations.RunPython(populate_path, noop),
+        migrations.AlterField(
+            model_name='file',
+            name='upload',
+            field=models.FileField(storage=coop.storage.ContentAddressedStorage(), upload_to=b'uploads/', db_index=True),
+            preserve_default=True,
+        ),
+    ]
@@ -1,11 +1,16 @@
+import os
 import string
 import datetime
 
 from django.conf import settings
-from django.db import models
+from django.db import models, transaction, IntegrityError
 from django.utils import timezone
 from django.utils.timezone import now, localtime
 from django.contrib.auth.models import User
+from django.utils.text import get_valid_filename
+
+from coop.markup import get_markdown_hash, render_markdown
+from coop.storage import upload_storage
 
 """Models for the Co-op App
 
@@ -79,11 +84,84 @@ class Base(models.Model):
             return u''
 
 
-class ApplicationSettings(Base):
+class RenderedMarkdown(models.Model):
+    """Abstract base class for models with a user-supplied Markdown attribute,
+    named by `markdown_field`. The rendered HTML is stored alongside the
+    Markdown whenever the model is saved, together with a hash of the source
+    text and style, so that it never has to be rendered on display. See
+    `coop.markup`.
+
+    """
+
+    markdown_field = None
+
+    rendered_html = models.TextField(
+        blank=True,
+        default=u'',
+        editable=False
+    )
+
+    rendered_hash = models.CharField(
+        max_length=40,
+        blank=True,
+        default=u'',
+        editable=False
+    )
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        self.refresh_rendered_markdown()
+        return super(RenderedMarkdown, self).save(*args, **kwargs)
+
+    def get_markdown(self):
+        return getattr(self, self.markdown_field) or u''
+
+    def get_markdown_style(self):
+        """Return the markdown-deux style to render with: 'default' escapes raw
+        HTML; 'trusted' lets it through.
+
+        """
+
+        return 'default'
+
+    def refresh_rendered_markdown(self):
+        """Re-render the Markdown, if it or its style has changed since it was
+        last rendered. Return `True` if it was re-rendered.
+
+        """
+
+        text = self.get_markdown()
+        style = self.get_markdown_style()
+        text_hash = get_markdown_hash(text, style)
+        if text_hash == self.rendered_hash:
+            return False
+        self.rendered_html = render_markdown(text, style, text_hash)
+        self.rendered_hash = text_hash
+        return True
+
+    def get_rendered_markdown(self, style=None):
+        """Return the Markdown rendered as HTML in `style` (by default, this
+        object's own style). The stored rendering is used if it is current.
+
+        """
+
+        text = self.get_markdown()
+        style = style or self.get_markdown_style()
+        text_hash = get_markdown_hash(text, style)
+        if text_hash == self.rendered_hash:
+            return self.rendered_html
+        return render_markdown(text, style, text_hash)
+
+
+class ApplicationSettings(Base, RenderedMarkdown):
 
     def __unicode__(self):
         return u'Application Settings for %s' % self.coop_name
 
+    markdown_field = 'news'
+
     coop_name = models.CharField(
         max_length=200,
         default=u'Co-op'
@@ -122,7 +200,7 @@ class ApplicationSettings(Base):
     )
 
 
-class Unit(Base):
+class Unit(Base, RenderedMarkdown):
     """A model for each of the units/homes in the co-op.
 
     """
@@ -130,6 +208,8 @@ class Unit(Base):
     def __unicode__(self):
         return u'Unit #%d, %d' % (self.unit_number, self.block_number)
 
+    markdown_field = 'page_content'
+
     BLOCKS = (1701, 1703, 1715, 1739, 1747) # possible block numbers
     UNITS = range(101, 114) # possible unit numbers
     BEDROOMS = range(1, 5) # possible number of bedrooms in a unit
@@ -194,7 +274,7 @@ class PhoneNumber(Base):
         choices=tuple([(pt, pt) for pt in [u'', u'cell', u'home']]))
 
 
-class Person(Base):
+class Person(Base, RenderedMarkdown):
     """Model for people who live in the co-op: members and their family members.
 
     https://docs.djangoproject.com/en/1.7/topics/auth/customizing/#extending-the-existing-user-model
@@ -204,6 +284,8 @@ class Person(Base):
     def __unicode__(self):
         return u'%s %s' % (self.first_name, self.last_name)
 
+    markdown_field = 'page_content'
+
     # The Django auth_user corresponding to this person (if applicable)
     # The `User` instance can access it's corresponding `Person` instance via
     # its `get_profile()` method.
@@ -344,7 +426,7 @@ class BlockRepresentative(Base):
         ROLES]))
 
 
-class Page(Base):
+class Page(Base, RenderedMarkdown):
     """A model for generic pages on the web site.
 
     """
@@ -352,6 +434,12 @@ class Page(Base):
     def __unicode__(self):
         return u'Page entitled "%s"' % self.title
 
+    markdown_field = 'content'
+
+    def get_markdown_style(self):
+        if self.trusted:
+            return 'trusted'
+        return 'default'
 
     # Title of page; add unique constraint
     title = models.CharField(
@@ -403,6 +491,42 @@ class File(Base):
     def __unicode__(self):
         return u'File "%s"' % self.name
 
+    # How many free paths are tried before saving a file gives up.
+    SAVE_PATH_ATTEMPTS = 5
+
+    def save(self, *args, **kwargs):
+        if self.path:
+            return super(File, self).save(*args, **kwargs)
+        # A concurrent upload of a file with the same name may take the path
+        # between `get_available_path` and the insert; then the next free
+        # path is tried.
+        for attempt in range(self.SAVE_PATH_ATTEMPTS):
+            path = self.get_available_path(self.name or str(self.upload))
+            self.path = path
+            try:
+                with transaction.atomic():
+                    return super(File, self).save(*args, **kwargs)
+            except IntegrityError:
+                self.path = ''
+                if (attempt == self.SAVE_PATH_ATTEMPTS - 1 or
+                        not File.objects.filter(path=path).exists()):
+                    raise
+
+    @classmethod
+    def get_available_path(cls, name):
+        """Return a path (see `path`) for a file called `name` that no other
+        file has.
+
+        """
+
+        path = get_valid_filename(os.path.basename(name)) or 'file'
+        root, ext = os.path.splitext(path)
+        counter = 0
+        while cls.objects.filter(path=path).exists():
+            counter += 1
+            path = '%s_%d%s' % (root, counter, ext)
+        return path
+
     name = models.CharField(
         max_length=200
     )
@@ -420,8 +544,25 @@ class File(Base):
         default=0
     )
 
-    # Field for the file data. Will store the url.
-    upload = models.FileField(upload_to='%s/' % UPLOADS_DIR)
+    # Field for the file data. The data is stored under its hash (see
+    # coop/storage.py), so files with the same content share it.
+    upload = models.FileField(
+        upload_to='%s/' % UPLOADS_DIR,
+        storage=upload_storage,
+        db_index=True
+    )
+
+    # The file's name in its URLs (e.g., /file/data/<path>/): its original
+    # name with whitespace replaced by underscores, made unique. Unlike the
+    # name of `upload`, this never changes.
+    path = models.CharField(
+        max_length=255,
+        unique=True,
+        blank=True,
+        null=True,
+        default=None,
+        editable=False
+    )
 
     # If true, then you don't need to be logged in to view this file.
     public = models.BooleanField(
@@ -495,6 +636,55 @@ class Forum(Base):
         blank=True
     )
 
+    # Denormalized statistics. These are kept up to date by the receivers in
+    # `coop.signals` whenever a thread or post is created, moved or deleted;
+    # the `rebuild_forum_stats` management command recomputes them from
+    # scratch.
+    thread_count = models.IntegerField(
+        default=0,
+        editable=False
+    )
+
+    post_count = models.IntegerField(
+        default=0,
+        editable=False
+    )
+
+    last_post = models.ForeignKey(
+        'Post',
+        blank=True,
+        null=True,
+        default=None,
+        editable=False,
+        related_name='+',
+        on_delete=models.SET_NULL
+    )
+
+    last_post_at = models.DateTimeField(
+        blank=True,
+        null=True,
+        default=None,
+        editable=False
+    )
+
+    def refresh_stats(self):
+        """Recompute the denormalized statistics of this forum and write them
+        with a single UPDATE that touches only the statistics columns.
+
+        """
+
+        posts = Post.objects.filter(thread__forum=self)
+        last_post = posts.order_by('-datetime_created', '-id').first()
+        stats = {
+            'thread_count': self.threads.count(),
+            'post_count': posts.count(),
+            'last_post': last_post,
+            'last_post_at': last_post and last_post.datetime_created
+        }
+        Forum.objects.filter(pk=self.pk).update(**stats)
+        for attr, val in stats.items():
+            setattr(self, attr, val)
+
     # Relational attributes defined on other models:
     # threads
 
@@ -532,6 +722,64 @@ class Thread(Base):
         default=0
     )
 
+    # Denormalized statistics; see the comment on `Forum.thread_count`.
+    post_count = models.IntegerField(
+        default=0,
+        editable=False
+    )
+
+    last_post = models.ForeignKey(
+        'Post',
+        blank=True,
+        null=True,
+        default=None,
+        editable=False,
+        related_name='+',
+        on_delete=models.SET_NULL
+    )
+
+    last_post_at = models.DateTimeField(
+        blank=True,
+        null=True,
+        default=None,
+        editable=False
+    )
+
+    # When the last post was made or, if there are no posts, when the thread
+    # was created. Forums list their threads in descending order of this
+    # value, using it (and the id) as a pagination cursor.
+    last_activity_at = models.DateTimeField(
+        default=now,
+        editable=False
+    )
+
+    class Meta:
+        index_together = [['forum', 'last_activity_at']]
+
+    def save(self, *args, **kwargs):
+        # The statistics of the thread's forum are updated by a post_save
+        # receiver (see coop.signals), in the same transaction.
+        with transaction.atomic():
+            super(Thread, self).save(*args, **kwargs)
+
+    def refresh_stats(self):
+        """Recompute the denormalized statistics of this thread and write them
+        with a single UPDATE that touches only the statistics columns.
+
+        """
+
+        last_post = self.posts.order_by('-datetime_created', '-id').first()
+        stats = {
+            'post_count': self.posts.count(),
+            'last_post': last_post,
+            'last_post_at': last_post and last_post.datetime_created,
+            'last_activity_at': (last_post and last_post.datetime_created or
+                self.datetime_created or self.last_activity_at)
+        }
+        Thread.objects.filter(pk=self.pk).update(**stats)
+        for attr, val in stats.items():
+            setattr(self, attr, val)
+
     # The content of the post
     #post = models.TextField()
 
@@ -549,7 +797,7 @@ class Thread(Base):
     # posts
 
 
-class Post(Base):
+class Post(Base, RenderedMarkdown):
     """Model for the posts in a forum thread.
 
     Every post needs a `reply_to` (i.e., a parent post), except for the first
@@ -568,6 +816,14 @@ class Post(Base):
         poster = self.get_user_str(self.creator)
         return u'%s (by %s on %s)' % (post, poster, post_time)
 
+    markdown_field = 'post'
+
+    def save(self, *args, **kwargs):
+        # The statistics of the post's thread and forum are updated by a
+        # post_save receiver (see coop.signals), in the same transaction.
+        with transaction.atomic():
+            super(Post, self).save(*args, **kwargs)
+
     def get_truncated_post(self):
         max_len = 30
         if len(self.post) > max_len:
@@ -609,7 +865,7 @@ class Post(Base):
     # - markup language # markdown, reStructuredText
 
 
-class Committee(Base):
+class Committee(Base, RenderedMarkdown):
     """A model for each committee.
 
     """
@@ -617,6 +873,8 @@ class Committee(Base):
     def __unicode__(self):
         return self.name
 
+    markdown_field = 'page_content'
+
     # Commmittee name, e.g., 'Finance', 'Grounds', etc.
     name = models.CharField(
         max_length=200
@@ -774,3 +1032,56 @@ class ParticipationRequirement(Base):
             " All</a>.")
     )
 
+
+class SearchDocument(models.Model):
+    """An entry in the full-text search index: the searchable text of one
+    post, page, file, set of meeting minutes, committee or member. The
+    database-specific index (a `tsvector` column on PostgreSQL, an FTS5 table
+    on SQLite) is maintained alongside; see coop/search.py.
+
+    """
+
+    def __unicode__(self):
+        return u'%s: %s' % (self.get_kind_display(), self.title)
+
+    KINDS = (
+        ('post', 'Forum post'),
+        ('page', 'Page'),
+        ('file', 'File'),
+        ('minutes', 'Meeting minutes'),
+        ('committee', 'Committee'),
+        ('person', 'Member'),
+    )
+
+    # The kind of object indexed and its primary key.
+    kind = models.CharField(max_length=20, choices=KINDS)
+    object_id = models.IntegerField()
+
+    title = models.CharField(max_length=255)
+    body = models.TextField(blank=True)
+
+    # Where the object is displayed.
+    url = models.CharField(max_length=500)
+
+    # If true, then people who are not logged in can find this object.
+    public = models.BooleanField(default=False)
+
+    datetime_indexed = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = (('kind', 'object_id'),)
+
+
+class Version(models.Model):
+    """A counter, kept in the database so that every process sees the same
+    value, which is bumped whenever the data that it is named after changes
+    (e.g., the committee memberships that the permission snapshots in the
+    sessions are made from; see coop/permissions.py).
+
+    """
+
+    def __unicode__(self):
+        return u'%s: %s' % (self.name, self.version)
+
+    name = models.CharField(max_length=50, primary_key=True)
+    version = models.BigIntegerField(default=0)
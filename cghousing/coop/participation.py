@@ -0,0 +1,107 @@
+"""Participation matrix: which units have fulfilled, shirked or been excused
+from which participation requirements.
+
+The matrix is built from flat queries only: one over the active member
+occupants of the units and one over each of the three many-to-many tables
+(fulfillers, excusees and shirkers) of the participation requirements. The
+status of each (unit, requirement) cell is then a handful of set operations,
+so the cost grows with the number of rows in those tables rather than with
+units x requirements x occupants.
+
+The queries select the requirements with a subquery and the units with a join,
+never with a list of ids, which could exceed the number of parameters that a
+query may have (999 on SQLite).
+
+"""
+
+from collections import defaultdict
+
+from coop.models import ParticipationRequirement, Person
+
+FULFILLED = 'fulfilled'
+SHIRKED = 'shirked'
+EXCUSED = 'excused'
+
+STATUSES = (FULFILLED, SHIRKED, EXCUSED)
+
+
+def get_participant_sets(m2m_field, participation_requirements):
+    """Return a dict from the ids of `participation_requirements` (a queryset
+    of `ParticipationRequirement`s) to sets of the ids of the persons related
+    to them via the many-to-many field named `m2m_field`.
+
+    """
+
+    through = getattr(ParticipationRequirement, m2m_field).through
+    result = defaultdict(set)
+    for pr_id, person_id in through.objects\
+            .filter(participationrequirement__in=participation_requirements
+                .order_by().values('pk'))\
+            .values_list('participationrequirement_id', 'person_id'):
+        result[pr_id].add(person_id)
+    return result
+
+
+def get_unit_occupant_sets():
+    """Return a dict from unit ids to sets of the ids of the active members
+    who occupy them.
+
+    """
+
+    result = defaultdict(set)
+    for person_id, unit_id in Person.objects\
+            .filter(member=True, user__is_active=True, unit__isnull=False)\
+            .values_list('id', 'unit_id'):
+        result[unit_id].add(person_id)
+    return result
+
+
+def get_unit_status(occupant_ids, fulfillers, excusees, shirkers):
+    """Return the participation status of a unit whose active members are
+    `occupant_ids` with respect to a requirement with the given sets of
+    fulfillers, excusees and shirkers.
+
+    Rules: an occupant who is a fulfiller has fulfilled; otherwise one who is
+    an excusee is excused; otherwise one who is a shirker has shirked. If one
+    occupant of the unit has fulfilled, the unit has fulfilled. Otherwise, if
+    one has shirked, the unit has shirked. Otherwise if one is excused, the
+    unit is excused. Otherwise, participation by this unit is not applicable
+    (`None`).
+
+    """
+
+    if occupant_ids & fulfillers:
+        return FULFILLED
+    elif (occupant_ids - excusees) & shirkers:
+        return SHIRKED
+    elif occupant_ids & excusees:
+        return EXCUSED
+    return None
+
+
+def get_participation_matrix(participation_requirements, units):
+    """Return the participation matrix of `units` (a list or queryset of
+    `Unit`s) for `participation_requirements` (a queryset of
+    `ParticipationRequirement`s), as a list of (`unit`, `statuses`) 2-tuples,
+    in the order of `units`. `statuses` is a list with one item per
+    requirement, in the order of `participation_requirements`: one of
+    `FULFILLED`, `SHIRKED`, `EXCUSED` or `None`.
+
+    """
+
+    pr_ids = [pr.id for pr in participation_requirements]
+    fulfillers = get_participant_sets('fulfillers', participation_requirements)
+    excusees = get_participant_sets('excusees', participation_requirements)
+    shirkers = get_participant_sets('shirkers', participation_requirements)
+    occupants = get_unit_occupant_sets()
+    empty = frozenset()
+    matrix = []
+    for unit in units:
+        occupant_ids = occupants.get(unit.id, empty)
+        statuses = [get_unit_status(occupant_ids,
+                                    fulfillers.get(pr_id, empty),
+                                    excusees.get(pr_id, empty),
+                                    shirkers.get(pr_id, empty))
+                    for pr_id in pr_ids]
+        matrix.append((unit, statuses))
+    return matrix
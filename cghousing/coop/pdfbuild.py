@@ -0,0 +1,391 @@
+"""Background building of the membership list PDF.
+
+Running `pdflatex` takes seconds, so it must not happen inside a request.
+Instead, the view generates the LaTeX source (which is cheap) and calls
+`request_build`, which:
+
+- returns straight away with `DONE` if a PDF for exactly that source has
+  already been built (builds are keyed by the SHA-1 of the source, so an
+  unchanged membership list is never rebuilt),
+- otherwise queues the build on a small pool of worker threads and returns
+  `PENDING`. Requests for a source that is already queued or building are
+  coalesced onto that one build, in whichever process it runs.
+
+Builds are coalesced across processes by a marker file,
+`BUILDS_DIR/<hash>.building`, which the process that queues a build creates
+exclusively (so only one process can) and deletes when the PDF is built. If
+the build fails, the marker records that instead, and the source is not built
+again for `FAILED_RETRY_AGE` seconds. A marker that is older than
+`get_stale_marker_age()` was left behind by a process that died.
+
+The client then polls `get_build_status` (via the members PDF status view)
+until the PDF is ready. It reports the state that this process knows of or
+else the state in the marker; completed PDFs live on disk, as
+`BUILDS_DIR/<hash>.pdf`, so every process sees them.
+
+Each build runs `pdflatex` (via `coop.latex.compile_pdf`, which precompiles
+the preamble and enforces a timeout) in its own scratch directory, so
+concurrent builds (in this process or another) never touch each other's .tex,
+.aux or .log files. Only a complete PDF from a `pdflatex` that exited by
+itself (i.e., was not killed) is renamed into place, atomically, and the
+scratch directory is then deleted.
+
+The built PDFs are a cache: after each build, `enforce_retention` deletes the
+least recently used ones (serving a PDF marks it as used) until at most
+`settings.PDF_CACHE_MAX_FILES` remain, taking up at most
+`settings.PDF_CACHE_MAX_BYTES`. It also deletes the scratch directories of
+builds whose process died and, next to `BUILDS_DIR`, the dated build
+directories of an older layout (`latex-YYYY-MM-DD`), and nothing else that it
+does not recognize.
+
+"""
+
+import os
+import re
+import time
+import errno
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+import Queue
+
+from django.conf import settings
+
+from coop.latex import compile_pdf
+from coop.storage import makedirs
+
+logger = logging.getLogger(__name__)
+
+BUILDS_DIR = getattr(settings, 'PDF_BUILDS_PATH', os.path.join('latex',
+    'builds'))
+BUILD_FILENAME = 'membership-list'
+SCRATCH_PREFIX = '.build-'
+MARKER_SUFFIX = '.building'
+
+# The build directories of an older layout, which were kept next to
+# `BUILDS_DIR` (in its parent directory, latex/) and are deleted.
+old_build_dir_regex = re.compile(r'^latex-\d{4}-\d{2}-\d{2}$')
+
+# Scratch directories older than this many seconds were left behind by a
+# process that died during a build.
+STALE_SCRATCH_AGE = 60 * 60
+
+# A source whose build failed is not built again for this many seconds.
+FAILED_RETRY_AGE = 60
+
+# Build states
+PENDING = 'pending'
+BUILDING = 'building'
+DONE = 'done'
+FAILED = 'failed'
+
+_queue = Queue.Queue()
+_states = {}
+_states_lock = threading.Lock()
+_workers = []
+
+
+def get_source_hash(source):
+    """Return the hash that identifies the build of the LaTeX `source`."""
+    if isinstance(source, unicode):
+        source = source.encode('utf8')
+    return hashlib.sha1(source).hexdigest()
+
+
+def get_pdf_path(source_hash):
+    return os.path.join(BUILDS_DIR, '%s.pdf' % source_hash)
+
+
+def get_marker_path(source_hash):
+    return os.path.join(BUILDS_DIR, '%s%s' % (source_hash, MARKER_SUFFIX))
+
+
+def get_stale_marker_age():
+    """Return the age, in seconds, beyond which the marker of a build that is
+    still in progress was left behind by a process that died. A build runs
+    `pdflatex` at most three times (to precompile the preamble, with it and
+    without it), each for at most `settings.PDF_BUILD_TIMEOUT` seconds.
+
+    """
+
+    return getattr(settings, 'PDF_BUILD_TIMEOUT', 120) * 3 + 60
+
+
+def read_marker(source_hash):
+    """Return a 2-tuple: the state recorded in the marker of the build
+    identified by `source_hash` (`BUILDING` or `FAILED`) and its age in
+    seconds, or (`None`, `None`) if there is no marker.
+
+    """
+
+    path = get_marker_path(source_hash)
+    try:
+        with open(path, 'rb') as f:
+            state = f.read().strip()
+        age = time.time() - os.path.getmtime(path)
+    except (IOError, OSError):
+        return None, None
+    return (FAILED if state == FAILED else BUILDING), age
+
+
+def claim_build(source_hash):
+    """Create the marker of the build identified by `source_hash`, replacing
+    a stale one. Return `False` if another process holds it, i.e., is
+    building the PDF or failed to lately.
+
+    """
+
+    makedirs(BUILDS_DIR)
+    path = get_marker_path(source_hash)
+    for _ in range(2):
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0644)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+            state, age = read_marker(source_hash)
+            if state == BUILDING and age < get_stale_marker_age():
+                return False
+            if state == FAILED and age < FAILED_RETRY_AGE:
+                return False
+            remove_marker(source_hash)
+            continue
+        try:
+            os.write(fd, BUILDING)
+        finally:
+            os.close(fd)
+        return True
+    return False
+
+
+def mark_failed(source_hash):
+    """Record in the marker of the build identified by `source_hash` that it
+    failed.
+
+    """
+
+    try:
+        with open(get_marker_path(source_hash), 'wb') as f:
+            f.write(FAILED)
+    except IOError:
+        logger.exception('Could not mark the build of %s as failed.',
+            source_hash)
+
+
+def remove_marker(source_hash):
+    try:
+        os.remove(get_marker_path(source_hash))
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+
+
+def touch(source_hash):
+    """Mark the PDF identified by `source_hash` as recently used, so that it
+    is evicted last.
+
+    """
+
+    try:
+        os.utime(get_pdf_path(source_hash), None)
+    except OSError:
+        pass
+
+
+def get_build_status(source_hash):
+    """Return the state of the build identified by `source_hash`, or `None`
+    if there is no such PDF on disk and no process is building it.
+
+    """
+
+    if os.path.isfile(get_pdf_path(source_hash)):
+        return DONE
+    with _states_lock:
+        state = _states.get(source_hash)
+    if state in (PENDING, BUILDING):
+        return state
+    marker_state, age = read_marker(source_hash)
+    if marker_state == BUILDING and age < get_stale_marker_age():
+        return BUILDING
+    if marker_state == FAILED:
+        return FAILED
+    return None
+
+
+def request_build(source):
+    """Make sure that the PDF of the LaTeX `source` is built or being built.
+    Return a 2-tuple: the source's hash and the build's state.
+
+    """
+
+    source_hash = get_source_hash(source)
+    if os.path.isfile(get_pdf_path(source_hash)):
+        touch(source_hash)
+        return source_hash, DONE
+    with _states_lock:
+        state = _states.get(source_hash)
+        if state in (PENDING, BUILDING):
+            return source_hash, state
+        claimed = claim_build(source_hash)
+        if claimed:
+            _states[source_hash] = PENDING
+            start_workers()
+    if not claimed:
+        # Another process is building it (or has just built it), or failed
+        # to lately.
+        return source_hash, get_build_status(source_hash) or BUILDING
+    _queue.put((source_hash, source))
+    return source_hash, PENDING
+
+
+def start_workers():
+    """Start the worker threads, if they are not running yet. The caller must
+    hold `_states_lock`.
+
+    """
+
+    if _workers:
+        return
+    for index in range(getattr(settings, 'PDF_BUILD_WORKERS', 1)):
+        worker = threading.Thread(target=work,
+            name='coop-pdf-build-%d' % index)
+        worker.daemon = True
+        worker.start()
+        _workers.append(worker)
+
+
+def set_state(source_hash, state):
+    with _states_lock:
+        _states[source_hash] = state
+
+
+def work():
+    """Build the PDFs in the queue, one at a time, forever."""
+    while True:
+        source_hash, source = _queue.get()
+        try:
+            set_state(source_hash, BUILDING)
+            # The marker's age counts from the start of the build, not from
+            # when it was queued.
+            try:
+                os.utime(get_marker_path(source_hash), None)
+            except OSError:
+                pass
+            if os.path.isfile(get_pdf_path(source_hash)) or build(
+                    source_hash, source):
+                set_state(source_hash, DONE)
+                remove_marker(source_hash)
+                enforce_retention(keep=source_hash)
+            else:
+                set_state(source_hash, FAILED)
+                mark_failed(source_hash)
+        except Exception:
+            logger.exception('Building the PDF %s failed.', source_hash)
+            set_state(source_hash, FAILED)
+            mark_failed(source_hash)
+        finally:
+            _queue.task_done()
+
+
+def build(source_hash, source):
+    """Typeset `source` in a scratch directory of its own and, if that
+    produced a complete PDF, rename the PDF into place at
+    `get_pdf_path(source_hash)`. The rename is atomic, so no one ever sees a
+    half-written PDF. The scratch directory, with the intermediate files, is
+    always deleted. Return `True` if the PDF was built.
+
+    """
+
+    makedirs(BUILDS_DIR)
+    scratch_dir = tempfile.mkdtemp(prefix='%s%s-' % (SCRATCH_PREFIX,
+        source_hash), dir=BUILDS_DIR)
+    try:
+        pdf_path = compile_pdf(source, scratch_dir, BUILD_FILENAME,
+            precompiled=getattr(settings, 'PDF_PRECOMPILED_PREAMBLE', True))
+        if not pdf_path:
+            logger.error('Building the PDF %s failed.', source_hash)
+            return False
+        os.rename(pdf_path, get_pdf_path(source_hash))
+        return True
+    finally:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+
+
+################################################################################
+# Retention
+################################################################################
+
+def delete_old_build_dirs():
+    """Delete the build directories of the older layout (see
+    `old_build_dir_regex`).
+
+    """
+
+    parent = os.path.dirname(os.path.abspath(BUILDS_DIR))
+    try:
+        names = os.listdir(parent)
+    except OSError:
+        return
+    for name in names:
+        path = os.path.join(parent, name)
+        if old_build_dir_regex.match(name) and os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def enforce_retention(keep=None, now=None):
+    """Delete built PDFs, least recently used first, until there are at most
+    `settings.PDF_CACHE_MAX_FILES` of them, totalling at most
+    `settings.PDF_CACHE_MAX_BYTES`, never deleting the one identified by
+    `keep`. Also delete stale scratch directories and build markers, and
+    the build directories of the older layout. Return the number of PDFs
+    deleted.
+
+    """
+
+    max_files = getattr(settings, 'PDF_CACHE_MAX_FILES', 20)
+    max_bytes = getattr(settings, 'PDF_CACHE_MAX_BYTES', 50000000)
+    now = now or time.time()
+    try:
+        names = os.listdir(BUILDS_DIR)
+    except OSError:
+        return 0
+    pdfs = []
+    for name in names:
+        path = os.path.join(BUILDS_DIR, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        if name.startswith(SCRATCH_PREFIX):
+            if now - stat.st_mtime > STALE_SCRATCH_AGE:
+                shutil.rmtree(path, ignore_errors=True)
+        elif name.endswith(MARKER_SUFFIX):
+            if now - stat.st_mtime > get_stale_marker_age():
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        elif name.endswith('.pdf'):
+            pdfs.append((stat.st_mtime, stat.st_size, name))
+    delete_old_build_dirs()
+    # Most recently used first, but the one to keep before all others.
+    pdfs.sort(key=lambda pdf: (pdf[2] == '%s.pdf' % keep, pdf[0]),
+        reverse=True)
+    kept_files = 0
+    kept_bytes = 0
+    evicted = 0
+    for _, size, name in pdfs:
+        if name == '%s.pdf' % keep or (kept_files < max_files and
+                kept_bytes + size <= max_bytes):
+            kept_files += 1
+            kept_bytes += size
+            continue
+        try:
+            os.remove(os.path.join(BUILDS_DIR, name))
+            evicted += 1
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+    return evicted
@@ -0,0 +1,204 @@
+"""A small PDF writer, in pure Python, for text, lines and rectangles.
+
+It uses the standard Helvetica fonts, which every PDF viewer has, so no fonts
+are embedded; text is encoded as Windows-1252 (characters outside of it are
+replaced by "?"). `text_width` measures strings with Helvetica's metrics and
+`wrap` breaks them into lines that fit a width.
+
+Pages are drawn on a `Canvas` and passed to `PdfWriter.page`, which returns
+the bytes of the page straight away, so that a document can be streamed to
+the client page by page; `PdfWriter.finish` returns the page tree, catalog,
+cross-reference table and trailer, which must come last.
+
+"""
+
+import zlib
+
+# Page sizes, in points (1/72 inch).
+A4_LANDSCAPE = (842, 595)
+LETTER_LANDSCAPE = (792, 612)
+
+REGULAR = 'F1'
+BOLD = 'F2'
+FONTS = ((REGULAR, 'Helvetica'), (BOLD, 'Helvetica-Bold'))
+
+# The widths, in thousandths of the font size, of the printable ASCII
+# characters (from ' ' to '~') in Helvetica and Helvetica-Bold. Other
+# characters are taken to be as wide as a digit.
+HELVETICA_WIDTHS = (
+    278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333,
+    278, 278, 556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278,
+    584, 584, 584, 556, 1015, 667, 667, 722, 722, 667, 611, 778, 722, 278,
+    500, 667, 556, 833, 722, 778, 667, 778, 722, 667, 611, 722, 667, 944,
+    667, 667, 611, 278, 278, 278, 469, 556, 333, 556, 556, 500, 556, 556,
+    278, 556, 556, 222, 222, 500, 222, 833, 556, 556, 556, 556, 333, 500,
+    278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584)
+HELVETICA_BOLD_WIDTHS = (
+    278, 333, 474, 556, 556, 889, 722, 238, 333, 333, 389, 584, 278, 333,
+    278, 278, 556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 333, 333,
+    584, 584, 584, 611, 975, 722, 722, 722, 722, 667, 611, 778, 722, 278,
+    556, 722, 611, 833, 722, 778, 667, 778, 722, 667, 611, 722, 667, 944,
+    667, 667, 611, 333, 278, 333, 584, 556, 333, 556, 611, 556, 611, 556,
+    333, 611, 611, 278, 278, 556, 278, 889, 611, 611, 611, 611, 389, 556,
+    333, 611, 556, 778, 556, 556, 500, 389, 280, 389, 584)
+DEFAULT_WIDTH = 556
+
+
+def text_width(text, size, font=REGULAR):
+    """Return the width, in points, of `text` set in `font` at `size`."""
+    widths = HELVETICA_BOLD_WIDTHS if font == BOLD else HELVETICA_WIDTHS
+    total = 0
+    for char in text:
+        index = ord(char) - 32
+        total += widths[index] if 0 <= index < len(widths) else DEFAULT_WIDTH
+    return total * size / 1000.0
+
+
+def wrap(text, width, size, font=REGULAR):
+    """Return `text` broken into lines no wider than `width` points, at
+    spaces where possible.
+
+    """
+
+    lines = []
+    for paragraph in text.split(u'\n'):
+        line = u''
+        for word in paragraph.split(u' '):
+            candidate = u'%s %s' % (line, word) if line else word
+            if text_width(candidate, size, font) <= width:
+                line = candidate
+                continue
+            if line:
+                lines.append(line)
+            # Break words that are wider than a line on their own.
+            while text_width(word, size, font) > width and len(word) > 1:
+                cut = len(word) - 1
+                while cut > 1 and text_width(word[:cut], size, font) > width:
+                    cut -= 1
+                lines.append(word[:cut])
+                word = word[cut:]
+            line = word
+        lines.append(line)
+    return lines
+
+
+def encode_text(text):
+    """Return `text` as a PDF string literal."""
+    data = text.encode('cp1252', 'replace')
+    return b'(%s)' % data.replace(b'\\', b'\\\\').replace(b'(', b'\\(')\
+        .replace(b')', b'\\)').replace(b'\r', b'').replace(b'\n', b' ')
+
+
+class Canvas(object):
+    """The drawing operations of one page. Coordinates are in points, from
+    the bottom left corner.
+
+    """
+
+    def __init__(self):
+        self.operations = []
+
+    def text(self, x, y, text, size, font=REGULAR):
+        self.operations.append(b'BT /%s %.2f Tf %.2f %.2f Td %s Tj ET' % (
+            font, size, x, y, encode_text(text)))
+
+    def line(self, x1, y1, x2, y2, width=0.5):
+        self.operations.append(b'%.2f w %.2f %.2f m %.2f %.2f l S' % (
+            width, x1, y1, x2, y2))
+
+    def rect(self, x, y, width, height, line_width=0.5):
+        self.operations.append(b'%.2f w %.2f %.2f %.2f %.2f re S' % (
+            line_width, x, y, width, height))
+
+    def get_content(self):
+        return b'\n'.join(self.operations)
+
+
+class PdfWriter(object):
+    """Writes a PDF document of pages of size `page_size` (a (width, height)
+    tuple, in points), one page at a time.
+
+    """
+
+    # Object ids: 1 is the catalog, 2 the page tree, then the fonts.
+    CATALOG_ID = 1
+    PAGES_ID = 2
+
+    def __init__(self, page_size=A4_LANDSCAPE):
+        self.page_size = page_size
+        self.offset = 0
+        self.offsets = {}
+        self.page_ids = []
+        self.font_ids = {}
+        self.next_id = self.PAGES_ID + 1
+
+    def allocate_id(self):
+        object_id = self.next_id
+        self.next_id += 1
+        return object_id
+
+    def write_object(self, object_id, body):
+        """Return the bytes of object `object_id`, whose content is `body`,
+        and record its offset for the cross-reference table.
+
+        """
+
+        data = b'%d 0 obj\n%s\nendobj\n' % (object_id, body)
+        self.offsets[object_id] = self.offset
+        self.offset += len(data)
+        return data
+
+    def start(self):
+        """Return the header and the font objects."""
+        # The comment with bytes above 127 marks the file as binary.
+        data = [b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n']
+        self.offset = len(data[0])
+        for name, base_font in FONTS:
+            self.font_ids[name] = self.allocate_id()
+            data.append(self.write_object(self.font_ids[name],
+                b'<< /Type /Font /Subtype /Type1 /BaseFont /%s'
+                b' /Encoding /WinAnsiEncoding >>' % base_font))
+        return b''.join(data)
+
+    def page(self, canvas):
+        """Return the bytes of a page with the drawing on `canvas`."""
+        content = zlib.compress(canvas.get_content())
+        content_id = self.allocate_id()
+        page_id = self.allocate_id()
+        self.page_ids.append(page_id)
+        fonts = b' '.join(b'/%s %d 0 R' % (name, self.font_ids[name]) for
+            name, _ in FONTS)
+        return b''.join([
+            self.write_object(content_id,
+                b'<< /Length %d /Filter /FlateDecode >>\nstream\n%s\n'
+                b'endstream' % (len(content), content)),
+            self.write_object(page_id,
+                b'<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %d %d]'
+                b' /Resources << /Font << %s >> >> /Contents %d 0 R >>' % (
+                    self.PAGES_ID, self.page_size[0], self.page_size[1],
+                    fonts, content_id))
+        ])
+
+    def finish(self):
+        """Return the page tree, the catalog, the cross-reference table and
+        the trailer.
+
+        """
+
+        data = [
+            self.write_object(self.PAGES_ID,
+                b'<< /Type /Pages /Kids [%s] /Count %d >>' % (
+                    b' '.join(b'%d 0 R' % page_id for page_id in
+                        self.page_ids), len(self.page_ids))),
+            self.write_object(self.CATALOG_ID,
+                b'<< /Type /Catalog /Pages %d 0 R >>' % self.PAGES_ID)
+        ]
+        xref_offset = self.offset
+        count = self.next_id
+        xref = [b'xref\n0 %d\n0000000000 65535 f \n' % count]
+        for object_id in range(1, count):
+            xref.append(b'%010d 00000 n \n' % self.offsets[object_id])
+        data.append(b''.join(xref))
+        data.append(b'trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n'
+            b'%%%%EOF\n' % (count, self.CATALOG_ID, xref_offset))
+        return b''.join(data)
@@ -0,0 +1,168 @@
+"""Snapshots of what each user may do.
+
+The permission checks in the views (e.g., whether a user may edit a committee
+or manage the participation requirements) depend on the committees that the
+user's person is on and chairs. `get_permissions` returns a `Permissions`
+snapshot of these, which is computed with one query when the user logs in
+(see `coop.signals`) and kept in the session, so later requests do not query
+for it at all. Within a request, the snapshot is memoized on the request.
+
+The snapshot in the session is stamped with the permissions' `Version`, a
+row in the database, which the signal receivers bump (see `bump_version`)
+whenever a person, a committee or the members of a committee change; a
+snapshot with an older stamp is computed afresh. The version is read once per
+request, by primary key, so that a change made through one process is seen
+by all others straight away (a per-process cache would let them go on
+granting rights that were taken away).
+
+Superuser status comes from the user, which the authentication middleware
+loads on every request anyway, rather than from the session, so that it takes
+effect straight away. Superusers may do everything, so no snapshot is kept
+for them; anonymous users may do nothing, so none is kept for them either.
+
+"""
+
+from collections import namedtuple
+
+from django.db import transaction, IntegrityError
+from django.db.models import F
+
+from coop.cache import memoize_on_request
+from coop.membership import PARTICIPATION_COMMITTEE
+from coop.models import Committee, Version
+
+SESSION_KEY = '_coop_permissions'
+
+# The name of the `Version` that the snapshots are stamped with.
+VERSION_NAME = 'permissions'
+
+# The chairs of the participation committee and of this one may edit every
+# committee.
+MEMBERSHIP_COMMITTEE = 'Membership'
+
+
+class Permissions(namedtuple('Permissions', 'is_superuser committee_ids'
+        ' chaired_committee_ids is_participation_chair is_membership_chair')):
+    """What a user may do: `committee_ids` and `chaired_committee_ids` are
+    frozensets of the ids of the committees that the user's person is on and
+    (of those) chairs.
+
+    """
+
+    __slots__ = ()
+
+    def can_edit_committee(self, committee):
+        """Superusers, members of `committee` and chairs of the Participation
+        and Membership committees can edit `committee`.
+
+        """
+
+        return (self.is_superuser or committee.id in self.committee_ids or
+            self.is_participation_chair or self.is_membership_chair)
+
+    def can_manage_participation(self):
+        """Superusers and the participation chair can create, edit and export
+        the participation requirements and view every member's participation
+        record.
+
+        """
+
+        return self.is_superuser or self.is_participation_chair
+
+
+def get_permissions(request):
+    """Return the `Permissions` of `request.user`."""
+    return memoize_on_request(request, '_coop_permissions',
+        lambda: load_permissions(request))
+
+
+def load_permissions(request):
+    user = request.user
+    if user.is_superuser:
+        # Superusers may do everything, so their committees do not matter.
+        return Permissions(True, frozenset(), frozenset(), False, False)
+    if not user.is_authenticated():
+        return Permissions(False, frozenset(), frozenset(), False, False)
+    version = get_version()
+    session = getattr(request, 'session', None)
+    snapshot = session.get(SESSION_KEY) if session is not None else None
+    if (not snapshot or snapshot.get('version') != version or
+            snapshot.get('user_id') != user.id):
+        snapshot = build_snapshot(user, version)
+        if session is not None:
+            session[SESSION_KEY] = snapshot
+    return Permissions(
+        is_superuser=False,
+        committee_ids=frozenset(snapshot['committee_ids']),
+        chaired_committee_ids=frozenset(snapshot['chaired_committee_ids']),
+        is_participation_chair=snapshot['is_participation_chair'],
+        is_membership_chair=snapshot['is_membership_chair'])
+
+
+def get_version():
+    """Return the current version of the permissions (one query)."""
+    versions = list(Version.objects.filter(name=VERSION_NAME)
+        .values_list('version', flat=True)[:1])
+    return versions[0] if versions else 0
+
+
+def bump_version():
+    """Bump the version of the permissions, so that every snapshot is
+    computed afresh, in every process. The signal receivers call this after
+    a person, a committee or a committee's members are saved (in autocommit
+    mode, unless the caller wraps the change in a transaction), so a snapshot
+    may be built from the changed data under the old version in between; it
+    is discarded at the bump.
+
+    """
+
+    bumped = Version.objects.filter(name=VERSION_NAME)\
+        .update(version=F('version') + 1)
+    if bumped:
+        return
+    try:
+        with transaction.atomic():
+            Version.objects.create(name=VERSION_NAME, version=1)
+    except IntegrityError:
+        # Another process created it in the meantime.
+        Version.objects.filter(name=VERSION_NAME)\
+            .update(version=F('version') + 1)
+
+
+def build_snapshot(user, version):
+    """Return the session's record of the committees that `user`'s person is
+    on and chairs, stamped with `version`. This costs one query (none for an
+    anonymous user).
+
+    """
+
+    committee_ids = []
+    chaired = {}
+    if user.is_authenticated():
+        for committee_id, name, chair_id, person_id in Committee.members\
+                .through.objects\
+                .filter(person__user_id=user.id)\
+                .values_list('committee_id', 'committee__name',
+                    'committee__chair_id', 'person_id'):
+            committee_ids.append(committee_id)
+            if chair_id == person_id:
+                chaired[committee_id] = name
+    return {
+        'version': version,
+        'user_id': user.id,
+        'committee_ids': committee_ids,
+        'chaired_committee_ids': chaired.keys(),
+        'is_participation_chair': PARTICIPATION_COMMITTEE in chaired.values(),
+        'is_membership_chair': MEMBERSHIP_COMMITTEE in chaired.values()
+    }
+
+
+def refresh_permissions(request, user):
+    """Store a fresh snapshot of `user`'s permissions in `request`'s session,
+    e.g., when `user` logs in.
+
+    """
+
+    request.session[SESSION_KEY] = build_snapshot(user, get_version())
+    if hasattr(request, '_coop_permissions'):
+        del request._coop_permissions
@@ -0,0 +1,365 @@
+"""Full-text search of the posts, pages, files, meeting minutes, committees
+and members.
+
+Each searchable object has one `SearchDocument`, which holds its title, its
+text, its URL and whether people who are not logged in may find it. The
+signal receivers in coop/signals.py call `index_object` and `unindex_object`
+when objects are saved and deleted, so the index is updated one document at
+a time. The `rebuild_search_index` management command indexes everything from
+scratch; run it after loading fixtures, since that bypasses the signals.
+
+How documents are matched and ranked depends on the database:
+
+- PostgreSQL: the `search_vector` column (a `tsvector` with a GIN index, in
+  which titles weigh more than bodies) is matched against `plainto_tsquery`
+  and ranked by `ts_rank`.
+- SQLite: an FTS5 table (with the Porter stemmer), whose rowids are the ids of
+  the documents, is matched and ranked by `bm25`.
+- Anything else, or an SQLite built without FTS5: `LIKE` queries, newest
+  first.
+
+"""
+
+import re
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.urlresolvers import reverse, NoReverseMatch
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from coop.models import (SearchDocument, Post, Page, File, MeetingMinutes,
+    Committee, Person)
+
+FTS_TABLE = 'coop_searchdocument_fts'
+
+# Backends
+POSTGRESQL = 'postgresql'
+FTS5 = 'fts5'
+LIKE = 'like'
+
+# Only this many words of a query are searched for.
+MAX_TERMS = 10
+
+# The length, in characters, of the excerpts shown with the results.
+SNIPPET_LENGTH = 200
+
+# SQLite limits the number of parameters in a query.
+BATCH_SIZE = 500
+
+
+################################################################################
+# Documents
+################################################################################
+
+def get_url(viewname, fallback, **kwargs):
+    """Return the URL of `viewname` with `kwargs`, or that of `fallback` if
+    the kwargs do not fit the URL pattern (e.g., a name with spaces).
+
+    """
+
+    try:
+        return reverse(viewname, kwargs=kwargs)
+    except NoReverseMatch:
+        return reverse(fallback)
+
+
+def describe_post(post):
+    forum = post.thread and post.thread.forum
+    if not (forum and forum.url_name):
+        return None
+    return {
+        'title': post.subject,
+        'body': post.post,
+        'url': u'%s?post=%d' % (get_url('coop:thread', 'coop:forums',
+            url_name=forum.url_name, pk=post.thread_id), post.pk),
+        'public': False
+    }
+
+
+def describe_page(page):
+    if page.url_title:
+        url = get_url('coop:page_by_url_title', 'coop:pages',
+            url_title=page.url_title)
+    else:
+        url = reverse('coop:page', kwargs={'pk': page.pk})
+    return {
+        'title': page.title,
+        'body': page.content,
+        'url': url,
+        'public': page.public
+    }
+
+
+def describe_file(file):
+    # The detail page of a file requires logging in, so public files link
+    # straight to their data.
+    if file.public:
+        url = get_url('coop:file_data', 'coop:files', path=file.path)
+    else:
+        url = reverse('coop:file', kwargs={'pk': file.pk})
+    return {
+        'title': file.name,
+        'body': file.description,
+        'url': url,
+        'public': file.public
+    }
+
+
+def get_committee_url(committee):
+    if committee.url_name:
+        return get_url('coop:committee_by_url_name', 'coop:committees',
+            url_name=committee.url_name)
+    return reverse('coop:committees')
+
+
+def describe_minutes(minutes):
+    return {
+        'title': unicode(minutes),
+        'body': minutes.minutes,
+        'url': get_committee_url(minutes.committee),
+        'public': False
+    }
+
+
+def describe_committee(committee):
+    return {
+        'title': committee.name,
+        'body': committee.description,
+        'url': get_committee_url(committee),
+        'public': False
+    }
+
+
+def describe_person(person):
+    # Only members have pages; their children are not searchable.
+    if not person.member:
+        return None
+    return {
+        'title': u'%s %s' % (person.first_name, person.last_name),
+        'body': u'',
+        'url': get_url('coop:member_by_full_name', 'coop:members',
+            full_name=u'%s_%s' % (person.last_name, person.first_name)),
+        'public': False
+    }
+
+
+# Maps each kind of `SearchDocument` to a 3-tuple: the model it indexes, a
+# function that returns the document's fields for an instance (or `None` if
+# the instance should not be found) and the relations that function follows.
+INDEXED_MODELS = OrderedDict([
+    ('post', (Post, describe_post, ('thread__forum',))),
+    ('page', (Page, describe_page, ())),
+    ('file', (File, describe_file, ())),
+    ('minutes', (MeetingMinutes, describe_minutes, ('committee',))),
+    ('committee', (Committee, describe_committee, ())),
+    ('person', (Person, describe_person, ())),
+])
+
+KINDS_BY_MODEL = dict((model, kind) for kind, (model, _, _) in
+    INDEXED_MODELS.items())
+
+
+################################################################################
+# Indexing
+################################################################################
+
+def index_object(instance):
+    """Create or update the search document of `instance`, an instance of one
+    of the models in `INDEXED_MODELS`.
+
+    """
+
+    kind = KINDS_BY_MODEL[type(instance)]
+    fields = INDEXED_MODELS[kind][1](instance)
+    if fields is None:
+        unindex_object(instance)
+        return
+    fields['title'] = fields['title'][:255]
+    with transaction.atomic():
+        document, _ = SearchDocument.objects.update_or_create(kind=kind,
+            object_id=instance.pk, defaults=fields)
+        sync_text_index([document.id])
+
+
+def unindex_object(instance):
+    """Delete the search document of `instance`, if it has one."""
+    documents = SearchDocument.objects.filter(
+        kind=KINDS_BY_MODEL[type(instance)], object_id=instance.pk)
+    with transaction.atomic():
+        document_ids = list(documents.values_list('id', flat=True))
+        if document_ids:
+            documents.delete()
+            sync_text_index(document_ids)
+
+
+def reindex(queryset):
+    """Update the search documents of the objects in `queryset`, e.g., after
+    a change to an object that their URLs or titles depend on.
+
+    """
+
+    related = INDEXED_MODELS[KINDS_BY_MODEL[queryset.model]][2]
+    if related:
+        queryset = queryset.select_related(*related)
+    for instance in queryset:
+        index_object(instance)
+
+
+def rebuild_index():
+    """Replace the whole search index with documents for every searchable
+    object. Return the number of documents.
+
+    """
+
+    documents = []
+    for kind, (model, describe, related) in INDEXED_MODELS.items():
+        queryset = model.objects.all()
+        if related:
+            queryset = queryset.select_related(*related)
+        for instance in queryset.iterator():
+            fields = describe(instance)
+            if fields is not None:
+                fields['title'] = fields['title'][:255]
+                documents.append(SearchDocument(kind=kind,
+                    object_id=instance.pk, **fields))
+    with transaction.atomic():
+        SearchDocument.objects.all().delete()
+        SearchDocument.objects.bulk_create(documents, batch_size=BATCH_SIZE)
+        sync_text_index()
+    return len(documents)
+
+
+def sync_text_index(document_ids=None):
+    """Bring the database-specific text index up to date with the documents
+    whose ids are in `document_ids` (including deleted ones), or with all of
+    them if `document_ids` is `None`.
+
+    """
+
+    backend = get_backend()
+    cursor = connection.cursor()
+    if backend == POSTGRESQL:
+        sql = ('UPDATE coop_searchdocument SET search_vector ='
+            ' setweight(to_tsvector(%s::regconfig, title), \'A\') ||'
+            ' setweight(to_tsvector(%s::regconfig, body), \'B\')')
+        params = [settings.SEARCH_CONFIG] * 2
+        if document_ids is not None:
+            sql += ' WHERE id = ANY(%s)'
+            params.append(list(document_ids))
+        cursor.execute(sql, params)
+    elif backend == FTS5:
+        insert = ('INSERT INTO %s (rowid, title, body)'
+            ' SELECT id, title, body FROM coop_searchdocument' % FTS_TABLE)
+        if document_ids is None:
+            cursor.execute('DELETE FROM %s' % FTS_TABLE)
+            cursor.execute(insert)
+            return
+        document_ids = list(document_ids)
+        for start in range(0, len(document_ids), BATCH_SIZE):
+            batch = document_ids[start:start + BATCH_SIZE]
+            placeholders = ', '.join(['%s'] * len(batch))
+            cursor.execute('DELETE FROM %s WHERE rowid IN (%s)' % (
+                FTS_TABLE, placeholders), batch)
+            cursor.execute('%s WHERE id IN (%s)' % (insert, placeholders),
+                batch)
+
+
+_fts_tables = {}
+
+
+def get_backend():
+    """Return the search backend that the database supports: `POSTGRESQL`,
+    `FTS5` or `LIKE`.
+
+    """
+
+    if connection.vendor == 'postgresql':
+        return POSTGRESQL
+    if connection.vendor == 'sqlite':
+        name = connection.settings_dict['NAME']
+        if name not in _fts_tables:
+            _fts_tables[name] = (FTS_TABLE in
+                connection.introspection.table_names())
+        if _fts_tables[name]:
+            return FTS5
+    return LIKE
+
+
+################################################################################
+# Searching
+################################################################################
+
+def get_terms(query):
+    return re.findall(r'\w+', query, re.UNICODE)[:MAX_TERMS]
+
+
+def search(query, include_private=False, limit=50):
+    """Return up to `limit` `SearchDocument`s that contain all of the words in
+    `query`, best match first. Unless `include_private` is true, only public
+    documents are returned. Each document gets a `snippet` attribute: an HTML
+    excerpt of its body with the words highlighted.
+
+    """
+
+    terms = get_terms(query)
+    if not terms:
+        return []
+    backend = get_backend()
+    if backend == POSTGRESQL:
+        documents = SearchDocument.objects.raw(
+            'SELECT d.* FROM coop_searchdocument d,'
+            ' plainto_tsquery(%s::regconfig, %s) query'
+            ' WHERE d.search_vector @@ query AND (d.public OR %s)'
+            ' ORDER BY ts_rank(d.search_vector, query) DESC, d.id DESC'
+            ' LIMIT %s',
+            [settings.SEARCH_CONFIG, u' '.join(terms), include_private,
+                limit])
+    elif backend == FTS5:
+        # Quoted, each word is matched literally (but stemmed), and the
+        # words are ANDed together. Titles weigh ten times more than bodies.
+        documents = SearchDocument.objects.raw(
+            'SELECT d.* FROM {0} JOIN coop_searchdocument d'
+            ' ON d.id = {0}.rowid'
+            ' WHERE {0} MATCH %s AND (d.public OR %s)'
+            ' ORDER BY bm25({0}, 10.0, 1.0), d.id DESC'
+            ' LIMIT %s'.format(FTS_TABLE),
+            [u' '.join(u'"%s"' % term for term in terms), include_private,
+                limit])
+    else:
+        match = Q()
+        for term in terms:
+            match &= Q(title__icontains=term) | Q(body__icontains=term)
+        documents = SearchDocument.objects.filter(match)
+        if not include_private:
+            documents = documents.filter(public=True)
+        documents = documents.order_by('-datetime_indexed')[:limit]
+    documents = list(documents)
+    for document in documents:
+        document.snippet = get_snippet(document.body, terms)
+    return documents
+
+
+def get_snippet(text, terms, length=SNIPPET_LENGTH):
+    """Return an HTML excerpt of `text`, starting a little before the first
+    occurrence of any of `terms`, with the terms wrapped in <mark> tags.
+
+    """
+
+    pattern = re.compile(r'\b(?:%s)' % '|'.join(re.escape(term) for term in
+        terms), re.IGNORECASE | re.UNICODE)
+    match = pattern.search(text)
+    start = max(0, match.start() - length // 4) if match else 0
+    excerpt = text[start:start + length]
+    parts = [u'&hellip; '] if start else []
+    position = 0
+    for match in pattern.finditer(excerpt):
+        parts.append(escape(excerpt[position:match.start()]))
+        parts.append(u'<mark>%s</mark>' % escape(match.group()))
+        position = match.end()
+    parts.append(escape(excerpt[position:]))
+    if start + length < len(text):
+        parts.append(u' &hellip;')
+    return mark_safe(u''.join(parts))
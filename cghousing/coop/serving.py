@@ -0,0 +1,237 @@
+"""Serving uploaded files.
+
+`serve_file` streams a file from disk in fixed-size chunks, so that even the
+largest uploads never have to be held in a worker's memory. It supports:
+
+- conditional GETs (`If-None-Match` and `If-Modified-Since`), answered with
+  304 Not Modified,
+- single byte ranges (`Range`, optionally with `If-Range`), answered with 206
+  Partial Content, so that audio and video players can seek, and
+- handing the transfer off to the front-end web server altogether, via
+  nginx's `X-Accel-Redirect` or Apache/lighttpd's `X-Sendfile`, when
+  `settings.FILE_SERVE_MODE` says so. Django then only does the
+  authorization check.
+
+Files that Django streams itself hold one of `settings.MAX_FILE_STREAMS`
+slots per process until the transfer finishes. When they are all taken,
+further downloads get 503 Service Unavailable (with Retry-After) straight
+away, so that slow downloads never occupy all of a worker's threads and page
+views always have some left.
+
+"""
+
+import os
+import re
+import calendar
+import threading
+
+from django.conf import settings
+from django.http import (HttpResponse, HttpResponseNotModified,
+    StreamingHttpResponse)
+from django.utils.http import http_date, parse_http_date_safe
+
+CHUNK_SIZE = 64 * 1024
+
+SERVE_MODE_DJANGO = 'django'
+SERVE_MODE_X_ACCEL_REDIRECT = 'x-accel-redirect'
+SERVE_MODE_X_SENDFILE = 'x-sendfile'
+
+# Seconds after which clients are asked to retry a download that was turned
+# away because all of the stream slots were taken.
+RETRY_AFTER = 10
+
+range_regex = re.compile(r'^\s*bytes\s*=\s*(\d*)\s*-\s*(\d*)\s*$', re.I)
+
+_stream_slots = None
+_stream_slots_lock = threading.Lock()
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def get_etag(size, modified):
+    """Return an ETag for a file of `size` bytes last modified at the
+    datetime `modified`.
+
+    """
+
+    return '"%x-%x"' % (size, get_timestamp(modified) if modified else 0)
+
+
+def get_timestamp(datetime_):
+    return calendar.timegm(datetime_.utctimetuple())
+
+
+def is_not_modified(request, etag, last_modified):
+    """Return `True` if the client's cached copy, as described by the
+    conditional request headers, is still current. `If-None-Match` takes
+    precedence over `If-Modified-Since`, as per RFC 7232.
+
+    """
+
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match and etag:
+        etags = [e.strip() for e in if_none_match.split(',')]
+        return etag in etags or '*' in etags
+    if_modified_since = parse_http_date_safe(
+        request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    if if_modified_since and last_modified:
+        return get_timestamp(last_modified) <= if_modified_since
+    return False
+
+
+def get_requested_range(request, size, etag, last_modified):
+    """Return the (`start`, `end`) byte offsets (inclusive) of the range the
+    client asked for, or `None` if the whole file should be sent. Multiple
+    ranges are not supported; such requests get the whole file, which the
+    spec permits. Raise `RangeNotSatisfiable` if the range lies outside of the
+    file.
+
+    """
+
+    match = range_regex.match(request.META.get('HTTP_RANGE', ''))
+    if not match:
+        return None
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if if_range:
+        if_range_date = parse_http_date_safe(if_range)
+        if if_range_date is not None:
+            if not (last_modified and
+                    get_timestamp(last_modified) <= if_range_date):
+                return None
+        elif if_range.strip() != etag:
+            return None
+    start, end = match.groups()
+    if start:
+        start = int(start)
+        end = min(int(end), size - 1) if end else size - 1
+    elif end:
+        # A suffix range, e.g., "bytes=-500" is the last 500 bytes.
+        start = max(size - int(end), 0)
+        end = size - 1
+    else:
+        return None
+    if start >= size or start > end:
+        raise RangeNotSatisfiable()
+    return start, end
+
+
+def iter_file(path, start, length, chunk_size=CHUNK_SIZE):
+    """Yield `length` bytes of the file at `path`, starting at byte `start`,
+    in chunks of at most `chunk_size` bytes.
+
+    """
+
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(chunk_size, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def get_stream_slots():
+    """Return the semaphore that limits the number of files this process
+    streams at once.
+
+    """
+
+    global _stream_slots
+    with _stream_slots_lock:
+        if _stream_slots is None:
+            _stream_slots = threading.BoundedSemaphore(
+                max(1, getattr(settings, 'MAX_FILE_STREAMS', 2)))
+        return _stream_slots
+
+
+class SlotHoldingStream(object):
+    """Iterate over `chunks` while holding a slot of the semaphore `slots`,
+    which is released when the server closes the response, whether or not
+    all of it was sent.
+
+    """
+
+    def __init__(self, chunks, slots):
+        self.chunks = chunks
+        self.slots = slots
+        self.held = True
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+    def close(self):
+        if self.held:
+            self.held = False
+            self.slots.release()
+        close = getattr(self.chunks, 'close', None)
+        if close:
+            close()
+
+
+def serve_file(request, path, content_type, relative_path=None,
+        last_modified=None, etag=None, extra_headers=None, mode=None):
+    """Return a response that serves the file at `path` with `content_type`.
+    `relative_path` is the path of the file relative to the directory that the
+    front-end server maps `settings.FILE_ACCEL_REDIRECT_PREFIX` to; it is only
+    needed in X-Accel-Redirect mode. `last_modified` (a datetime) and `etag`
+    are used for conditional requests. `extra_headers` (e.g.,
+    Content-Disposition or Cache-Control) are set on every response. `mode`
+    overrides `settings.FILE_SERVE_MODE`, e.g., for files that the front-end
+    server cannot see.
+
+    """
+
+    if mode is None:
+        mode = getattr(settings, 'FILE_SERVE_MODE', SERVE_MODE_DJANGO)
+    headers = dict(extra_headers or {})
+    if etag:
+        headers['ETag'] = etag
+    if last_modified:
+        headers['Last-Modified'] = http_date(get_timestamp(last_modified))
+
+    if is_not_modified(request, etag, last_modified):
+        response = HttpResponseNotModified()
+    elif mode == SERVE_MODE_X_ACCEL_REDIRECT:
+        # nginx does ranges and conditional requests itself.
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = '%s%s' % (
+            settings.FILE_ACCEL_REDIRECT_PREFIX,
+            relative_path or os.path.basename(path))
+    elif mode == SERVE_MODE_X_SENDFILE:
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = os.path.abspath(path)
+    else:
+        size = os.path.getsize(path)
+        slots = get_stream_slots()
+        if not slots.acquire(False):
+            response = HttpResponse('Too many downloads are in progress;'
+                ' please try again shortly.', status=503,
+                content_type='text/plain')
+            response['Retry-After'] = str(RETRY_AFTER)
+            return response
+        try:
+            requested_range = get_requested_range(request, size, etag,
+                last_modified)
+        except RangeNotSatisfiable:
+            slots.release()
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */%d' % size
+            return response
+        if requested_range:
+            start, end = requested_range
+            response = StreamingHttpResponse(SlotHoldingStream(
+                iter_file(path, start, end - start + 1), slots),
+                status=206, content_type=content_type)
+            response['Content-Range'] = 'bytes %d-%d/%d' % (start, end, size)
+            response['Content-Length'] = str(end - start + 1)
+        else:
+            response = StreamingHttpResponse(SlotHoldingStream(
+                iter_file(path, 0, size), slots), content_type=content_type)
+            response['Content-Length'] = str(size)
+        response['Accept-Ranges'] = 'bytes'
+    for header, value in headers.items():
+        response[header] = value
+    return response
@@ -0,0 +1,318 @@
+"""Signal receivers for the Co-op App.
+
+These keep denormalized and cached data in sync with the models. They are
+connected when the app is loaded (see `coop.apps.CoopConfig.ready`).
+
+"""
+
+import threading
+
+from django.core.signals import request_started
+from django.db import transaction
+from django.db.models.signals import (post_init, post_save, pre_delete,
+    post_delete, m2m_changed)
+from django.dispatch import receiver
+from django.contrib.auth.models import User
+from django.contrib.auth.signals import user_logged_in
+
+from coop.cache import (invalidate_namespace, GLOBAL_CONTEXT_NAMESPACE,
+    MEMBER_DIRECTORY_NAMESPACE, COMMITTEE_LIST_NAMESPACE,
+    UNIT_OCCUPANTS_NAMESPACE)
+from coop.models import (ApplicationSettings, Page, Forum, Thread, Post,
+    Person, Committee, PhoneNumber, Unit, File, MeetingMinutes)
+from coop import search, storage, derivatives, permissions
+
+
+# Cache Invalidation
+################################################################################
+
+# The fields of a user that no cached page shows. Saving only these (e.g.,
+# `last_login`, which `django.contrib.auth.login` saves on every login) leaves
+# the caches valid.
+UNRENDERED_USER_FIELDS = frozenset(['last_login', 'password'])
+
+
+def is_unrendered_user_change(sender, update_fields=None, **kwargs):
+    """Return `True` if the signal is for a save of only fields of a user
+    that no cached page shows.
+
+    """
+
+    return (sender is User and update_fields is not None and
+        frozenset(update_fields) <= UNRENDERED_USER_FIELDS)
+
+
+@receiver(post_save, sender=ApplicationSettings)
+@receiver(post_delete, sender=ApplicationSettings)
+@receiver(post_save, sender=Page)
+@receiver(post_delete, sender=Page)
+def invalidate_global_context(sender, **kwargs):
+    """The global template context depends on the application settings and on
+    the titles of the public pages.
+
+    """
+
+    invalidate_namespace(GLOBAL_CONTEXT_NAMESPACE)
+
+
+@receiver(post_save, sender=Person)
+@receiver(post_delete, sender=Person)
+@receiver(post_save, sender=Committee)
+@receiver(post_delete, sender=Committee)
+@receiver(post_save, sender=PhoneNumber)
+@receiver(post_delete, sender=PhoneNumber)
+@receiver(post_save, sender=Unit)
+@receiver(post_delete, sender=Unit)
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+@receiver(m2m_changed, sender=Committee.members.through)
+@receiver(m2m_changed, sender=Person.phone_numbers.through)
+@receiver(m2m_changed, sender=Person.children.through)
+def invalidate_member_directory(sender, **kwargs):
+    """The member directory lists the active members with their units,
+    phone numbers, children and committees (and the committees' chairs).
+
+    """
+
+    if is_unrendered_user_change(sender, **kwargs):
+        return
+    if kwargs.get('action', 'post_').startswith('post_'):
+        invalidate_namespace(MEMBER_DIRECTORY_NAMESPACE)
+
+
+@receiver(post_save, sender=Committee)
+@receiver(post_delete, sender=Committee)
+@receiver(post_save, sender=Person)
+@receiver(post_delete, sender=Person)
+@receiver(m2m_changed, sender=Committee.members.through)
+def invalidate_committee_list(sender, **kwargs):
+    """The committee list shows each committee with its chair and members."""
+    if kwargs.get('action', 'post_').startswith('post_'):
+        invalidate_namespace(COMMITTEE_LIST_NAMESPACE)
+
+
+@receiver(post_save, sender=Person)
+@receiver(post_delete, sender=Person)
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_unit_occupants(sender, **kwargs):
+    """The units index lists the occupants of each unit who have active
+    users.
+
+    """
+
+    if not is_unrendered_user_change(sender, **kwargs):
+        invalidate_namespace(UNIT_OCCUPANTS_NAMESPACE)
+
+
+@receiver(post_save, sender=Person)
+@receiver(post_delete, sender=Person)
+@receiver(post_save, sender=Committee)
+@receiver(post_delete, sender=Committee)
+@receiver(m2m_changed, sender=Committee.members.through)
+def invalidate_permissions(sender, **kwargs):
+    """The permission snapshots record the committees that each user's
+    person is on and chairs.
+
+    """
+
+    if kwargs.get('action', 'post_').startswith('post_'):
+        permissions.bump_version()
+
+
+@receiver(user_logged_in)
+def store_permissions(sender, request, user, **kwargs):
+    permissions.refresh_permissions(request, user)
+
+
+# Stored Uploads
+################################################################################
+
+@receiver(post_delete, sender=File)
+def release_upload(sender, instance, **kwargs):
+    """Uploads are shared by the files with the same content, so the data
+    (and its thumbnail and preview) is only deleted along with the last of
+    them.
+
+    """
+
+    storage.release(instance.upload.name, instance.upload.storage,
+        on_delete=derivatives.delete_derivatives)
+
+
+# Denormalized Forum and Thread Statistics
+################################################################################
+
+def refresh_forum_stats(forum_ids, thread_ids=()):
+    """Recompute the statistics of the threads in `thread_ids` and the forums
+    in `forum_ids` in one transaction. The forum rows are locked first (then
+    the thread rows) so that concurrent posts to the same forum serialize
+    instead of overwriting each other's counts.
+
+    """
+
+    forum_ids = sorted(set(id_ for id_ in forum_ids if id_))
+    thread_ids = sorted(set(id_ for id_ in thread_ids if id_))
+    with transaction.atomic():
+        forums = list(Forum.objects.select_for_update()
+            .filter(pk__in=forum_ids).order_by('pk'))
+        threads = list(Thread.objects.select_for_update()
+            .filter(pk__in=thread_ids).order_by('pk'))
+        for thread in threads:
+            thread.refresh_stats()
+        for forum in forums:
+            forum.refresh_stats()
+
+
+# The (model, pk) pairs of the forums and threads that this thread of
+# execution is deleting. Deleting one deletes its threads and posts too, one
+# by one, and their post_delete receivers skip refreshing the statistics of
+# a forum or thread that is going anyway.
+_deleting = threading.local()
+
+
+def get_deleting():
+    if not hasattr(_deleting, 'objects'):
+        _deleting.objects = set()
+    return _deleting.objects
+
+
+@receiver(request_started)
+def forget_deleting(sender, **kwargs):
+    """A deletion that failed leaves its objects in the set."""
+    get_deleting().clear()
+
+
+@receiver(pre_delete, sender=Forum)
+@receiver(pre_delete, sender=Thread)
+def remember_deleting(sender, instance, **kwargs):
+    get_deleting().add((sender, instance.pk))
+
+
+@receiver(post_init, sender=Thread)
+def remember_thread_forum(sender, instance, **kwargs):
+    instance._saved_forum_id = instance.forum_id
+
+
+@receiver(post_init, sender=Post)
+def remember_post_thread(sender, instance, **kwargs):
+    instance._stats_thread_id = instance.thread_id
+
+
+@receiver(post_save, sender=Thread)
+def update_stats_on_thread_save(sender, instance, created, raw=False,
+        **kwargs):
+    """A new thread, or a thread that moved to another forum, changes the
+    thread counts of its forum(s). The posts of a thread that moved are also
+    re-indexed, since their URLs contain the `url_name` of their forum. Raw
+    saves (i.e., fixture loading) are skipped; run `manage.py
+    rebuild_forum_stats` and `manage.py rebuild_search_index` afterwards.
+
+    """
+
+    old_forum_id = getattr(instance, '_saved_forum_id', None)
+    instance._saved_forum_id = instance.forum_id
+    if raw or not (created or old_forum_id != instance.forum_id):
+        return
+    refresh_forum_stats([old_forum_id, instance.forum_id])
+    if not created:
+        search.reindex(instance.posts.all())
+
+
+@receiver(post_delete, sender=Thread)
+def update_stats_on_thread_delete(sender, instance, **kwargs):
+    deleting = get_deleting()
+    deleting.discard((Thread, instance.pk))
+    if (Forum, instance.forum_id) not in deleting:
+        refresh_forum_stats([instance.forum_id])
+
+
+@receiver(post_delete, sender=Forum)
+def forget_deleted_forum(sender, instance, **kwargs):
+    get_deleting().discard((Forum, instance.pk))
+
+
+@receiver(post_save, sender=Post)
+def update_stats_on_post_save(sender, instance, created, raw=False, **kwargs):
+    """A new post, or a post that moved to another thread, changes the
+    statistics of its thread(s) and forum(s). Edits to existing posts do not.
+
+    """
+
+    if raw:
+        return
+    old_thread_id = getattr(instance, '_stats_thread_id', None)
+    if created or old_thread_id != instance.thread_id:
+        thread_ids = [old_thread_id, instance.thread_id]
+        forum_ids = Thread.objects.filter(pk__in=[id_ for id_ in thread_ids
+            if id_]).values_list('forum_id', flat=True)
+        refresh_forum_stats(forum_ids, thread_ids)
+    instance._stats_thread_id = instance.thread_id
+
+
+@receiver(post_delete, sender=Post)
+def update_stats_on_post_delete(sender, instance, **kwargs):
+    """The thread of a deleted post (and its forum) is refreshed, unless the
+    post is deleted along with it.
+
+    """
+
+    if (Thread, instance.thread_id) in get_deleting():
+        return
+    forum_ids = Thread.objects.filter(pk=instance.thread_id)\
+        .values_list('forum_id', flat=True)
+    refresh_forum_stats(forum_ids, [instance.thread_id])
+
+
+# Search Index
+################################################################################
+
+@receiver(post_save, sender=Post)
+@receiver(post_save, sender=Page)
+@receiver(post_save, sender=File)
+@receiver(post_save, sender=MeetingMinutes)
+@receiver(post_save, sender=Committee)
+@receiver(post_save, sender=Person)
+def update_search_index(sender, instance, raw=False, **kwargs):
+    """Index the saved object. Raw saves (i.e., fixture loading) are skipped;
+    run `manage.py rebuild_search_index` afterwards.
+
+    """
+
+    if not raw:
+        search.index_object(instance)
+
+
+@receiver(post_delete, sender=Post)
+@receiver(post_delete, sender=Page)
+@receiver(post_delete, sender=File)
+@receiver(post_delete, sender=MeetingMinutes)
+@receiver(post_delete, sender=Committee)
+@receiver(post_delete, sender=Person)
+def remove_from_search_index(sender, instance, **kwargs):
+    search.unindex_object(instance)
+
+
+@receiver(post_save, sender=Committee)
+def reindex_committee_minutes(sender, instance, raw=False, **kwargs):
+    """The titles and URLs of meeting minutes come from their committee."""
+    if not raw:
+        search.reindex(instance.meeting_minutes.all())
+
+
+@receiver(post_init, sender=Forum)
+def remember_forum_url_name(sender, instance, **kwargs):
+    instance._search_url_name = instance.url_name
+
+
+@receiver(post_save, sender=Forum)
+def reindex_forum_posts(sender, instance, created, raw=False, **kwargs):
+    """The URLs of posts contain the `url_name` of their forum, so the posts
+    are re-indexed when a saved forum's `url_name` changed, and only then.
+
+    """
+
+    if not (raw or created) and (instance.url_name !=
+            getattr(instance, '_search_url_name', instance.url_name)):
+        search.reindex(Post.objects.filter(thread__forum=instance))
+    instance._search_url_name = instance.url_name
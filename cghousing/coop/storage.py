@@ -0,0 +1,242 @@
+"""Content-addressed storage of uploaded files.
+
+`ContentAddressedStorage` stores each upload under the SHA-256 of its bytes,
+in subdirectories of `settings.UPLOADS_PATH` sharded by the first two pairs of
+hex digits (e.g., 3a/7f/3a7f...), so that no directory grows too large and an
+upload of bytes that are already stored takes no extra space. The hash is
+computed while the upload is copied to a temporary file next to its final
+location, which is then renamed into place, so an upload is only read once
+and readers never see a partial file. Uploads that `coop.uploads.UploadHandler`
+has already written and hashed are just renamed.
+
+Any number of `File` rows may reference the same stored file. `release`, which
+is called when a `File` is deleted, removes the stored file once no row
+references it. It does so `RELEASE_DELAY` seconds later, on a background
+thread, so that the deletion of the row has been committed (or rolled back)
+by then. Storing a file and checking whether it can be deleted, then deleting
+it, are serialized by a file lock (see `ContentAddressedStorage.lock`), so an
+upload of the same bytes cannot be renamed into place between the check and
+the deletion. A stored file that was renamed into place lately is kept, since
+the `File` of the upload that stored it may not be committed yet. The
+releases that are pending when a process stops are lost; the `sweep_uploads`
+management command deletes the stored files that they leave behind.
+
+Uploads stored before this scheme keep their flat names (e.g.,
+/uploads/minutes.pdf) until the `convert_uploads` management command moves
+them into place.
+
+"""
+
+import os
+import re
+import time
+import errno
+import fcntl
+import hashlib
+import logging
+import tempfile
+import threading
+import Queue
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+# The default permissions of stored files, so that a front-end server (see
+# `settings.FILE_SERVE_MODE`) can read them.
+DEFAULT_FILE_PERMISSIONS = 0o644
+
+# The directory of the lock files, within the storage's location.
+LOCKS_DIR = '.locks'
+
+# How many seconds after a `File` is deleted its stored file is released.
+RELEASE_DELAY = 10
+
+_release_queue = Queue.Queue()
+_release_workers = []
+_release_workers_lock = threading.Lock()
+
+hash_name_regex = re.compile(r'^[0-9a-f]{2}/[0-9a-f]{2}/([0-9a-f]{64})$')
+
+
+def get_hash_name(content_hash):
+    """Return the name under which the file with SHA-256 `content_hash` is
+    stored.
+
+    """
+
+    return '%s/%s/%s' % (content_hash[:2], content_hash[2:4], content_hash)
+
+
+def get_content_hash(name):
+    """Return the SHA-256 of the stored file called `name`, or `None` if
+    `name` is not a content-addressed name (i.e., the file has not been
+    converted).
+
+    """
+
+    match = hash_name_regex.match(name or '')
+    return match.group(1) if match else None
+
+
+def makedirs(path):
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """A file system storage that names files by the hash of their content.
+    The names that it is asked to save under are ignored.
+
+    """
+
+    def __init__(self, location=None, base_url=None, **kwargs):
+        if location is None:
+            location = settings.UPLOADS_PATH
+        super(ContentAddressedStorage, self).__init__(location, base_url,
+            **kwargs)
+
+    @contextmanager
+    def lock(self, name):
+        """Hold an exclusive lock on the stored file called `name`, across
+        processes. Names share 256 lock files, picked by their hash, so the
+        lock files never need to be deleted.
+
+        """
+
+        locks_dir = os.path.join(self.location, LOCKS_DIR)
+        makedirs(locks_dir)
+        stripe = hashlib.sha1(name.encode('utf8')).hexdigest()[:2]
+        with open(os.path.join(locks_dir, '%s.lock' % stripe), 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def get_available_name(self, name):
+        # The name depends only on the content, so it never needs a suffix.
+        return name
+
+    def _save(self, name, content):
+        upload = getattr(content, 'file', content)
+        content_hash = getattr(upload, 'content_hash', None)
+        if content_hash and os.path.dirname(
+                upload.temporary_file_path()) == self.location:
+            # The upload handler (see coop.uploads) has already written the
+            # bytes into this directory and hashed them.
+            return self.store(upload.temporary_file_path(), content_hash)
+        makedirs(self.location)
+        fd, temp_path = tempfile.mkstemp(prefix='.upload-', dir=self.location)
+        sha256 = hashlib.sha256()
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in content.chunks(CHUNK_SIZE):
+                    sha256.update(chunk)
+                    f.write(chunk)
+            return self.store(temp_path, sha256.hexdigest())
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def store(self, path, content_hash):
+        """Move the file at `path`, whose SHA-256 is `content_hash`, into
+        place and return its name. If identical bytes are already stored, the
+        file at `path` atomically replaces them.
+
+        """
+
+        name = get_hash_name(content_hash)
+        stored_path = self.path(name)
+        makedirs(os.path.dirname(stored_path))
+        os.chmod(path, self.file_permissions_mode or DEFAULT_FILE_PERMISSIONS)
+        with self.lock(name):
+            os.rename(path, stored_path)
+        return name
+
+    def adopt(self, path):
+        """Store the existing file at `path`, which must be on the same file
+        system, by hashing it and renaming it into place (so that it is
+        neither copied nor held in memory). Return its new name.
+
+        """
+
+        sha256 = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                sha256.update(chunk)
+        return self.store(path, sha256.hexdigest())
+
+
+upload_storage = ContentAddressedStorage()
+
+
+def release(name, storage=upload_storage, on_delete=None):
+    """In `RELEASE_DELAY` seconds, delete the stored file called `name` from
+    `storage` if no `File` references it any more, then call
+    `on_delete(name)`, if given (e.g., to delete its derivatives).
+
+    """
+
+    if not name:
+        return
+    with _release_workers_lock:
+        if not _release_workers:
+            worker = threading.Thread(target=release_work,
+                name='coop-storage-release')
+            worker.daemon = True
+            worker.start()
+            _release_workers.append(worker)
+    _release_queue.put((time.time() + RELEASE_DELAY, name, storage,
+        on_delete))
+
+
+def release_work():
+    """Release the stored files in the queue when they are due, forever. They
+    are queued with the same delay, so they fall due in order.
+
+    """
+
+    while True:
+        due, name, storage, on_delete = _release_queue.get()
+        try:
+            delay = due - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            if release_now(name, storage) and on_delete:
+                on_delete(name)
+        except Exception:
+            logger.exception('Releasing the stored file %s failed.', name)
+        finally:
+            # This thread's connection would otherwise stay open.
+            connection.close()
+            _release_queue.task_done()
+
+
+def release_now(name, storage=upload_storage):
+    """Delete the stored file called `name` if no `File` references it and it
+    was not stored again within the last `RELEASE_DELAY` seconds. Return
+    `True` if it was deleted.
+
+    """
+
+    from coop.models import File
+    with storage.lock(name):
+        if File.objects.filter(upload=name).exists():
+            return False
+        try:
+            stored_at = os.stat(storage.path(name)).st_ctime
+        except OSError:
+            return False
+        if time.time() - stored_at < RELEASE_DELAY:
+            return False
+        storage.delete(name)
+        return True
@@ -1,5 +1,6 @@
 from django import template
 from django.template.defaultfilters import stringfilter
+from django.utils.safestring import mark_safe
 
 register = template.Library()
 
@@ -78,3 +79,16 @@ def addstr(arg1, arg2):
 
     return str(arg1) + str(arg2)
 
+
+@register.filter
+def rendered_markdown(obj, style=None):
+    """Return the stored HTML rendering of the Markdown of `obj`, a
+    `RenderedMarkdown` model instance, e.g., `{{ post|rendered_markdown }}`.
+    Use this instead of markdown-deux's `markdown` filter, which renders the
+    Markdown every time. `style` overrides the object's own style.
+
+    """
+
+    if not obj:
+        return u''
+    return mark_safe(obj.get_rendered_markdown(style))
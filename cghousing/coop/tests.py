@@ -1,3 +1,781 @@
-from django.test import TestCase
+"""Tests of the Co-op App: query-count and latency benchmarks of its views,
+and tests of the behaviour of the subsystems beneath them.
 
-# Create your tests here.
+`ViewBenchmarkTests` loads a synthetic data set (see
+coop/fixtures/syntheticfixtures.py), renders every URL in coop/urls.py as the
+superuser, and fails if a view issues more queries than its ceiling in
+`BENCHMARKS`. The ceilings do not depend on the size of the data set, so an
+N+1 query pattern makes them fail.
+
+`PdfBuildBenchmarkTests` (which needs `pdflatex`) times typesetting the
+membership list cold, i.e., parsing its whole preamble, and warm, i.e., with
+the precompiled preamble (see coop/latex.py), and prints the results.
+
+The other test cases check, on small data sets of their own, how files are
+served (coop/serving.py), uploaded (coop/uploads.py) and stored
+(coop/storage.py), how thread views are counted (coop/viewcounts.py), how
+forums and threads are paginated and how the participation matrix is
+exported.
+
+Environment variables:
+
+- CG_BENCHMARK_SCALE: "small" (the default, quick enough for every test run)
+  or "large" (hundreds of units, thousands of persons, tens of thousands of
+  posts).
+- CG_BENCHMARK_REPEAT: how many warm requests to time per URL (default 3).
+- CG_BENCHMARK_OUTPUT: a path to write the results to, as JSON.
+- CG_BENCHMARK_BASELINE: the path of the JSON results of an earlier run. Any
+  view that now issues more queries than it did then fails; views that got
+  more than CG_BENCHMARK_TOLERANCE (default 1.5) times slower are reported.
+
+For example:
+
+    $ CG_BENCHMARK_SCALE=large CG_BENCHMARK_OUTPUT=before.json \\
+        python manage.py test coop
+    $ CG_BENCHMARK_SCALE=large CG_BENCHMARK_BASELINE=before.json \\
+        python manage.py test coop
+
+"""
+
+import os
+import io
+import sys
+import csv
+import json
+import time
+import wave
+import shutil
+import datetime
+import tempfile
+from collections import OrderedDict
+from distutils.spawn import find_executable
+from unittest import skipUnless
+
+from django.core import serializers
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.color import no_style
+from django.core.urlresolvers import reverse
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase, RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.utils.http import http_date
+from django.utils.timezone import now
+
+from coop import cache as coop_cache
+from coop import permissions, serving, storage, viewcounts
+from coop import urls as coop_urls
+from coop.fixtures.syntheticfixtures import generate_fixtures
+from coop.latex import compile_pdf, get_format, split_preamble
+from coop.storage import upload_storage
+from coop.views import (get_latex_membership_doc, get_forum_threads_page,
+    parse_thread_cursor, get_thread_posts_page)
+from coop.models import (Person, Unit, Committee, Page, Forum, Thread, Post,
+    File, ParticipationRequirement)
+
+
+################################################################################
+# Benchmarks
+################################################################################
+
+# Maps each URL name in coop/urls.py to a 2-tuple: a function that returns the
+# URL's kwargs (given a dict of sample objects from the data set) and the
+# maximum number of queries that a GET of the URL may issue.
+BENCHMARKS = OrderedDict([
+    ('index', (None, 7)),
+    ('welcome', (None, 7)),
+    ('members', (None, 10)),
+    ('members_pdf_status', (lambda s: {'source_hash': '0' * 40}, 4)),
+    ('members_export', (lambda s: {'export_format': 'pdf'}, 10)),
+    ('member_change_password', (lambda s: {'pk': s['member'].pk}, 7)),
+    ('member_by_full_name', (lambda s: {'full_name': '%s_%s' % (
+        s['member'].last_name, s['member'].first_name)}, 12)),
+    ('member_edit', (lambda s: {'pk': s['member'].pk}, 11)),
+    ('member_participation_record', (lambda s: {'pk': s['member'].pk}, 10)),
+    ('participation_requirements', (None, 14)),
+    ('participation_requirements_export',
+        (lambda s: {'export_format': 'json'}, 10)),
+    ('participation_requirement_new', (None, 9)),
+    ('participation_requirement', (lambda s: {
+        'pk': s['participation_requirement'].pk}, 10)),
+    ('participation_requirement_edit', (lambda s: {
+        'pk': s['participation_requirement'].pk}, 13)),
+    ('pages', (None, 7)),
+    ('page_new', (None, 6)),
+    ('page', (lambda s: {'pk': s['page'].pk}, 7)),
+    ('page_by_url_title', (lambda s: {'url_title': s['page'].url_title}, 7)),
+    ('page_edit', (lambda s: {'pk': s['page'].pk}, 7)),
+    ('minutes', (None, 7)),
+    ('help', (None, 7)),
+    ('rules', (None, 7)),
+    ('units', (None, 7)),
+    ('unit_by_block_unit_nos', (lambda s: {'block_unit_nos': '%s-%s' % (
+        s['unit'].block_number, s['unit'].unit_number)}, 8)),
+    ('committees', (None, 8)),
+    ('committee_by_url_name', (lambda s: {
+        'url_name': s['committee'].url_name}, 8)),
+    ('committee_edit', (lambda s: {'pk': s['committee'].pk}, 10)),
+    ('files', (None, 7)),
+    ('file_new', (None, 6)),
+    ('forums', (None, 7)),
+    ('forum', (lambda s: {'pk': s['forum'].pk}, 8)),
+    ('forum_by_url_name', (lambda s: {'url_name': s['forum'].url_name}, 8)),
+    ('forum_new', (None, 6)),
+    ('thread', (lambda s: {'url_name': s['forum'].url_name,
+        'pk': s['thread'].pk}, 9)),
+    ('thread_view_by_url_subject', (lambda s: {
+        'url_name': s['forum'].url_name,
+        'url_subject': s['thread'].url_subject}, 9)),
+    ('thread_new', (lambda s: {'url_name': s['forum'].url_name}, 7)),
+    ('post_edit', (lambda s: {'pk': s['post'].pk}, 12)),
+    ('login', (None, 4)),
+    ('search', (None, 6)),
+    ('request_stats', (None, 4)),
+])
+
+# The maximum number of queries that building the LaTeX membership list (see
+# `get_latex_membership_doc`, which `members_pdf` calls) may issue.
+MEMBERSHIP_DOC_QUERIES = 8
+
+# The maximum number of queries that a search (see `test_search`) may issue.
+SEARCH_QUERIES = 6
+
+# URL names that are not benchmarked, with the reason why.
+SKIPPED = {
+    'members_pdf': 'starts a background pdflatex build',
+    'members_pdf_download': 'needs a built PDF',
+    'member_save': 'POST only',
+    'participation_requirement_save': 'POST only',
+    'phone_number_save_ajax': 'POST only',
+    'page_save': 'POST only',
+    'committee_save': 'POST only',
+    'file': 'no uploads in the synthetic data',
+    'file_by_path': 'no uploads in the synthetic data',
+    'file_data': 'no uploads in the synthetic data',
+    'file_edit': 'no uploads in the synthetic data',
+    'file_derivative': 'no uploads in the synthetic data',
+    'file_save': 'POST only',
+    'forum_save': 'POST only',
+    'thread_save': 'POST only',
+    'logout': 'ends the session',
+    'authenticate': 'POST only',
+}
+
+
+def get_url_names():
+    return [pattern.name for pattern in coop_urls.urlpatterns if pattern.name]
+
+
+def load_fixtures(fixtures):
+    """Save the objects in `fixtures` with one bulk INSERT per model (and per
+    many-to-many table), which is much faster than `loaddata`. Like `loaddata`,
+    this bypasses `save` and the signals.
+
+    """
+
+    instances = OrderedDict()
+    m2m_rows = OrderedDict()
+    for deserialized in serializers.deserialize('python', fixtures):
+        obj = deserialized.object
+        instances.setdefault(type(obj), []).append(obj)
+        for field_name, related_ids in deserialized.m2m_data.items():
+            field = type(obj)._meta.get_field(field_name)
+            through = field.rel.through
+            rows = m2m_rows.setdefault(through, [])
+            for related_id in related_ids:
+                rows.append(through(**{
+                    '%s_id' % field.m2m_field_name(): obj.pk,
+                    '%s_id' % field.m2m_reverse_field_name(): related_id}))
+    for model, objs in instances.items() + m2m_rows.items():
+        model.objects.bulk_create(objs)
+    # Sequences (e.g., on PostgreSQL) must be moved past the explicit ids.
+    sequence_sql = connection.ops.sequence_reset_sql(
+        no_style(), instances.keys() + m2m_rows.keys())
+    if sequence_sql:
+        cursor = connection.cursor()
+        for sql in sequence_sql:
+            cursor.execute(sql)
+
+
+def clear_caches():
+    cache.clear()
+    with coop_cache._local_cache_lock:
+        coop_cache._local_cache.clear()
+
+
+################################################################################
+# Tests
+################################################################################
+
+class ViewBenchmarkTests(TestCase):
+
+    def load_data(self):
+        self.scale = os.environ.get('CG_BENCHMARK_SCALE', 'small')
+        start = time.time()
+        load_fixtures(generate_fixtures(self.scale))
+        call_command('rebuild_forum_stats', verbosity=0)
+        call_command('render_markdown', verbosity=0)
+        call_command('rebuild_search_index', verbosity=0)
+        self.load_time = time.time() - start
+        clear_caches()
+        self.client.login(username='a', password='a')
+
+    def get_samples(self):
+        """Return a dict of typical objects to build URLs for. Prefer the
+        busiest ones, since they are the most likely to expose N+1 queries.
+
+        """
+
+        forum = Forum.objects.order_by('-post_count', 'pk')[0]
+        thread = forum.threads.order_by('-post_count', 'pk')[0]
+        member = Person.objects.filter(member=True, committees__isnull=False)\
+            .order_by('pk')[0]
+        return {
+            'member': member,
+            'unit': member.unit,
+            'participation_requirement':
+                ParticipationRequirement.objects.order_by('-date')[0],
+            'page': Page.objects.order_by('pk')[0],
+            'committee': Committee.objects.exclude(name='Co-op')
+                .order_by('pk')[0],
+            'forum': forum,
+            'thread': thread,
+            # Users may only edit their own posts.
+            'post': Post.objects.filter(creator__username='a')
+                .order_by('-pk')[0]
+        }
+
+    def test_every_url_is_covered(self):
+        for name in get_url_names():
+            self.assertTrue(name in BENCHMARKS or name in SKIPPED,
+                'Add a benchmark (or a reason to skip it) for coop:%s' % name)
+
+    def test_view_query_counts(self):
+        self.load_data()
+        repeat = int(os.environ.get('CG_BENCHMARK_REPEAT', 3))
+        samples = self.get_samples()
+        results = OrderedDict()
+        failures = []
+        for name, (get_kwargs, ceiling) in BENCHMARKS.items():
+            url = reverse('coop:%s' % name,
+                kwargs=get_kwargs(samples) if get_kwargs else None)
+            clear_caches()
+            start = time.time()
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            cold_ms = (time.time() - start) * 1000
+            # The queries must be counted before the next request resets them.
+            query_count = len(queries)
+            warm_times = []
+            for _ in range(repeat):
+                start = time.time()
+                self.client.get(url)
+                warm_times.append((time.time() - start) * 1000)
+            warm_times.sort()
+            results[name] = {
+                'url': url,
+                'status': response.status_code,
+                'queries': query_count,
+                'ceiling': ceiling,
+                'cold_ms': round(cold_ms, 2),
+                'warm_ms': round(warm_times[len(warm_times) // 2], 2)
+                    if warm_times else None
+            }
+            if response.status_code >= 400:
+                failures.append('%s returned %d' % (url,
+                    response.status_code))
+            if ceiling is not None and query_count > ceiling:
+                failures.append('%s issued %d queries; its ceiling is %d' % (
+                    url, query_count, ceiling))
+        failures += self.compare_to_baseline(results)
+        self.write_results(results)
+        self.assertFalse(failures, '\n'.join(failures))
+
+    def test_membership_doc_query_count(self):
+        self.load_data()
+        members = Person.objects.filter(member=True, user__is_active=True)
+        with CaptureQueriesContext(connection) as queries:
+            get_latex_membership_doc(members)
+        query_count = len(queries)
+        self.assertTrue(query_count <= MEMBERSHIP_DOC_QUERIES,
+            'Building the membership list issued %d queries; its ceiling is'
+            ' %d' % (query_count, MEMBERSHIP_DOC_QUERIES))
+
+    def test_search(self):
+        """The `search` benchmark only displays the form; this searches for a
+        word in posts, pages and files, public and private, as the superuser
+        and as someone who is not logged in.
+
+        """
+
+        self.load_data()
+        thread = self.get_samples()['thread']
+        post = Post.objects.create(thread=thread, subject=u'Zeppelin',
+            post=u'The zeppelin is moored by the garden.')
+        public_page = Page.objects.create(title=u'Zeppelin rides',
+            content=u'Ask about the zeppelin.', public=True)
+        private_page = Page.objects.create(title=u'Zeppelin budget',
+            content=u'The zeppelin fund.', public=False)
+        private_file = File.objects.create(name=u'zeppelin.pdf',
+            description=u'Plans of the zeppelin.', upload='uploads/zeppelin',
+            public=False)
+        url = '%s?q=zeppelin' % reverse('coop:search')
+        clear_caches()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(len(queries) <= SEARCH_QUERIES,
+            'Searching issued %d queries; its ceiling is %d' % (
+                len(queries), SEARCH_QUERIES))
+        found = set((result.kind, result.object_id) for result in
+            response.context['results'])
+        self.assertTrue(set([('post', post.pk), ('page', public_page.pk),
+            ('page', private_page.pk), ('file', private_file.pk)]) <= found)
+        for result in response.context['results']:
+            self.assertTrue(result.snippet)
+        self.client.logout()
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        found = set((result.kind, result.object_id) for result in
+            response.context['results'])
+        self.assertEqual(found, set([('page', public_page.pk)]))
+
+    def log_in_committee_member(self):
+        """Log in as a member (not a superuser) of a committee. Return the
+        committee, the member's person and the URL of the committee's edit
+        page.
+
+        """
+
+        self.load_data()
+        committee = Committee.objects.exclude(name='Co-op')\
+            .filter(members__user__isnull=False).order_by('pk')[0]
+        person = committee.members.filter(user__isnull=False)\
+            .order_by('pk')[0]
+        person.user.set_password('p')
+        person.user.is_superuser = False
+        person.user.save()
+        self.client.login(username=person.user.username, password='p')
+        url = reverse('coop:committee_edit', kwargs={'pk': committee.pk})
+        return committee, person, url
+
+    def test_permission_checks_use_snapshot(self):
+        committee, person, url = self.log_in_committee_member()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        # The snapshot was stored in the session when the user logged in, so
+        # the user's committees are not queried.
+        membership_table = Committee.members.through._meta.db_table
+        self.assertFalse([query for query in queries
+            if membership_table in query['sql'] and
+                '"user_id"' in query['sql']])
+        # Leaving the committee invalidates the snapshot.
+        committee.members.remove(person)
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+    def test_stale_permission_snapshot_is_rejected(self):
+        committee, person, url = self.log_in_committee_member()
+        self.assertEqual(self.client.get(url).status_code, 200)
+        # Another process takes the person off the committee and bumps the
+        # version in the database; no signal is sent in this process.
+        Committee.members.through.objects.filter(committee=committee,
+            person=person).delete()
+        self.assertEqual(self.client.get(url).status_code, 200)
+        permissions.bump_version()
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+    def compare_to_baseline(self, results):
+        """Return failure messages for the views that issue more queries than
+        they did in the baseline run, and print a warning for those that are
+        slower by more than the tolerance.
+
+        """
+
+        path = os.environ.get('CG_BENCHMARK_BASELINE')
+        if not path:
+            return []
+        tolerance = float(os.environ.get('CG_BENCHMARK_TOLERANCE', 1.5))
+        with open(path) as f:
+            baseline = json.load(f)
+        if baseline.get('scale') != self.scale:
+            return ['The baseline in %s is for scale "%s", not "%s"' % (
+                path, baseline.get('scale'), self.scale)]
+        failures = []
+        for name, result in results.items():
+            previous = baseline['views'].get(name)
+            if not previous:
+                continue
+            if result['queries'] > previous['queries']:
+                failures.append('%s issued %d queries; the baseline is %d' % (
+                    result['url'], result['queries'], previous['queries']))
+            if (result['warm_ms'] and previous.get('warm_ms') and
+                    result['warm_ms'] > previous['warm_ms'] * tolerance):
+                sys.stderr.write('\nWARNING: %s took %.1f ms; the baseline is'
+                    ' %.1f ms\n' % (result['url'], result['warm_ms'],
+                    previous['warm_ms']))
+        return failures
+
+    def write_results(self, results):
+        path = os.environ.get('CG_BENCHMARK_OUTPUT')
+        if not path:
+            return
+        with open(path, 'w') as f:
+            json.dump({
+                'scale': self.scale,
+                'load_seconds': round(self.load_time, 2),
+                'counts': {
+                    'units': Unit.objects.count(),
+                    'persons': Person.objects.count(),
+                    'threads': Thread.objects.count(),
+                    'posts': Post.objects.count(),
+                    'participation_requirements':
+                        ParticipationRequirement.objects.count()
+                },
+                'views': results
+            }, f, indent=2)
+
+
+@skipUnless(find_executable('pdflatex'), 'pdflatex is not installed')
+class PdfBuildBenchmarkTests(TestCase):
+
+    def test_cold_vs_warm_build(self):
+        scale = os.environ.get('CG_BENCHMARK_SCALE', 'small')
+        repeat = max(1, int(os.environ.get('CG_BENCHMARK_REPEAT', 3)))
+        load_fixtures(generate_fixtures(scale))
+        source = get_latex_membership_doc(Person.objects.filter(member=True,
+            user__is_active=True)).encode('utf8')
+        directory = tempfile.mkdtemp()
+        try:
+            with self.settings(LATEX_FORMATS_PATH=os.path.join(directory,
+                    'formats')):
+                cold_ms = self.time_builds(source, directory, False, repeat)
+                start = time.time()
+                self.assertTrue(get_format(split_preamble(source)[0]),
+                    'The preamble could not be precompiled')
+                dump_ms = (time.time() - start) * 1000
+                warm_ms = self.time_builds(source, directory, True, repeat)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+        sys.stderr.write('\nMembership list PDF (%s): cold %.0f ms, warm %.0f'
+            ' ms (precompiling the preamble took %.0f ms once)\n' % (scale,
+            cold_ms, warm_ms, dump_ms))
+
+    def time_builds(self, source, directory, precompiled, repeat):
+        """Return the median time, in milliseconds, of `repeat` builds of
+        `source`.
+
+        """
+
+        times = []
+        for _ in range(repeat):
+            scratch_dir = tempfile.mkdtemp(dir=directory)
+            start = time.time()
+            pdf_path = compile_pdf(source, scratch_dir, 'membership-list',
+                precompiled=precompiled)
+            times.append((time.time() - start) * 1000)
+            self.assertTrue(pdf_path, 'pdflatex did not produce a PDF')
+        times.sort()
+        return times[len(times) // 2]
+
+
+class ServeFileTests(TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.write(fd, b'0123456789')
+        os.close(fd)
+        self.modified = now().replace(microsecond=0)
+        self.etag = serving.get_etag(10, self.modified)
+        self.factory = RequestFactory()
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def serve(self, **headers):
+        return serving.serve_file(self.factory.get('/', **headers), self.path,
+            'text/plain', relative_path='ab/cd/file',
+            last_modified=self.modified, etag=self.etag)
+
+    def read(self, response):
+        try:
+            return b''.join(response.streaming_content)
+        finally:
+            # Gives back the stream slot.
+            response.close()
+
+    def test_whole_file(self):
+        response = self.serve()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['ETag'], self.etag)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(self.read(response), b'0123456789')
+
+    def test_ranges(self):
+        response = self.serve(HTTP_RANGE='bytes=2-5')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 2-5/10')
+        self.assertEqual(self.read(response), b'2345')
+        response = self.serve(HTTP_RANGE='bytes=-3')
+        self.assertEqual(response['Content-Range'], 'bytes 7-9/10')
+        self.assertEqual(self.read(response), b'789')
+        # A range for an older version of the file gets all of it.
+        response = self.serve(HTTP_RANGE='bytes=2-5', HTTP_IF_RANGE='"old"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.read(response), b'0123456789')
+
+    def test_unsatisfiable_range(self):
+        response = self.serve(HTTP_RANGE='bytes=20-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */10')
+
+    def test_not_modified(self):
+        self.assertEqual(self.serve(HTTP_IF_NONE_MATCH=self.etag).status_code,
+            304)
+        self.assertEqual(self.read(self.serve(HTTP_IF_NONE_MATCH='"old"')),
+            b'0123456789')
+        timestamp = serving.get_timestamp(self.modified)
+        self.assertEqual(self.serve(
+            HTTP_IF_MODIFIED_SINCE=http_date(timestamp)).status_code, 304)
+        response = self.serve(HTTP_IF_MODIFIED_SINCE=http_date(timestamp - 1))
+        self.assertEqual(response.status_code, 200)
+        self.read(response)
+
+    def test_x_accel_redirect(self):
+        with self.settings(FILE_SERVE_MODE=serving.SERVE_MODE_X_ACCEL_REDIRECT,
+                FILE_ACCEL_REDIRECT_PREFIX='/protected/'):
+            response = self.serve()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected/ab/cd/file')
+        self.assertEqual(response.content, b'')
+
+
+def make_wav(frames=100):
+    """Return the bytes of a short, silent WAV file, which may be uploaded
+    and has no derivatives.
+
+    """
+
+    data = io.BytesIO()
+    writer = wave.open(data, 'wb')
+    writer.setnchannels(1)
+    writer.setsampwidth(1)
+    writer.setframerate(8000)
+    writer.writeframes(b'\x80' * frames)
+    writer.close()
+    return data.getvalue()
+
+
+class UploadTests(TestCase):
+    """Uploads go to a temporary directory instead of `UPLOADS_PATH`."""
+
+    def setUp(self):
+        self.location = (upload_storage.base_location,
+            upload_storage.location)
+        self.directory = tempfile.mkdtemp()
+        upload_storage.base_location = upload_storage.location = \
+            self.directory
+        # Record the releases that the deletion of files asks for, rather
+        # than have a background thread carry them out later.
+        self.release = storage.release
+        self.released = []
+        storage.release = lambda name, *args, **kwargs: \
+            self.released.append(name)
+        User.objects.create_superuser('a', 'a@example.com', 'a')
+        self.client.login(username='a', password='a')
+
+    def tearDown(self):
+        storage.release = self.release
+        upload_storage.base_location, upload_storage.location = self.location
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def upload(self, data, name='sound.wav'):
+        upload = io.BytesIO(data)
+        upload.name = name
+        return self.client.post(reverse('coop:file_save'), {
+            'upload': upload, 'description': '', 'public': ''})
+
+    def get_stored_files(self):
+        return sorted(os.path.relpath(os.path.join(path, name),
+            self.directory) for path, _, names in os.walk(self.directory)
+            for name in names if not path.endswith(storage.LOCKS_DIR))
+
+    def test_oversize_upload_is_rejected(self):
+        with self.settings(MAX_UPLOAD_SIZE=100):
+            response = self.upload(make_wav(1000))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'That file is too big')
+        self.assertFalse(File.objects.exists())
+        # The temporary file was deleted as soon as the upload was rejected.
+        self.assertEqual(self.get_stored_files(), [])
+
+    def test_identical_uploads_share_storage(self):
+        data = make_wav()
+        self.assertEqual(self.upload(data).status_code, 302)
+        self.assertEqual(self.upload(data, 'copy.wav').status_code, 302)
+        first, second = File.objects.order_by('pk')
+        self.assertEqual(first.upload.name, second.upload.name)
+        self.assertNotEqual(first.path, second.path)
+        self.assertEqual(self.get_stored_files(), [first.upload.name])
+        with open(first.upload.path, 'rb') as f:
+            self.assertEqual(f.read(), data)
+
+    def test_release_keeps_referenced_and_recent_files(self):
+        self.upload(make_wav())
+        first = File.objects.get()
+        name = first.upload.name
+        second = File.objects.create(name='copy.wav', upload=name)
+        first.delete()
+        self.assertEqual(self.released, [name])
+        storage.RELEASE_DELAY, delay = 0, storage.RELEASE_DELAY
+        try:
+            self.assertFalse(storage.release_now(name))
+            second.delete()
+            storage.RELEASE_DELAY = 3600
+            # Stored too recently: its file may not be committed yet.
+            self.assertFalse(storage.release_now(name))
+            storage.RELEASE_DELAY = 0
+            self.assertTrue(storage.release_now(name))
+        finally:
+            storage.RELEASE_DELAY = delay
+        self.assertEqual(self.get_stored_files(), [])
+
+    def test_sweep_deletes_unreferenced_uploads(self):
+        self.upload(make_wav())
+        self.upload(make_wav(200))
+        kept, swept = File.objects.order_by('pk')
+        swept.delete()
+        storage.RELEASE_DELAY, delay = 0, storage.RELEASE_DELAY
+        try:
+            call_command('sweep_uploads', verbosity=0)
+        finally:
+            storage.RELEASE_DELAY = delay
+        self.assertEqual(self.get_stored_files(), [kept.upload.name])
+
+
+class ViewCountTests(TestCase):
+
+    def setUp(self):
+        # Write out the views buffered by earlier tests.
+        viewcounts.flush_thread_views()
+        forum = Forum.objects.create(name='Forum', url_name='forum')
+        self.threads = [Thread.objects.create(subject='Thread %d' % index,
+            forum=forum) for index in range(2)]
+
+    def get_views(self):
+        return [Thread.objects.get(pk=thread.pk).views for thread in
+            self.threads]
+
+    def test_views_are_buffered_until_flushed(self):
+        with self.settings(VIEW_COUNT_FLUSH_INTERVAL=3600):
+            for thread in self.threads + self.threads[:1] * 2:
+                viewcounts.record_thread_view(thread.id)
+        self.assertEqual(self.get_views(), [0, 0])
+        self.assertEqual(viewcounts.flush_thread_views(), 2)
+        self.assertEqual(self.get_views(), [3, 1])
+        self.assertEqual(viewcounts.flush_thread_views(), 0)
+
+    def test_views_are_written_straight_away_without_interval(self):
+        with self.settings(VIEW_COUNT_FLUSH_INTERVAL=0):
+            viewcounts.record_thread_view(self.threads[1].id)
+        self.assertEqual(self.get_views(), [0, 1])
+
+
+class PaginationTests(TestCase):
+
+    def setUp(self):
+        self.forum = Forum.objects.create(name='Forum', url_name='forum')
+
+    def test_forum_pages_follow_cursors(self):
+        start = now()
+        # Two threads were last active at the same time; their ids break the
+        # tie.
+        for index, minutes in enumerate([1, 5, 3, 3, 4]):
+            Thread.objects.create(subject='Thread %d' % index,
+                forum=self.forum,
+                last_activity_at=start + datetime.timedelta(minutes=minutes))
+        expected = list(Thread.objects.order_by('-last_activity_at', '-id')
+            .values_list('id', flat=True))
+        seen = []
+        cursor = None
+        while True:
+            threads, cursor = get_forum_threads_page(self.forum,
+                parse_thread_cursor(cursor), page_size=2)
+            seen.extend(thread.id for thread in threads)
+            if not cursor:
+                break
+        self.assertEqual(seen, expected)
+        self.assertEqual(parse_thread_cursor('not-a-cursor'), None)
+        User.objects.create_user('m', 'm@example.com', 'm')
+        self.client.login(username='m', password='m')
+        response = self.client.get(reverse('coop:forum_by_url_name',
+            kwargs={'url_name': 'forum'}), {'before': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_thread_pages(self):
+        thread = Thread.objects.create(subject='Thread', forum=self.forum)
+        posts = [Post.objects.create(thread=thread, subject='Post %d' % index,
+            post='Post %d' % index) for index in range(7)]
+        thread = Thread.objects.get(pk=thread.pk)
+        self.assertEqual(thread.post_count, 7)
+
+        def get_page(page=None, post_id=None):
+            page = get_thread_posts_page(thread, page, post_id, page_size=3)
+            return page['number'], [post.id for post in page['posts']]
+
+        ids = [post.id for post in posts]
+        self.assertEqual(get_page(), (1, ids[:3]))
+        self.assertEqual(get_page('2'), (2, ids[3:6]))
+        self.assertEqual(get_page('last'), (3, ids[6:]))
+        self.assertEqual(get_page('99'), (3, ids[6:]))
+        self.assertEqual(get_page('x'), (1, ids[:3]))
+        # The page of a given post.
+        self.assertEqual(get_page(post_id=str(ids[4])), (2, ids[3:6]))
+        page = get_thread_posts_page(thread, '2', page_size=3)
+        self.assertTrue(page['has_previous'] and page['has_next'])
+
+
+class ParticipationExportTests(TestCase):
+
+    def setUp(self):
+        unit = Unit.objects.create(block_number=1701, unit_number=101)
+        Unit.objects.create(block_number=1701, unit_number=102)
+        user = User.objects.create_user('m', 'm@example.com', 'm')
+        person = Person.objects.create(first_name='Ann', last_name='Lee',
+            user=user, unit=unit, member=True)
+        self.meeting = ParticipationRequirement.objects.create(
+            name='Meeting', date=datetime.date(2015, 1, 10))
+        self.cleanup = ParticipationRequirement.objects.create(
+            name='Cleanup', date=datetime.date(2015, 2, 10))
+        self.meeting.fulfillers.add(person)
+        self.cleanup.shirkers.add(person)
+        User.objects.create_superuser('a', 'a@example.com', 'a')
+
+    def export(self, export_format):
+        return self.client.get(reverse('coop:participation_requirements_export',
+            kwargs={'export_format': export_format}))
+
+    def test_json(self):
+        self.client.login(username='a', password='a')
+        data = json.loads(self.export('json').content)
+        self.assertEqual([pr['name'] for pr in
+            data['participation_requirements']], ['Meeting', 'Cleanup'])
+        self.assertEqual([(unit['unit_number'], unit['participation']) for
+            unit in data['units']], [(101, ['fulfilled', 'shirked']),
+            (102, [None, None])])
+
+    def test_csv(self):
+        self.client.login(username='a', password='a')
+        response = self.export('csv')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.reader(io.BytesIO(response.content)))
+        self.assertEqual(rows, [
+            ['Block #', 'Unit #', 'Meeting (2015-01-10)',
+                'Cleanup (2015-02-10)'],
+            ['1701', '101', 'fulfilled', 'shirked'],
+            ['1701', '102', '', '']])
+
+    def test_only_authorized_users_may_export(self):
+        self.client.login(username='m', password='m')
+        self.assertEqual(self.export('json').status_code, 403)
@@ -0,0 +1,151 @@
+"""Single-pass handling of uploaded files.
+
+`UploadHandler` (see `settings.FILE_UPLOAD_HANDLERS`) streams each uploaded
+file into a temporary file in the upload store's directory and, as the
+chunks arrive,
+
+- counts the bytes, giving up on the file as soon as it exceeds
+  `settings.MAX_UPLOAD_SIZE` (or straight away, if the request itself is too
+  big), instead of buffering all of it first,
+- keeps the first `SNIFF_SIZE` bytes, from which it sniffs the MIME type with
+  a libmagic handle that is shared by the whole process, and
+- computes the SHA-256 of the content.
+
+So the upload is never read again: `ContentAddressedStorage` (see
+coop/storage.py) renames the temporary file into place under its hash.
+Rejected files are left out of `request.FILES`; `get_rejected_uploads` says
+which ones they were.
+
+"""
+
+import hashlib
+import tempfile
+import threading
+
+import magic
+from django.conf import settings
+from django.core.files.uploadedfile import (UploadedFile,
+    TemporaryUploadedFile)
+from django.core.files.uploadhandler import (FileUploadHandler, SkipFile,
+    StopFutureHandlers)
+
+from coop.storage import upload_storage, makedirs
+
+# The number of bytes at the start of a file that its MIME type is sniffed
+# from.
+SNIFF_SIZE = 8 * 1024
+
+# Room for the other form fields and the multipart boundaries, when the size
+# of a whole request is compared with `settings.MAX_UPLOAD_SIZE`.
+REQUEST_OVERHEAD = 64 * 1024
+
+_magic = None
+_magic_lock = threading.Lock()
+
+
+def sniff_mime_type(data):
+    """Return the MIME type of a file that starts with the bytes `data`.
+    Opening a libmagic handle loads its whole database, and handles are not
+    thread-safe, so one handle is shared, behind a lock.
+
+    """
+
+    global _magic
+    with _magic_lock:
+        if _magic is None:
+            _magic = magic.Magic(mime=True)
+        return _magic.from_buffer(data)
+
+
+def get_mime_type(upload):
+    """Return the MIME type of the uploaded file `upload`: the one sniffed by
+    `UploadHandler`, if it handled the upload, otherwise one sniffed from the
+    first bytes of the file.
+
+    """
+
+    type_ = getattr(upload, 'sniffed_type', None)
+    if type_ is None:
+        upload.seek(0)
+        type_ = sniff_mime_type(upload.read(SNIFF_SIZE))
+        upload.seek(0)
+    return type_
+
+
+def get_rejected_uploads(request):
+    """Return a dict from the names of the file fields whose uploads were
+    rejected for being too large to the number of bytes received (or, if the
+    request was rejected as a whole, its length).
+
+    """
+
+    return getattr(request, 'rejected_uploads', {})
+
+
+class HashedUploadedFile(TemporaryUploadedFile):
+    """A file uploaded to a temporary file in the upload store's directory,
+    with the MIME type that was sniffed from it (`sniffed_type`) and its
+    SHA-256 (`content_hash`).
+
+    """
+
+    def __init__(self, name, content_type, size, charset,
+            content_type_extra=None):
+        makedirs(upload_storage.location)
+        file = tempfile.NamedTemporaryFile(prefix='.upload-',
+            dir=upload_storage.location)
+        UploadedFile.__init__(self, file, name, content_type, size, charset,
+            content_type_extra)
+        self.sniffed_type = None
+        self.content_hash = None
+
+
+class UploadHandler(FileUploadHandler):
+    """Stream uploads to disk, sniffing, measuring and hashing them on the
+    way.
+
+    """
+
+    def handle_raw_input(self, input_data, META, content_length, boundary,
+            encoding=None):
+        self.request_length = content_length
+        self.request_too_large = (content_length >
+            settings.MAX_UPLOAD_SIZE + REQUEST_OVERHEAD)
+
+    def new_file(self, *args, **kwargs):
+        super(UploadHandler, self).new_file(*args, **kwargs)
+        self.file = HashedUploadedFile(self.file_name, self.content_type, 0,
+            self.charset, self.content_type_extra)
+        self.sha256 = hashlib.sha256()
+        self.head = b''
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        if getattr(self, 'request_too_large', False):
+            self.reject(self.request_length)
+        size = start + len(raw_data)
+        if size > settings.MAX_UPLOAD_SIZE:
+            self.reject(size)
+        if len(self.head) < SNIFF_SIZE:
+            self.head += raw_data[:SNIFF_SIZE - len(self.head)]
+        self.sha256.update(raw_data)
+        self.file.write(raw_data)
+
+    def reject(self, size):
+        """Skip the rest of the current file (which closes, and so deletes,
+        its temporary file) and remember why.
+
+        """
+
+        if self.request is not None:
+            if not hasattr(self.request, 'rejected_uploads'):
+                self.request.rejected_uploads = {}
+            self.request.rejected_uploads[self.field_name] = size
+        raise SkipFile()
+
+    def file_complete(self, file_size):
+        self.file.seek(0)
+        self.file.size = file_size
+        self.file.sniffed_type = sniff_mime_type(self.head)
+        self.file.content_hash = self.sha256.hexdigest()
+        return self.file
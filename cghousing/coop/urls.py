@@ -10,6 +10,12 @@ urlpatterns = patterns('',
     # Members
     url(r'^members/$', views.members_view, name='members'),
     url(r'^members-pdf/$', views.members_pdf_view, name='members_pdf'),
+    url(r'^members-pdf/(?P<source_hash>[0-9a-f]{40})/status/$',
+        views.members_pdf_status_view, name='members_pdf_status'),
+    url(r'^members-pdf/(?P<source_hash>[0-9a-f]{40})/$',
+        views.members_pdf_download_view, name='members_pdf_download'),
+    url(r'^members-list\.(?P<export_format>[a-z]+)$', views.members_export_view,
+        name='members_export'),
     url(r'^member/save/$', views.member_save_view, name='member_save'),
     url(r'^member/(?P<pk>\d+)/change-password/$',
         views.member_change_password_view, name='member_change_password'),
@@ -25,6 +31,9 @@ urlpatterns = patterns('',
     url(r'^participation-requirements/$',
         views.participation_requirements_view,
         name='participation_requirements'),
+    url(r'^participation-requirements/export\.(?P<export_format>json|csv)$',
+        views.participation_requirements_export_view,
+        name='participation_requirements_export'),
     url(r'^participation-requirement/$',
         views.participation_requirement_new_view,
         name='participation_requirement_new'),
@@ -75,6 +84,9 @@ urlpatterns = patterns('',
     url(r'^file/data/(?P<path>[^ ]+)/$$', views.file_data_view,
         name='file_data'),
     url(r'^file/(?P<pk>\d+)/edit/$', views.file_edit_view, name='file_edit'),
+    url(r'^file/derivative/(?P<content_hash>[0-9a-f]{64})/'
+        r'(?P<kind>thumbnail|preview)\.png$', views.file_derivative_view,
+        name='file_derivative'),
 
     # Forums
     url(r'^forums/$', views.forums_view, name='forums'),
@@ -97,11 +109,17 @@ urlpatterns = patterns('',
     # Posts
     url(r'^post/(?P<pk>\d+)/edit/$', views.post_edit_view, name='post_edit'),
 
+    # Search
+    url(r'^search/$', views.search_view, name='search'),
+
     # Authentication
     url(r'^accounts/login/$', views.login_view, name='login'),
     url(r'^accounts/logout/$', views.logout_view, name='logout'),
     url(r'^accounts/authenticate/$', views.authenticate_view,
-        name='authenticate')
+        name='authenticate'),
+
+    # Instrumentation
+    url(r'^request-stats/$', views.request_stats_view, name='request_stats')
 
 )
 
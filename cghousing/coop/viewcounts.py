@@ -0,0 +1,101 @@
+"""Counting thread views.
+
+Saving the thread on every view would turn each read into a full-row write
+(which also bumps `datetime_modified`) and would lose increments when two
+workers save the same thread at once. Instead, `record_thread_view` adds the
+view to a buffer in this process, and `flush_thread_views` writes the
+buffered counts with one `UPDATE ... SET views = views + n` per distinct `n`.
+Since the increments are applied by the database, the buffers of any number
+of worker processes add up correctly.
+
+A background thread, started by the first view that is recorded, flushes the
+buffer every `settings.VIEW_COUNT_FLUSH_INTERVAL` seconds (with 0, every
+view is written straight away), whether or not more views arrive; the buffer
+is also flushed when the process exits. At most an interval's worth of views
+is lost if the process is killed, so the counts are approximate.
+
+"""
+
+import time
+import atexit
+import logging
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import F
+
+from coop.models import Thread
+
+logger = logging.getLogger(__name__)
+
+_pending = defaultdict(int)
+_lock = threading.Lock()
+_flushers = []
+
+
+def get_flush_interval():
+    return getattr(settings, 'VIEW_COUNT_FLUSH_INTERVAL', 60)
+
+
+def record_thread_view(thread_id):
+    """Count one view of the thread with id `thread_id`."""
+    with _lock:
+        _pending[thread_id] += 1
+        if get_flush_interval() > 0 and not _flushers:
+            flusher = threading.Thread(target=flush_work,
+                name='coop-viewcounts-flush')
+            flusher.daemon = True
+            flusher.start()
+            _flushers.append(flusher)
+    if get_flush_interval() <= 0:
+        flush_thread_views()
+
+
+def flush_work():
+    """Flush the buffered view counts every interval, forever."""
+    while True:
+        time.sleep(max(get_flush_interval(), 1))
+        try:
+            flush_thread_views()
+        except Exception:
+            logger.exception('Flushing the view counts failed.')
+        finally:
+            # This thread's connection would otherwise stay open.
+            connection.close()
+
+
+def flush_thread_views():
+    """Write the buffered view counts to the database. Return the number of
+    threads updated. If the database fails, the counts are kept for the next
+    flush.
+
+    """
+
+    with _lock:
+        pending = dict(_pending)
+        _pending.clear()
+    if not pending:
+        return 0
+    by_increment = defaultdict(list)
+    for thread_id, increment in pending.items():
+        by_increment[increment].append(thread_id)
+    by_increment = by_increment.items()
+    for index, (increment, thread_ids) in enumerate(by_increment):
+        try:
+            Thread.objects.filter(pk__in=thread_ids)\
+                .update(views=F('views') + increment)
+        except Exception:
+            logger.exception('Could not write the view counts of %d'
+                ' threads; will retry.', len(pending))
+            # Put back the increments that were not written.
+            with _lock:
+                for increment, thread_ids in by_increment[index:]:
+                    for thread_id in thread_ids:
+                        _pending[thread_id] += increment
+            return 0
+    return len(pending)
+
+
+atexit.register(flush_thread_views)
@@ -1,19 +1,22 @@
 import time
+import datetime
 import os
 import string
-import magic
 import logging
 import json
 import errno
-import subprocess
 import re
+import csv
 from itertools import chain
 from django.shortcuts import render, get_object_or_404
-from django.http import HttpResponse, HttpResponseRedirect, HttpResponseForbidden
+from django.http import (HttpResponse, HttpResponseRedirect,
+    HttpResponseForbidden, StreamingHttpResponse)
 from django.core.urlresolvers import reverse
 from django.template import RequestContext, loader
+from django.template.loader import render_to_string
+from django.conf import settings
 from django.http import Http404
-from django.utils.timezone import now
+from django.utils.timezone import now, utc
 from django.views.generic import ListView, DetailView, TemplateView, View
 from django.views.decorators.http import require_POST
 from django.contrib.auth import authenticate, login, logout
@@ -22,11 +25,26 @@ from django.contrib import messages
 from django.forms import (Form, ModelForm, CharField, Textarea,
         ModelChoiceField, ValidationError, CheckboxSelectMultiple)
 from django.forms.widgets import HiddenInput
-from django.db.models import Q
+from django.utils.html import format_html, escape
+from django.utils.http import urlquote
+from django.db.models import Q, Prefetch
 from coop.models import (
     Forum, Thread, Post, ApplicationSettings, Page, File, Person, UPLOADS_DIR,
     BlockRepresentative, Committee, PhoneNumber, Unit, Committee,
     ParticipationRequirement)
+from coop.cache import (get_or_build, memoize_on_request,
+    GLOBAL_CONTEXT_NAMESPACE, MEMBER_DIRECTORY_NAMESPACE,
+    COMMITTEE_LIST_NAMESPACE, UNIT_OCCUPANTS_NAMESPACE)
+from coop.membership import MembershipSnapshot
+from coop.permissions import get_permissions
+from coop.participation import (get_participation_matrix, FULFILLED,
+    SHIRKED, EXCUSED)
+from coop.serving import serve_file, get_etag, SERVE_MODE_DJANGO
+from coop.storage import upload_storage, get_content_hash, get_hash_name
+from coop.uploads import get_mime_type, get_rejected_uploads
+from coop import pdfbuild, instrumentation, search, derivatives, exports
+from coop.viewcounts import record_thread_view
+from coop.templatetags.coop_extras import coop_user_name
 
 logger = logging.getLogger(__name__)
 
@@ -40,22 +58,33 @@ logger = logging.getLogger(__name__)
 ################################################################################
 
 
-LATEX_DIR = 'latex'
-
-
-def get_global_context():
+def get_global_context(request=None):
     """Return a context dict that all templates need. Includes the active
     application settings model, which specifies which pages are public.
 
+    The context is built at most once per request and is otherwise served from
+    the cache; it is invalidated whenever an `ApplicationSettings` or a `Page`
+    is saved or deleted (see `coop.signals`). A fresh dict is returned on each
+    call, so callers may update it.
+
+    """
+
+    context = memoize_on_request(request, '_coop_global_context',
+        lambda: get_or_build(GLOBAL_CONTEXT_NAMESPACE, build_global_context))
+    return dict(context)
+
+
+def build_global_context():
+    """Build the global template context from the database.
+
     """
 
     app_settings = get_application_settings()
-    context = {
+    return {
         'app_settings': app_settings,
         'coop_members_only_pages': get_coop_members_only_pages(app_settings),
         'coop_public_pages': get_coop_public_pages(app_settings)
     }
-    return context
 
 
 def get_coop_public_pages(app_settings):
@@ -114,7 +143,7 @@ class GlobalContextMixin(View):
 
     def get_context_data(self, **kwargs):
         context = super(GlobalContextMixin, self).get_context_data(**kwargs)
-        context.update(get_global_context())
+        context.update(get_global_context(self.request))
         return context
 
 
@@ -127,7 +156,7 @@ def index_view(request):
 
     """
 
-    return render(request, 'coop/index.html', get_global_context())
+    return render(request, 'coop/index.html', get_global_context(request))
 
 
 ################################################################################
@@ -143,10 +172,9 @@ def forums_view(request):
 
     """
 
-    forums = Forum.objects.order_by('name')
-    forums = [get_forum_posts(forum) for forum in forums]
-    forums = [get_forum_most_recent_post(forum) for forum in forums]
-    forums = sorted(forums, key=lambda k: len(k.posts), reverse=True)
+    forums = Forum.objects\
+        .select_related('committee', 'last_post__creator')\
+        .order_by('-post_count', 'name')
     forum_list, committee_forum_list = split_committee_forums(forums)
     context = {
         'forum_list': {
@@ -156,7 +184,7 @@ def forums_view(request):
         'current_page': 'forums',
         'request': request
         }
-    context.update(get_global_context())
+    context.update(get_global_context(request))
     return render(request, 'coop/forum_list.html', context)
 
 
@@ -186,15 +214,85 @@ def forum_view_by_url_name(request, url_name):
 
 
 def display_forum(request, forum):
-    """Display the forum `forum`.
+    """Display the forum `forum`. Its threads are listed most recently active
+    first, `FORUM_THREADS_PER_PAGE` at a time. Pages are selected with the
+    `before` GET parameter, an opaque cursor that identifies the last thread
+    of the previous page (see `get_thread_cursor`). Since this is keyset
+    pagination, viewing the oldest threads of a large forum costs no more than
+    viewing the newest.
 
     """
 
-    context = {'forum': forum}
-    context.update(get_global_context())
+    before = parse_thread_cursor(request.GET.get('before'))
+    threads, next_cursor = get_forum_threads_page(forum, before)
+    context = {
+        'forum': forum,
+        'threads': threads,
+        'before': request.GET.get('before') if before else None,
+        'next_cursor': next_cursor
+    }
+    context.update(get_global_context(request))
     return render(request, 'coop/forum_detail.html', context)
 
 
+FORUM_THREADS_PER_PAGE = 25
+
+
+def get_forum_threads_page(forum, before=None, page_size=FORUM_THREADS_PER_PAGE):
+    """Return a 2-tuple: a list of (at most) `page_size` threads of `forum`,
+    most recently active first, and the cursor of the following page (or
+    `None` if this is the last page). `before` is a parsed cursor, i.e., a
+    (`last_activity_at`, `id`) 2-tuple; only threads that sort after it are
+    returned. Each thread comes with its creator and its last post (and that
+    post's creator) so the page renders with a single query.
+
+    """
+
+    threads = Thread.objects\
+        .filter(forum=forum)\
+        .select_related('creator', 'last_post__creator')\
+        .order_by('-last_activity_at', '-id')
+    if before:
+        last_activity_at, id_ = before
+        threads = threads.filter(Q(last_activity_at__lt=last_activity_at) |
+            Q(last_activity_at=last_activity_at, id__lt=id_))
+    threads = list(threads[:page_size + 1])
+    next_cursor = None
+    if len(threads) > page_size:
+        threads = threads[:page_size]
+        next_cursor = get_thread_cursor(threads[-1])
+    return threads, next_cursor
+
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=utc)
+
+
+def get_thread_cursor(thread):
+    """Return a URL-safe string that encodes the position of `thread` in its
+    forum's thread listing: microseconds since the epoch of its last activity,
+    an underscore, and its id, e.g., "1422400043123456_37".
+
+    """
+
+    delta = thread.last_activity_at - EPOCH
+    microseconds = ((delta.days * 86400 + delta.seconds) * 1000000 +
+        delta.microseconds)
+    return '%d_%d' % (microseconds, thread.id)
+
+
+def parse_thread_cursor(cursor):
+    """Return the (`last_activity_at`, `id`) 2-tuple encoded in `cursor` (see
+    `get_thread_cursor`), or `None` if `cursor` is missing or malformed.
+
+    """
+
+    try:
+        microseconds, id_ = [int(x) for x in cursor.split('_')]
+        return (EPOCH + datetime.timedelta(microseconds=microseconds), id_)
+    except (AttributeError, ValueError, OverflowError):
+        return None
+
+
 @login_required
 def forum_new(request):
     """Display page for creating a new forum, if you're a superuser.
@@ -205,7 +303,7 @@ def forum_new(request):
         return HttpResponseForbidden('Only administrators can create new forums.')
     form = ForumForm()
     context = {'form': form}
-    context.update(get_global_context())
+    context.update(get_global_context(request))
     return render(request, 'coop/forum_new.html', context)
 
 
@@ -227,7 +325,7 @@ def forum_save(request):
             kwargs={'pk': new_forum.id}))
     else:
         context = {'form': form}
-        context.update(get_global_context())
+        context.update(get_global_context(request))
         return render(request, 'coop/forum_new.html', context)
 
 
@@ -242,7 +340,8 @@ def thread_view(request, url_name, pk):
     """
 
     try:
-        thread = Thread.objects.get(pk=pk)
+        thread = Thread.objects\
+            .select_related('forum', 'last_post__creator').get(pk=pk)
         return display_thread(request, thread)
     except:
         raise Http404("There is no thread with id %s in forum %s" % (
@@ -257,7 +356,9 @@ def thread_view_by_url_subject(request, url_name, url_subject):
     """
 
     try:
-        thread = Thread.objects.filter(url_subject=url_subject).first()
+        thread = Thread.objects\
+            .select_related('forum', 'last_post__creator')\
+            .filter(url_subject=url_subject).first()
         if not thread:
             raise Http404("There is no thread %s in forum %s" % (
                 url_subject, url_name))
@@ -277,7 +378,7 @@ def thread_new_view(request, url_name):
     forum = Forum.objects.filter(url_name=url_name).first()
     form = ThreadForm(forum)
     context = {'form': form, 'forum': forum}
-    context.update(get_global_context())
+    context.update(get_global_context(request))
     return render(request, 'coop/thread_new.html', context)
 
 
@@ -298,7 +399,7 @@ def thread_save_view(request, url_name):
             kwargs={'url_name': forum.url_name, 'pk': new_thread.id}))
     else:
         context = {'form': form, 'forum': forum}
-        context.update(get_global_context())
+        context.update(get_global_context(request))
         return render(request, 'coop/thread_new.html', context)
 
 
@@ -310,19 +411,71 @@ def display_thread(request, thread):
     """
 
     context = {'thread': thread, 'errors': {}}
-    context.update(get_global_context())
+    context.update(get_global_context(request))
     if request.method == 'POST':
         return save_thread(request, thread, context)
     else:
-        thread.views += 1
-        thread.save()
+        record_thread_view(thread.id)
         form = PostForm(thread=thread)
-        form.fields['reply_to'].queryset = Post.objects.filter(thread=thread)
         context['post_form'] = form
+        context['posts_page'] = get_thread_posts_page(thread,
+            request.GET.get('page'), request.GET.get('post'))
         context['markdown_help_text'] = markdown_help_text
         return render(request, 'coop/thread_detail.html', context)
 
 
+THREAD_POSTS_PER_PAGE = 50
+
+
+def get_thread_posts_page(thread, page=None, post_id=None,
+        page_size=THREAD_POSTS_PER_PAGE):
+    """Return a dict describing one page of the posts of `thread`, oldest
+    first. The page is the one containing the post with id `post_id`, if
+    given, otherwise page number `page` ("last" for the last page), otherwise
+    the first page.
+
+    The number of pages comes from the denormalized `thread.post_count` and
+    each post comes with its creator and the post it replies to (and that
+    post's creator), so the page costs a fixed number of queries however long
+    the thread is. Each post is given a `reply_to_on_page` attribute so that
+    the template can link within the page when possible.
+
+    """
+
+    num_pages = max(1, (thread.post_count + page_size - 1) // page_size)
+    number = 1
+    if post_id:
+        try:
+            number = (Post.objects.filter(thread=thread)
+                .filter(id__lt=int(post_id)).count() // page_size) + 1
+        except ValueError:
+            pass
+    elif page == 'last':
+        number = num_pages
+    elif page:
+        try:
+            number = int(page)
+        except ValueError:
+            pass
+    number = min(max(number, 1), num_pages)
+    offset = (number - 1) * page_size
+    posts = list(thread.posts
+        .select_related('creator', 'reply_to__creator')
+        .order_by('id')[offset:offset + page_size])
+    post_ids = set(p.id for p in posts)
+    for post in posts:
+        post.reply_to_on_page = post.reply_to_id in post_ids
+    return {
+        'posts': posts,
+        'number': number,
+        'num_pages': num_pages,
+        'has_previous': number > 1,
+        'has_next': number < num_pages,
+        'previous_page_number': number - 1,
+        'next_page_number': number + 1
+    }
+
+
 def save_thread(request, thread, context):
     """Save an existing thread, either by adding a post to it or by modifying
     one of its existing posts.
@@ -343,16 +496,17 @@ def save_thread(request, thread, context):
         else:
             post.creator = post.modifier = request.user
         post.save()
-        return HttpResponseRedirect(reverse('coop:thread',
-            kwargs={'url_name': post.thread.forum.url_name,
-                    'pk': post.thread.id}))
+        return HttpResponseRedirect('%s?post=%d#%d' % (
+            reverse('coop:thread', kwargs={'url_name': thread.forum.url_name,
+                'pk': thread.id}),
+            post.id, post.id))
     else:
-        form.fields['reply_to'].queryset = Post.objects.filter(thread=thread)
-        context = get_global_context()
+        context = get_global_context(request)
         if post_id:
             context.update({'thread': thread, 'form': form, 'post': post})
             return render(request, 'coop/post_edit.html', context)
         context.update({'thread': thread, 'post_form': form,
+            'posts_page': get_thread_posts_page(thread, 'last'),
             'markdown_help_text': markdown_help_text})
         return render(request, 'coop/thread_detail.html', context)
 
@@ -374,11 +528,8 @@ def post_edit_view(request, pk):
         if post.creator != request.user:
             return HttpResponseForbidden('You are not authorized to edit this post')
         form = PostForm(instance=post, thread=post.thread)
-        # TODO: can't the following line go in the `PostForm` constructor override?
-        form.fields['reply_to'].queryset = Post.objects\
-            .filter(thread=post.thread).filter(~Q(id=post.id))
         context = {'post': post, 'form': form}
-        context.update(get_global_context())
+        context.update(get_global_context(request))
         return render(request, 'coop/post_edit.html', context)
 
 
@@ -391,11 +542,12 @@ def files_view(request):
 
     """
 
-    files = File.objects.order_by('name')
+    files = list(File.objects.order_by('name'))
     for file in files:
-        file.path = os.path.split(str(file.upload))[1]
+        file.thumbnail_url = derivatives.get_derivative_url(file,
+            derivatives.THUMBNAIL)
     context = {'files': files, 'request': request}
-    context.update(get_global_context())
+    context.update(get_global_context(request))
     return render(request, 'coop/file_list.html', context)
 
 
@@ -409,9 +561,11 @@ def file_view(request, pk):
     context = {
         'file': file,
         'icon': FILE_FA_ICONS.get(file.type, 'file-o'),
-        'path': os.path.split(str(file.upload))[1]
+        'path': file.path,
+        'preview_url': derivatives.get_derivative_url(file,
+            derivatives.PREVIEW)
     }
-    context.update(get_global_context())
+    context.update(get_global_context(request))
     return render(request, 'coop/file_detail.html', context)
 
 
@@ -422,24 +576,30 @@ def file_by_path_view(request, path):
 
     """
 
-    full_path = os.path.join(UPLOADS_DIR, path)
-    file = File.objects.filter(upload=full_path).first()
+    file = File.objects.filter(path=path).first()
+    if not file:
+        raise Http404("There is no file at %s" % path)
     context = {
         'file': file,
         'icon': FILE_FA_ICONS.get(file.type, 'file-o'),
-        'path': path
+        'path': path,
+        'preview_url': derivatives.get_derivative_url(file,
+            derivatives.PREVIEW)
     }
-    context.update(get_global_context())
+    context.update(get_global_context(request))
     return render(request, 'coop/file_detail.html', context)
 
 
 def file_data_view(request, path):
-    """Return the file data, i.e., serve the file. The `path` argument must be
-    the value of file.upload minus the 'uploads' directory prefix. This is the
-    name of the file with whitespace replaced by underscores.
+    """Return the file data, i.e., serve the file. The `path` argument is the
+    file's `path`: its name with whitespace replaced by underscores. (The data
+    itself is stored under its hash; see `coop.storage`.)
 
-    TODO: is this inefficient? Does it load the entire file into memory and/or
-    should these files be served via Apache/Nginx instead of Django/Python?
+    The file is streamed in chunks, with support for byte ranges (so audio can
+    seek) and conditional GETs based on the file's size and modification
+    time. Depending on `settings.FILE_SERVE_MODE`, the bytes may instead be
+    sent by nginx (X-Accel-Redirect) or Apache (X-Sendfile); see
+    `coop.serving`.
 
     Note: add the following line in order to force a download/save-as of the
     file::
@@ -448,21 +608,45 @@ def file_data_view(request, path):
 
     """
 
-    try:
-        path = os.path.join(UPLOADS_DIR, path)
-        file = File.objects.filter(upload=path).first()
-        if (not file.public) and (not request.user.is_authenticated()):
-            return HttpResponseForbidden('Only co-op members can access that file')
-        if os.path.isfile(path) and file:
-            file_data = open(path, 'rb')
-            response = HttpResponse(content=file_data)
-            response['Content-Type']= file.type
-            response['Content-Disposition'] = 'filename="%s.pdf"' % file.name
-            return response
-        else:
-            raise Http404("There is no file at %s" % path)
-    except File.DoesNotExist:
+    file = File.objects.filter(path=path).first()
+    if not file:
+        raise Http404("There is no file at %s" % path)
+    if (not file.public) and (not request.user.is_authenticated()):
+        return HttpResponseForbidden('Only co-op members can access that file')
+    data_path = file.upload.path
+    if not os.path.isfile(data_path):
         raise Http404("There is no file at %s" % path)
+    return serve_file(request, data_path, file.type,
+        relative_path=os.path.relpath(data_path, file.upload.storage.location),
+        last_modified=file.datetime_modified,
+        etag=get_etag(file.size, file.datetime_modified),
+        extra_headers={
+            'Content-Disposition': 'filename="%s.pdf"' % file.name})
+
+
+# Derivatives never change, since they are named by the hash of the upload.
+DERIVATIVE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+def file_derivative_view(request, content_hash, kind):
+    """Serve the thumbnail or preview (depending on `kind`) of the upload
+    whose SHA-256 is `content_hash`; see `coop.derivatives`. People who are
+    not logged in may only see those of public files.
+
+    """
+
+    files = File.objects.filter(upload=get_hash_name(content_hash))
+    if not request.user.is_authenticated():
+        files = files.filter(public=True)
+    path = derivatives.get_derivative_path(content_hash, kind)
+    if not (files.exists() and os.path.isfile(path)):
+        raise Http404("There is no %s of %s" % (kind, content_hash))
+    return serve_file(request, path, 'image/png',
+        relative_path=os.path.relpath(path, upload_storage.location),
+        etag='"%s-%s"' % (content_hash, kind),
+        extra_headers={'Cache-Control': '%s, max-age=%d' % (
+            'private' if request.user.is_authenticated() else 'public',
+            DERIVATIVE_MAX_AGE)})
 
 
 @login_required
@@ -473,7 +657,7 @@ def file_new_view(request):
 
     form = FileForm()
     context = {'form': form}
-    context.update(get_global_context())
+    context.update(get_global_context(request))
     return render(request, 'coop/file_new.html', context)
 
 
@@ -493,9 +677,8 @@ def file_edit_view(request, pk):
                 ' file')
         form = FileEditForm(instance=file)
         icon = FILE_FA_ICONS.get(file.type, 'file-o')
-        file.path = os.path.split(str(file.upload))[1]
         context = {'form': form, 'file': file, 'icon': icon}
-        context.update(get_global_context())
+        context.update(get_global_context(request))
         return render(request, 'coop/file_edit.html', context)
 
 
@@ -512,7 +695,8 @@ def file_save_view(request):
         file = File.objects.get(pk=file_id)
         form = FileEditForm(instance=file, data=request.POST)
     else:
-        form = FileForm(request.POST, request.FILES)
+        form = FileForm(request.POST, request.FILES,
+            rejected_uploads=get_rejected_uploads(request))
     if form.is_valid():
         if file_id:
             updated_file = form.save(commit=False)
@@ -524,17 +708,18 @@ def file_save_view(request):
             new_file = File(**form.cleaned_data)
             new_file.creator = new_file.modifier = request.user
             new_file.save()
+            derivatives.request_derivatives(
+                get_content_hash(new_file.upload.name), new_file.type)
             return HttpResponseRedirect(reverse('coop:file',
                 kwargs={'pk': new_file.id}))
     else:
         if file_id:
             icon = FILE_FA_ICONS.get(file.type, 'file-o')
-            file.path = os.path.split(str(file.upload))[1]
             context = {'form': form, 'file': file, 'icon': icon}
-            context.update(get_global_context())
+            context.update(get_global_context(request))
             return render(request, 'coop/file_edit.html', context)
         context = {'form': form}
-        context.update(get_global_context())
+        context.update(get_global_context(request))
         return render(request, 'coop/file_new.html', context)
 
 
@@ -551,66 +736,86 @@ def participation_requirements_view(request):
     """
 
     participation_requirements = ParticipationRequirement.objects\
-        .order_by('date')\
-        .prefetch_related('fulfillers', 'shirkers', 'excusees')\
-        .all()
-    user_authorized = (request.user.is_superuser or
-        user_is_participation_chair(request.user))
+        .order_by('date')
+    user_authorized = get_permissions(request).can_manage_participation()
     context = {'participation_requirements': participation_requirements,
         'request': request, 'user_authorized': user_authorized}
     if user_authorized:
-        context['units'] = Unit.objects\
-            .order_by('block_number', 'unit_number')\
-            .prefetch_related('occupants')
-        for unit in context['units']:
-            unit.formatted_occupants = get_formatted_occupants(unit)
-            unit.participation = get_unit_participation(unit,
-                    participation_requirements)
-    context.update(get_global_context())
+        matrix = get_participation_matrix(participation_requirements,
+            get_units_index())
+        for unit, statuses in matrix:
+            unit.participation = [
+                format_participation_status(status, pr)
+                for status, pr in zip(statuses, participation_requirements)]
+        context['units'] = [unit for unit, statuses in matrix]
+    context.update(get_global_context(request))
     return render(request, 'coop/participation_requirements.html', context)
 
 
-def get_unit_participation(unit, participation_requirements):
-    """Return a list of HTML strings representing whether the unit has
-    fulfilled, shirked or been excused from each participation requirement in
-    `participation_requirements`.
+@login_required
+def participation_requirements_export_view(request, export_format):
+    """Return the participation matrix, i.e., the participation status of
+    every unit for every participation requirement, as JSON or CSV, depending
+    on `export_format`. Only superusers and the participation chair may export it.
 
-    Rules: if one member from the unit has fulfilled, the unit has fulfilled.
-    Otherwise, if one has shirked, the unit has shirked. Otherwise if one is
-    excused, the unit is excused. Otherwise, participation by this unit at this
-    time is not applicable (null).
+    """
+
+    if not get_permissions(request).can_manage_participation():
+        return HttpResponseForbidden('You are not authorized to view'
+            ' participation requirements.')
+    participation_requirements = ParticipationRequirement.objects\
+        .order_by('date')
+    units = Unit.objects.order_by('block_number', 'unit_number')
+    matrix = get_participation_matrix(participation_requirements, units)
+    if export_format == 'csv':
+        response = HttpResponse(content_type='text/csv')
+        response['Content-Disposition'] = ('attachment;'
+            ' filename="participation-requirements.csv"')
+        writer = csv.writer(response)
+        writer.writerow(['Block #', 'Unit #'] + [
+            ('%s (%s)' % (pr.name, pr.date.isoformat())).encode('utf-8')
+            for pr in participation_requirements])
+        for unit, statuses in matrix:
+            writer.writerow([unit.block_number, unit.unit_number] +
+                [status or '' for status in statuses])
+        return response
+    response_data = {
+        'participation_requirements': [
+            {'id': pr.id, 'name': pr.name, 'date': pr.date.isoformat()}
+            for pr in participation_requirements],
+        'units': [
+            {'id': unit.id, 'block_number': unit.block_number,
+             'unit_number': unit.unit_number, 'participation': statuses}
+            for unit, statuses in matrix]
+    }
+    return HttpResponse(json.dumps(response_data),
+        content_type="application/json")
+
+
+PARTICIPATION_STATUS_ICONS = {
+    FULFILLED: ('<i class="pr-icon ok fa fa-trophy"'
+        ' title="Unit/member fulfilled participation requirement'
+        ' %s.">&nbsp;</i>'),
+    SHIRKED: ('<i class="pr-icon error fa fa-circle-o"'
+        ' title="Unit/member failed to fulfill participation'
+        ' requirement %s.">&nbsp;</i>'),
+    EXCUSED: ('<i class="pr-icon fa fa-times"'
+        ' title="Unit/member is excused from fulfilling participation'
+        ' requirement %s.">&nbsp;</i>')
+}
+
+
+def format_participation_status(status, participation_requirement):
+    """Return an HTML string representing whether a unit has fulfilled,
+    shirked or been excused from `participation_requirement`, given its
+    `status` (see `coop.participation`).
 
     """
 
-    result = []
-    occupants = unit.occupants.filter(member=True).filter(user__is_active=True).all()
-    for pr in participation_requirements:
-        participation_list = []
-        for occupant in occupants:
-            if occupant in pr.fulfillers.all():
-                participation_list.append('fulfilled')
-            elif occupant in pr.excusees.all():
-                participation_list.append('excused')
-            elif occupant in pr.shirkers.all():
-                participation_list.append('shirked')
-            else:
-                participation_list.append(None)
-        if 'fulfilled' in participation_list:
-            occupants_result = ('<i class="pr-icon ok fa fa-trophy"'
-                ' title="Unit/member fulfilled participation requirement'
-                ' %s.">&nbsp;</i>' % pr.name)
-        elif 'shirked' in participation_list:
-            occupants_result = ('<i class="pr-icon error fa fa-circle-o"'
-                ' title="Unit/member failed to fulfill participation'
-                ' requirement %s.">&nbsp;</i>' % pr.name)
-        elif 'excused' in participation_list:
-            occupants_result = ('<i class="pr-icon fa fa-times"'
-                ' title="Unit/member is excused from fulfilling participation'
-                ' requirement %s.">&nbsp;</i>' % pr.name)
-        else:
-            occupants_result = ''
-        result.append(occupants_result)
-    return result
+    if status:
+        return PARTICIPATION_STATUS_ICONS[status] % escape(
+            participation_requirement.name)
+    return ''
 
 
 @login_required
@@ -620,13 +825,12 @@ def participation_requirement_new_view(request):
 
     """
 
-    if ((not request.user.is_superuser) and
-        (not user_is_participation_chair(request.user))):
+    if not get_permissions(request).can_manage_participation():
         return HttpResponseForbidden('You are not authorized to create new'
             ' participation requirements.')
     form = ParticipationRequirementForm()
     context = {'form': form, 'participation_edit_js': participation_edit_js}
-    context.update(get_global_context())
+    context.update(get_global_context(request))
     return render(request, 'coop/participation_requirement_new.html', context)
 
 
@@ -636,8 +840,7 @@ def participation_requirement_edit_view(request, pk):
 
     """
 
-    if ((not request.user.is_superuser) and
-        (not user_is_participation_chair(request.user))):
+    if not get_permissions(request).can_manage_participation():
         return HttpResponseForbidden('You are not authorized to edit'
             ' participation requirements.')
     try:
@@ -648,22 +851,11 @@ def participation_requirement_edit_view(request, pk):
         form = ParticipationRequirementForm(instance=pr)
         context = {'form': form, 'participation_requirement': pr,
                     'participation_edit_js': participation_edit_js}
-        context.update(get_global_context())
+        context.update(get_global_context(request))
         return render(request, 'coop/participation_requirement_edit.html',
                 context)
 
 
-def user_is_participation_chair(user):
-    """Return `True` if `user` is the participation chair; `False` otherwise.
-
-    """
-
-    for c in user.person.committees.all():
-        if c.name == 'Participation' and c.chair.id == user.person.id:
-            return True
-    return False
-
-
 @login_required
 def participation_requirement_view(request, pk):
     """Display a participation requirement, given its primary key `pk`, e.g.,
@@ -671,13 +863,12 @@ def participation_requirement_view(request, pk):
 
     """
 
-    if ((not request.user.is_superuser) and
-        (not user_is_participation_chair(request.user))):
+    if not get_permissions(request).can_manage_participation():
         return HttpResponseForbidden('You are not authorized to view'
             ' participation requirements.')
     pr = ParticipationRequirement.objects.get(pk=pk)
     context = {'participation_requirement': pr}
-    context.update(get_global_context())
+    context.update(get_global_context(request))
     return render(request, 'coop/participation_requirement_detail.html',
         context)
 
@@ -690,8 +881,7 @@ def participation_requirement_save_view(request):
 
     """
 
-    if ((not request.user.is_superuser) and
-        (not user_is_participation_chair(request.user))):
+    if not get_permissions(request).can_manage_participation():
         return HttpResponseForbidden('You are not authorized to save'
             ' participation requirements.')
     pr_id = request.POST.get('id')
@@ -717,7 +907,7 @@ def participation_requirement_save_view(request):
                 kwargs={'pk': new_pr.id}))
     else:
         context = {'form': form, 'participation_edit_js': participation_edit_js}
-        context.update(get_global_context())
+        context.update(get_global_context(request))
         if pr_id:
             context['participation_requirement'] = pr
             return render(request, 'coop/participation_requirement_edit.html',
@@ -736,29 +926,138 @@ def members_view(request):
 
     """
 
-    members = [fix_member(m) for m in
-        Person.objects.order_by('last_name').filter(member=True).filter(user__is_active=True)]
-    context = {'members': members, 'request': request, 'current_page': 'members'}
-    context.update(get_global_context())
+    if getattr(settings, 'CACHE_MEMBER_DIRECTORY', False):
+        members_table = get_or_build(MEMBER_DIRECTORY_NAMESPACE,
+            render_member_directory)
+    else:
+        members_table = render_member_directory()
+    context = {'members_table': members_table, 'request': request,
+        'current_page': 'members'}
+    context.update(get_global_context(request))
     return render(request, 'coop/members.html', context)
 
 
+def get_member_directory():
+    """Return the list of active members, ordered by last name, each fixed up
+    for display by `fix_member`. The members' units, committees, children and
+    phone numbers are fetched in bulk, so this costs four queries no matter
+    how many members there are.
+
+    """
+
+    members = Person.objects\
+        .filter(member=True)\
+        .filter(user__is_active=True)\
+        .select_related('unit')\
+        .prefetch_related('committees', 'children', 'phone_numbers')\
+        .order_by('last_name')
+    committee_urls = {}
+    member_url = get_member_url_formatter()
+    unit_url = get_url_formatter('coop:unit_by_block_unit_nos',
+        'block_unit_nos', '-0-0-0-')
+    members = [fix_member(m, committee_urls) for m in members]
+    for member in members:
+        member.url = member_url(member)
+        if member.unit:
+            member.unit_url = unit_url('%s-%s' % (member.unit.block_number,
+                member.unit.unit_number))
+    return members
+
+
+def render_member_directory():
+    """Return the HTML table of the member directory. The members view caches
+    this, if `settings.CACHE_MEMBER_DIRECTORY` is set, until a person,
+    committee, phone number, unit or user changes (see `coop.signals`).
+
+    """
+
+    return render_to_string('coop/members_table.html',
+        {'members': get_member_directory()})
+
+
 @login_required
 def members_pdf_view(request):
-    """Create and serve a PDF file that shows the members of the co-op.
+    """Serve the PDF file that shows the members of the co-op. If the PDF for
+    the current membership list has not been built yet, start building it in
+    the background (see `coop.pdfbuild`) and display a page that polls
+    `members_pdf_status_view` until it is ready.
 
     """
 
     members = Person.objects.filter(member=True).filter(user__is_active=True).all()
-    path = generate_membership_list_pdf(members)
-    if path:
-        file_data = open(path, 'rb')
-        response = HttpResponse(content=file_data)
-        response['Content-Type']= 'application/pdf'
-        response['Content-Disposition'] = 'filename="%s.pdf"' % file.name
-        return response
-    else:
-        return HttpResponseRedirect(reverse('coop:members'))
+    source_hash, status = pdfbuild.request_build(
+        get_latex_membership_doc(members))
+    download_url = reverse('coop:members_pdf_download',
+        kwargs={'source_hash': source_hash})
+    if status == pdfbuild.DONE:
+        return HttpResponseRedirect(download_url)
+    context = {
+        'download_url': download_url,
+        'status_url': reverse('coop:members_pdf_status',
+            kwargs={'source_hash': source_hash}),
+        'request': request,
+        'current_page': 'members'
+    }
+    context.update(get_global_context(request))
+    return render(request, 'coop/members_pdf.html', context)
+
+
+@login_required
+def members_pdf_status_view(request, source_hash):
+    """Return JSON that describes the state of the build of the members PDF
+    identified by `source_hash`. The status is "unknown" if no process is
+    building it (e.g., because the one that was died); the client should then
+    request the PDF again, which starts the build afresh.
+
+    """
+
+    status = pdfbuild.get_build_status(source_hash) or 'unknown'
+    data = {'status': status}
+    if status == pdfbuild.DONE:
+        data['url'] = reverse('coop:members_pdf_download',
+            kwargs={'source_hash': source_hash})
+    return HttpResponse(json.dumps(data), content_type='application/json')
+
+
+@login_required
+def members_pdf_download_view(request, source_hash):
+    """Serve a built members PDF. Its URL embeds the hash of its LaTeX source,
+    so it never changes and browsers may keep it.
+
+    """
+
+    path = pdfbuild.get_pdf_path(source_hash)
+    if not os.path.isfile(path):
+        raise Http404
+    pdfbuild.touch(source_hash)
+    return serve_file(request, path, 'application/pdf',
+        etag='"%s"' % source_hash, mode=SERVE_MODE_DJANGO,
+        extra_headers={
+            'Content-Disposition': 'filename="%s.pdf"' % pdfbuild.BUILD_FILENAME,
+            'Cache-Control': 'private, max-age=86400'})
+
+
+@login_required
+def members_export_view(request, export_format):
+    """Return the membership list in the export format `export_format` (e.g.,
+    "pdf", "html" or "csv"; see `coop.exports`). Unlike `members_pdf_view`,
+    this does not need LaTeX: the export is rendered in Python as it is
+    streamed.
+
+    """
+
+    export = exports.get_export(export_format)
+    if not export:
+        raise Http404("There is no membership list export in format %s" %
+            export_format)
+    members = Person.objects.filter(member=True).filter(user__is_active=True)
+    membership_list = get_membership_list(members)
+    response = StreamingHttpResponse(export.render(membership_list),
+        content_type=export.content_type)
+    response['Content-Disposition'] = '%sfilename="%s.%s"' % (
+        'attachment; ' if export.attachment else '',
+        pdfbuild.BUILD_FILENAME, export.extension)
+    return response
 
 
 @login_required
@@ -771,9 +1070,8 @@ def member_participation_record_view(request, pk):
         member = Person.objects.filter(member=True).get(pk=pk)
     except Person.DoesNotExist:
         raise Http404("There is no member with id %s" % pk)
-    if ((not request.user.is_superuser) and
-        (not request.user.id == member.user.id) and
-        (not user_is_participation_chair(request.user))):
+    if ((request.user.id != member.user_id) and
+        (not get_permissions(request).can_manage_participation())):
         return HttpResponseForbidden('You are not authorized to view this'
                 ' member\'s participation record.')
     fulfilled = [pr for pr in member.fulfilled_participation_requirements.order_by('date').all()]
@@ -788,7 +1086,7 @@ def member_participation_record_view(request, pk):
     requirements = fulfilled + shirked + excused
     requirements = sorted([(pr.date, pr) for pr in requirements])
     context = {'member': member, 'requirements': requirements}
-    context.update(get_global_context())
+    context.update(get_global_context(request))
     return render(request, 'coop/member_participation_record.html', context)
 
 
@@ -813,7 +1111,7 @@ def member_by_full_name_view(request, full_name):
     if not member:
         raise Http404("There is no member matching %s" % full_name)
     context = {'member': fix_member(member)}
-    context.update(get_global_context())
+    context.update(get_global_context(request))
     return render(request, 'coop/person_detail.html', context)
 
 
@@ -830,13 +1128,13 @@ def member_edit_view(request, pk):
     except Person.DoesNotExist:
         raise Http404("There is no member with id %s" % pk)
     else:
-        if ((not request.user.is_superuser) and member.user.id != request.user.id):
+        if ((not request.user.is_superuser) and member.user_id != request.user.id):
             return HttpResponseForbidden('You are not authorized to edit this'
                 ' member')
         form = PersonForm(instance=member)
         context = {'form': form, 'member': member, 'markdown_help_text':
                 markdown_help_text}
-        context.update(get_global_context())
+        context.update(get_global_context(request))
         return render(request, 'coop/member_edit.html', context)
 
 
@@ -864,11 +1162,11 @@ def return_change_password_form(request, pk):
     except Person.DoesNotExist:
         raise Http404("There is no member with id %s" % pk)
     else:
-        if ((not request.user.is_superuser) and member.user.id != request.user.id):
+        if ((not request.user.is_superuser) and member.user_id != request.user.id):
             return HttpResponseForbidden('You are not authorized to change this'
                 ' member\'s password.')
         context = {'member': member}
-        context.update(get_global_context())
+        context.update(get_global_context(request))
         return render(request, 'coop/member_change_password.html', context)
 
 
@@ -883,8 +1181,8 @@ def change_password(request, pk):
         raise Http404("There is no member with id %s" % pk)
     else:
         context = {'member': member}
-        context.update(get_global_context())
-        if ((not request.user.is_superuser) and member.user.id != request.user.id):
+        context.update(get_global_context(request))
+        if ((not request.user.is_superuser) and member.user_id != request.user.id):
             return HttpResponseForbidden('You are not authorized to change this'
                 ' member\'s password.')
         old_password = request.POST.get('old_password')
@@ -909,7 +1207,7 @@ def change_password(request, pk):
         member.user.set_password(new_password)
         member.user.save()
         context = {'member': fix_member(member)}
-        context.update(get_global_context())
+        context.update(get_global_context(request))
         return render(request, 'coop/person_detail.html', context)
 
 
@@ -959,29 +1257,34 @@ def member_save_view(request):
     else:
         context = {'form': form, 'member': member, 'markdown_help_text':
                 markdown_help_text}
-        context.update(get_global_context())
+        context.update(get_global_context(request))
         return render(request, 'coop/member_edit.html', context)
 
 
-def fix_member(member):
+def fix_member(member, committee_urls=None):
     """Add attributes to the member (`Person` instance) so that it is more
-    easily displayable in a template.
+    easily displayable in a template. `committee_urls` is an optional dict
+    from committee ids to URLs; pass the same one when fixing many members,
+    so that each committee's URL is only reversed once.
 
     TODO: this functionality should probably be in the `Person` model.
 
-    TODO: link each committee name to the page for that committee.
-
     """
 
+    if committee_urls is None:
+        committee_urls = {}
     if member.committee_excused:
         member.formatted_committees = 'Excused by board'
     else:
         committees = []
         for c in member.committees.all():
             if c.name != 'Co-op':
-                url = reverse('coop:committee_by_url_name',
-                    kwargs={'url_name': c.url_name})
-                if c.chair and c.chair.id == member.id:
+                url = committee_urls.get(c.id)
+                if url is None:
+                    url = committee_urls[c.id] = reverse(
+                        'coop:committee_by_url_name',
+                        kwargs={'url_name': c.url_name})
+                if c.chair_id == member.id:
                     committees.append('<a href="%s">%s</a> (chair)' % (url, c.name))
                 else:
                     committees.append('<a href="%s">%s</a>' % (url, c.name))
@@ -1000,9 +1303,14 @@ def fix_member(member):
     return member
 
 
-def get_person_phone_numbers_string(person):
+def get_phone_numbers_string(phone_numbers):
+    """Return a string listing `phone_numbers`, `PhoneNumber`s (or anything
+    else with a `number` and a `phone_type`), with their types.
+
+    """
+
     phone_nos = []
-    for p in person.phone_numbers.all():
+    for p in phone_numbers:
         if p.phone_type:
             phone_nos.append('%s (%s)' % (p.number, p.phone_type))
         else:
@@ -1019,44 +1327,93 @@ def committees_view(request):
 
     """
 
-    committees = Committee.objects.order_by('name')
-    for c in committees:
-        c.formatted_members = get_formatted_members(c)
+    if getattr(settings, 'CACHE_COMMITTEE_LIST', False):
+        committees_table = get_or_build(COMMITTEE_LIST_NAMESPACE,
+            render_committee_list)
+    else:
+        committees_table = render_committee_list()
     context = {
-        'committees': committees,
+        'committees_table': committees_table,
         'current_page': 'committees',
         'request': request
         }
-    context.update(get_global_context())
+    context.update(get_global_context(request))
     return render(request, 'coop/committee_list.html', context)
 
 
-def get_formatted_members(committee):
+def get_committee_list():
+    """Return the list of committees, ordered by name, with their chairs and
+    their members (ordered by name) and the URLs of all of them. This costs
+    three queries no matter how many committees or members there are.
+
+    """
+
+    committees = Committee.objects\
+        .select_related('chair')\
+        .prefetch_related(get_committee_members_prefetch())\
+        .order_by('name')
+    committee_url = get_url_formatter('coop:committee_by_url_name',
+        'url_name')
+    member_url = get_member_url_formatter()
+    committees = list(committees)
+    for committee in committees:
+        committee.url = committee_url(committee.url_name)
+        if committee.chair:
+            committee.chair_url = member_url(committee.chair)
+        committee.formatted_members = get_formatted_members(committee,
+            member_url)
+    return committees
+
+
+def render_committee_list():
+    """Return the HTML table of the committee list. The committees view caches
+    this, if `settings.CACHE_COMMITTEE_LIST` is set, until a committee, its
+    membership or a person changes (see `coop.signals`).
+
+    """
+
+    return render_to_string('coop/committee_list_table.html',
+        {'committees': get_committee_list()})
+
+
+def get_committee_members_prefetch():
+    return Prefetch('members',
+        queryset=Person.objects.order_by('last_name', 'first_name'))
+
+
+def get_member_url_formatter():
+    """Return a function that returns the URL of a member's page, given the
+    member (a `Person`).
+
+    """
+
+    url = get_url_formatter('coop:member_by_full_name', 'full_name')
+    return lambda member: url('%s_%s' % (member.last_name, member.first_name))
+
+
+def get_formatted_members(committee, member_url=None):
     """Return a comma-delimited string of HTML links for each non-chair member
-    in `committee`.
+    in `committee`. `member_url` is a function from members to their URLs; see
+    `get_member_url_formatter`.
 
     """
 
-    chair_id = None
-    if committee.chair:
-        chair_id = committee.chair.id
+    if member_url is None:
+        member_url = get_member_url_formatter()
     members = []
     for member in committee.members.all():
-        if member.id != chair_id:
-            members.append(get_formatted_member(member))
+        if member.id != committee.chair_id:
+            members.append(get_formatted_member(member, member_url))
     return ', '.join(members)
 
 
-def get_formatted_member(member):
+def get_formatted_member(member, member_url):
     """Return member as a link to that member's page.
 
     """
 
-    url = reverse('coop:member_by_full_name',
-        kwargs={'full_name': '%s_%s' % (member.last_name,
-            member.first_name)})
-    return '<a href="%s">%s %s</a>' % (url, member.first_name,
-            member.last_name)
+    return format_html(u'<a href="{0}">{1} {2}</a>', member_url(member),
+        member.first_name, member.last_name)
 
 
 @login_required
@@ -1071,7 +1428,7 @@ def committee_save_view(request):
         committee = Committee.objects.get(pk=committee_id)
     except Committee.DoesNotExist:
         raise Http404("There is no committee with id %s" % committee_id)
-    if not user_can_edit_committee(request.user, committee):
+    if not get_permissions(request).can_edit_committee(committee):
         return HttpResponseForbidden('You are not authorized to edit this'
                 ' committee')
     form = CommitteeForm(instance=committee, data=request.POST)
@@ -1085,7 +1442,7 @@ def committee_save_view(request):
     else:
         context = {'form': form, 'committee': committee, 'markdown_help_text':
                 markdown_help_text}
-        context.update(get_global_context())
+        context.update(get_global_context(request))
         return render(request, 'coop/committee_edit.html', context)
 
 
@@ -1096,41 +1453,26 @@ def committee_by_url_name_view(request, url_name):
     """
 
     try:
-        committee = Committee.objects.filter(url_name=url_name).first()
+        committee = Committee.objects\
+            .filter(url_name=url_name)\
+            .select_related('chair', 'forum')\
+            .prefetch_related(get_committee_members_prefetch())\
+            .first()
         if not committee:
             raise Http404("Committee %s does not exist" % url_name)
         committee.formatted_members = get_formatted_members(committee)
-        committee.member_ids = [m.user.id for m in committee.members.all()]
+        committee.member_ids = [m.user_id for m in committee.members.all()]
         context = {
                 'committee': committee,
                 'user_can_edit_committee':
-                    user_can_edit_committee(request.user, committee)
+                    get_permissions(request).can_edit_committee(committee)
                     }
-        context.update(get_global_context())
+        context.update(get_global_context(request))
         return render(request, 'coop/committee_detail.html', context)
     except Committee.DoesNotExist:
         raise Http404("Committee %s does not exist" % url_name)
 
 
-def user_can_edit_committee(user, committee):
-    """Return `True` if the `user` can edit `committee`. Superusers, members of
-    `committee` and chairs of the Participation and Membership committees can
-    edit `committee`.
-
-    """
-
-    if user.is_superuser:
-        return True
-    elif user.id in [m.user.id for m in committee.members.all()]:
-        return True
-    else:
-        for c in user.person.committees.all():
-            if (c.name in ['Participation', 'Membership'] and
-                c.chair.id == user.person.id):
-                return True
-    return False
-
-
 @login_required
 def committee_edit_view(request, pk):
     """Display a form for editing a committee. Only superusers and members of
@@ -1143,7 +1485,7 @@ def committee_edit_view(request, pk):
     except Committee.DoesNotExist:
         raise Http404("There is no committee with id %s" % pk)
     else:
-        if not user_can_edit_committee(request.user, committee):
+        if not get_permissions(request).can_edit_committee(committee):
             return HttpResponseForbidden('You are not authorized to edit this'
                 ' committee')
         form = CommitteeForm(instance=committee)
@@ -1153,7 +1495,7 @@ def committee_edit_view(request, pk):
         form.fields['chair'].queryset = members
         context = {'form': form, 'committee': committee, 'markdown_help_text':
                 markdown_help_text}
-        context.update(get_global_context())
+        context.update(get_global_context(request))
         return render(request, 'coop/committee_edit.html', context)
 
 
@@ -1166,34 +1508,62 @@ def units_view(request):
 
     """
 
-    units = Unit.objects.order_by('block_number', 'unit_number')
-    for unit in units:
-        unit.formatted_occupants = get_formatted_occupants(unit)
     context = {
-        'units': units,
+        'units': get_units_index(),
         'current_page': 'units',
         'request': request
         }
-    context.update(get_global_context())
+    context.update(get_global_context(request))
     return render(request, 'coop/unit_list.html', context)
 
 
-def get_formatted_occupants(unit):
-    """Return a string of HTML links
+def get_units_index(units=None):
+    """Return `units` (by default, all units, ordered by block and unit
+    number) as a list. Each unit gets a `url` and a `formatted_occupants`
+    attribute, the HTML that lists its active occupants. This costs at most
+    two queries: one for the units and one for all of the occupants, which is
+    skipped while their HTML is cached.
 
     """
 
-    fo = []
-    for o in unit.occupants.all():
-        if o.user and o.user.is_active:
-            if o.member:
-                url = reverse('coop:member_by_full_name',
-                    kwargs={'full_name': '%s_%s' % (o.last_name, o.first_name)})
-                fo.append('<a href="%s">%s %s</a>' % (url, o.first_name,
-                    o.last_name))
-            else:
-                fo.append('%s %s' % (o.first_name, o.last_name))
-    return ', '.join(fo)
+    if units is None:
+        units = Unit.objects.order_by('block_number', 'unit_number')
+    units = list(units)
+    formatted_occupants = get_formatted_occupants_by_unit()
+    unit_url = get_url_formatter('coop:unit_by_block_unit_nos',
+        'block_unit_nos', '-0-0-0-')
+    for unit in units:
+        unit.url = unit_url('%s-%s' % (unit.block_number, unit.unit_number))
+        unit.formatted_occupants = formatted_occupants.get(unit.id, u'')
+    return units
+
+
+def get_formatted_occupants_by_unit():
+    """Return a dict from unit ids to the HTML that lists the active occupants
+    (i.e., those with active users) of the unit: links to the members' pages
+    and the names of the others. The dict is cached until a person or a user
+    changes (see `coop.signals`).
+
+    """
+
+    return get_or_build(UNIT_OCCUPANTS_NAMESPACE, build_formatted_occupants)
+
+
+def build_formatted_occupants():
+    member_url = get_member_url_formatter()
+    occupants = {}
+    for person in Person.objects\
+            .filter(unit__isnull=False)\
+            .filter(user__is_active=True)\
+            .order_by('id'):
+        if person.member:
+            formatted = get_formatted_member(person, member_url)
+        else:
+            formatted = escape(u'%s %s' % (person.first_name,
+                person.last_name))
+        occupants.setdefault(person.unit_id, []).append(formatted)
+    return dict((unit_id, u', '.join(formatted))
+        for unit_id, formatted in occupants.items())
 
 
 @login_required
@@ -1213,9 +1583,10 @@ def unit_by_block_unit_nos_view(request, block_unit_nos):
         .first()
     if not unit:
         raise Http404("There is no unit matching %s" % block_unit_nos)
-    unit.formatted_occupants = get_formatted_occupants(unit)
+    unit.formatted_occupants = get_formatted_occupants_by_unit().get(unit.id,
+        u'')
     context = {'unit': unit}
-    context.update(get_global_context())
+    context.update(get_global_context(request))
     return render(request, 'coop/unit_detail.html', context)
 
 
@@ -1234,7 +1605,7 @@ def pages_view(request):
         'current_page': 'pages',
         'request': request
         }
-    context.update(get_global_context())
+    context.update(get_global_context(request))
     return render(request, 'coop/page_list.html', context)
 
 
@@ -1247,7 +1618,7 @@ def page_new_view(request):
     form = PageForm()
     context = {'form': form,
         'markdown_help_text': markdown_help_text}
-    context.update(get_global_context())
+    context.update(get_global_context(request))
     return render(request, 'coop/page_new.html', context)
 
 
@@ -1269,7 +1640,7 @@ def page_edit_view(request, pk):
         form = PageForm(instance=page)
         context = {'form': form, 'page': page,
             'markdown_help_text': markdown_help_text}
-        context.update(get_global_context())
+        context.update(get_global_context(request))
         return render(request, 'coop/page_edit.html', context)
 
 
@@ -1304,11 +1675,11 @@ def page_save_view(request):
         if page_id:
             context = {'form': form, 'page': page,
                 'markdown_help_text': markdown_help_text}
-            context.update(get_global_context())
+            context.update(get_global_context(request))
             return render(request, 'coop/page_edit.html', context)
         context = {'form': form,
             'markdown_help_text': markdown_help_text}
-        context.update(get_global_context())
+        context.update(get_global_context(request))
         return render(request, 'coop/page_new.html', context)
 
 
@@ -1343,10 +1714,10 @@ def display_page(request, page):
     if (not page.public) and (not request.user.is_authenticated()):
         context = {'next': reverse('coop:page_by_url_title',
             kwargs={'url_title': page.url_title})}
-        context.update(get_global_context())
+        context.update(get_global_context(request))
         return render(request, 'coop/login.html', context)
     context = {'page': page, 'current_page': page.url_title}
-    context.update(get_global_context())
+    context.update(get_global_context(request))
     return render(request, 'coop/page_detail.html', context)
 
 
@@ -1426,7 +1797,7 @@ def login_view(request):
 
     next_ = request.GET.get('next', reverse('coop:index'))
     context = {'next': next_}
-    context.update(get_global_context())
+    context.update(get_global_context(request))
     return render(request, 'coop/login.html', context)
 
 
@@ -1456,6 +1827,57 @@ def logout_view(request):
     return HttpResponseRedirect(reverse('coop:index'))
 
 
+################################################################################
+# Search
+################################################################################
+
+SEARCH_RESULTS_LIMIT = 50
+
+
+def search_view(request):
+    """Display the best matches for the words in the `q` parameter, e.g.,
+    /search/?q=roof+repair. People who are not logged in only find public
+    pages and files. See `coop.search`.
+
+    """
+
+    query = request.GET.get('q', '').strip()
+    results = []
+    if query:
+        results = search.search(query,
+            include_private=request.user.is_authenticated(),
+            limit=SEARCH_RESULTS_LIMIT)
+    context = {
+        'query': query,
+        'results': results,
+        'limit': SEARCH_RESULTS_LIMIT,
+        'request': request
+    }
+    context.update(get_global_context(request))
+    return render(request, 'coop/search.html', context)
+
+
+################################################################################
+# Instrumentation
+################################################################################
+
+@login_required
+def request_stats_view(request):
+    """Return JSON summarizing the query counts and timings of the requests
+    that this process has served, per view (see `coop.instrumentation`). Only
+    superusers may see this. POST with `reset=1` to start over.
+
+    """
+
+    if not request.user.is_superuser:
+        return HttpResponseForbidden('Only administrators can view request'
+            ' statistics.')
+    if request.method == 'POST' and request.POST.get('reset'):
+        instrumentation.reset_stats()
+    return HttpResponse(json.dumps(instrumentation.get_stats(), indent=2,
+        sort_keys=True), content_type='application/json')
+
+
 ################################################################################
 # Forms
 ################################################################################
@@ -1508,6 +1930,33 @@ class ThreadForm(ModelForm):
         return cleaned_data
 
 
+class ReplyToWidget(HiddenInput):
+    """Widget for the `reply_to` field of posts. Rather than a <select> with
+    an option for every post in the thread, it renders the id of the post
+    being replied to in a hidden input, along with a label. The "Reply" links
+    on the thread page update both. The label is taken from the `reply_to`
+    post instance that the form puts on the widget, so rendering costs no
+    queries.
+
+    """
+
+    def __init__(self, attrs=None):
+        super(ReplyToWidget, self).__init__(attrs)
+        self.reply_to = None
+
+    def render(self, name, value, attrs=None):
+        hidden = super(ReplyToWidget, self).render(name, value, attrs)
+        if self.reply_to and unicode(self.reply_to.id) == unicode(value):
+            label = u'%s by %s' % (self.reply_to.subject,
+                coop_user_name(self.reply_to.creator))
+        elif value:
+            label = u'post #%s' % value
+        else:
+            label = u'nobody in particular'
+        return format_html(u'<span class="reply-to-label">{0}</span>{1}',
+            label, hidden)
+
+
 class PostForm(ModelForm):
     """Form for creating new posts.
 
@@ -1516,14 +1965,28 @@ class PostForm(ModelForm):
     class Meta:
         model = Post
         fields = ['reply_to', 'subject', 'post']
+        widgets = {'reply_to': ReplyToWidget}
+        labels = {'reply_to': 'Replying to'}
 
     def __init__(self, *args, **kwargs):
         thread = kwargs['thread']
         del kwargs['thread']
         super(PostForm, self).__init__(*args, **kwargs)
-        posts = thread.posts.all()
-        if (not posts) or (self.instance == posts[0]):
-            self.fields["reply_to"].widget = HiddenInput()
+        # Only posts in this thread (other than this one) can be replied to.
+        # The queryset is only evaluated to validate a submitted id.
+        reply_to_field = self.fields['reply_to']
+        reply_to_field.queryset = Post.objects.filter(thread=thread)
+        if self.instance.pk:
+            reply_to_field.queryset = reply_to_field.queryset\
+                .exclude(pk=self.instance.pk)
+            reply_to_field.widget.reply_to = self.instance.reply_to
+            is_first_post = self.instance.reply_to_id is None
+        else:
+            # New posts reply to nobody in particular until a post's "Reply"
+            # link is clicked.
+            is_first_post = thread.post_count == 0
+        if is_first_post:
+            reply_to_field.widget = HiddenInput()
 
 ALLOWED_FILE_TYPES = (
     'application/pdf',
@@ -1573,23 +2036,29 @@ class FileForm(ModelForm):
         model = File
         fields = ['upload', 'description', 'public']
 
+    def __init__(self, *args, **kwargs):
+        # The uploads that `coop.uploads.UploadHandler` rejected for being
+        # too large; see `get_rejected_uploads`.
+        self.rejected_uploads = kwargs.pop('rejected_uploads', {})
+        super(FileForm, self).__init__(*args, **kwargs)
+        if 'upload' in self.rejected_uploads:
+            self.fields['upload'].required = False
+
     def clean(self):
         cleaned_data = super(FileForm, self).clean()
         upload = cleaned_data.get('upload', '')
+        if ('upload' in self.rejected_uploads or
+                (upload and upload.size > settings.MAX_UPLOAD_SIZE)):
+            raise ValidationError('That file is too big. %(limit)d MB is the'
+                ' limit', params={'limit': settings.MAX_UPLOAD_SIZE // 1000000},
+                code='invalid')
         if not upload:
             raise ValidationError('Please choose a file for upload',
                 code='invalid')
-        try:
-            type_ = magic.Magic(mime=True).from_file(
-                upload.temporary_file_path())
-        except AttributeError:
-            type_ = magic.Magic(mime=True).from_buffer(upload.read())
+        type_ = get_mime_type(upload)
         if type_ not in ALLOWED_FILE_TYPES:
             raise ValidationError('Files of type %(type)s cannot be uploaded',
                 params={'type': type_}, code='invalid')
-        if upload.size > 20000000:
-            raise ValidationError('That file is too big. 20 MB is the limit',
-                code='invalid')
         cleaned_data['type'] = type_
         cleaned_data['size'] = upload.size
         cleaned_data['name'] = upload.name
@@ -1709,27 +2178,18 @@ def split_committee_forums(forums):
     return (general_forums, committee_forums)
 
 
-def get_forum_posts(forum):
-    """Return all of the posts in the forum `forum`.
+def get_url_formatter(viewname, kwarg, placeholder='placeholder'):
+    """Return a function that takes the value of the single keyword argument
+    `kwarg` of the URL pattern `viewname` and returns the URL, like `reverse`
+    does. The pattern is only reversed once, so this is much faster than
+    calling `reverse` for each of many objects. `placeholder` must match the
+    pattern's group and must not occur elsewhere in the URL.
 
     """
 
-    forum.posts = [post for thread in forum.threads.all()
-        for post in thread.posts.all()]
-    return forum
-
-
-def get_forum_most_recent_post(forum):
-    """Return the most recent post in `forum`.
-
-    """
-
-    posts = sorted(forum.posts, key=lambda p: p.datetime_created, reverse=True)
-    try:
-        forum.most_recent_post = posts[0]
-    except IndexError:
-        forum.most_recent_post = None
-    return forum
+    url = reverse(viewname, kwargs={kwarg: placeholder})
+    prefix, suffix = url.split(placeholder)
+    return lambda value: u'%s%s%s' % (prefix, urlquote(value), suffix)
 
 
 def name2url(name):
@@ -1767,49 +2227,26 @@ def make_directory_safely(path):
 ################################################################################
 
 
-def generate_membership_list_pdf(members):
-    """Use LaTeX to generate a PDF encoding the members, their roles, and their
-    contact information.
-
-    """
-
-    make_directory_safely(LATEX_DIR)
-    subdir = 'latex-%s' % now().strftime('%Y-%m-%d')
-    subpath = os.path.join(LATEX_DIR, subdir)
-    make_directory_safely(subpath)
-    filename = 'membership-distribution-list-%s' % now().strftime('%Y-%m-%d')
-    latex_fname = '%s.tex' % filename
-    pdf_fname = '%s.pdf' % filename
-    latex_fpath = os.path.join(subpath, latex_fname)
-    pdf_fpath = os.path.join(subpath, pdf_fname)
-    with open(latex_fpath, 'w') as f:
-        f.write(get_latex_membership_doc(members))
-    cwd = os.path.join(os.getcwd(), subpath)
-    process = subprocess.Popen(['pdflatex', latex_fname], shell=False,
-            stdout=subprocess.PIPE, cwd=cwd)
-    output = process.communicate()[0]
-    if os.path.isfile(pdf_fpath):
-        return pdf_fpath
-    else:
-        return None
-
-
 def get_latex_membership_doc(members):
     """Return a LaTeX (.tex) document representing a "Membership List". This is
-    a series of tables, one for each block (i.e., address) in the co-op
+    a series of tables, one for each block (i.e., address) in the co-op. The
+    data come from a `MembershipSnapshot` of `members` (a queryset of
+    persons), so the number of queries does not depend on the number of
+    members.
 
     """
 
-    blocks = get_blocks_dict_for_latex_membership_doc(members)
-    block_reps = BlockRepresentative.objects.all()
-    participation_chair = get_participation_chair()
+    snapshot = MembershipSnapshot.load(members)
+    blocks = get_blocks_dict_for_latex_membership_doc(snapshot)
+    participation_chair = get_participation_chair(snapshot)
     for block_no, block in blocks.items():
         latex_rows = []
         for unit_no, occupants in block['units'].items():
-            latex_rows.append(get_latex_occupants_row(unit_no, occupants))
+            latex_rows.append(get_latex_occupants_row(unit_no, occupants,
+                snapshot))
         block['member_rows'] = '\n'.join(latex_rows)
-        block['maintenance_rep'] = get_maintenance_rep(block_no, block_reps)
-        block['roof_monitor'] = get_roof_monitor(block_no, block_reps)
+        block['maintenance_rep'] = get_maintenance_rep(block_no, snapshot)
+        block['roof_monitor'] = get_roof_monitor(block_no, snapshot)
         block['participation_chair'] = participation_chair
     latex_membership_blocks = '\n\n'.join(get_latex_membership_block_table(
             block_no, blocks[block_no]) for block_no in sorted(blocks.keys()))
@@ -1830,11 +2267,62 @@ def get_latex_membership_doc(members):
 ''' % latex_membership_blocks
 
 
-def get_blocks_dict_for_latex_membership_doc(members):
+def get_membership_list(members):
+    """Return the membership list of `members` (a queryset of persons) as
+    plain text, for the exports in `coop.exports`: a dict with the co-op's
+    name, the date, the participation chair and a list of blocks, ordered by
+    number, each with its representatives and a row for each of its units.
+    The data come from a `MembershipSnapshot`, as for the LaTeX membership
+    list.
+
+    """
+
+    snapshot = MembershipSnapshot.load(members)
+    blocks = get_blocks_dict_for_latex_membership_doc(snapshot)
+    # Every block has the co-op's name and the date.
+    if blocks:
+        block = blocks.values()[0]
+        coop_name, date = block['coop_name'], block['date']
+    else:
+        coop_name = getattr(get_application_settings(), 'coop_name', 'Co-op')
+        date = now().strftime('%B %d, %Y')
+    membership_list = {
+        'coop_name': coop_name,
+        'date': date,
+        'participation_chair': get_participation_chair(snapshot),
+        'blocks': []
+    }
+    for block_no in sorted(blocks.keys()):
+        units = blocks[block_no]['units']
+        rows = []
+        for unit_no in sorted(units.keys()):
+            occupants = units[unit_no]
+            committees, chairships = get_cmtes_chrs_for_latex_row(occupants,
+                snapshot)
+            rows.append({
+                'unit': unicode(unit_no),
+                'members': get_members_for_latex_row(occupants),
+                'children': get_children_for_latex_row(occupants, snapshot),
+                'phone_numbers': get_phone_nos_for_latex_row(occupants,
+                    snapshot, space=' '),
+                'emails': get_emails_for_row(occupants),
+                'committees': committees,
+                'chairships': chairships
+            })
+        membership_list['blocks'].append({
+            'number': block_no,
+            'maintenance_rep': get_maintenance_rep(block_no, snapshot),
+            'roof_monitor': get_roof_monitor(block_no, snapshot),
+            'rows': rows
+        })
+    return membership_list
+
+
+def get_blocks_dict_for_latex_membership_doc(snapshot):
     """Return a dict representing the blocks in the co-op. Keys are block
     numbers, i.e., street addresses. Values are dicts representing each block.
     Each block has a `unit` key whose value is a dict that maps unit numbers to
-    lists of persons, i.e., members.
+    lists of persons, i.e., the members in `snapshot`.
 
     """
 
@@ -1842,7 +2330,7 @@ def get_blocks_dict_for_latex_membership_doc(members):
     app_settings = get_application_settings()
     coop_name = getattr(app_settings, 'coop_name', 'Co-op')
     date = now().strftime('%B %d, %Y')
-    for member in members:
+    for member in snapshot.members:
         member_block = member.unit.block_number
         block = blocks.get(member_block)
         if not block:
@@ -1860,7 +2348,7 @@ def get_blocks_dict_for_latex_membership_doc(members):
     return blocks
 
 
-def get_latex_occupants_row(unit_no, occupants):
+def get_latex_occupants_row(unit_no, occupants, snapshot):
     """Return a latex {tabular} row to represent the occupants of a given unit.
     This is a row with the following columns:
 
@@ -1875,10 +2363,10 @@ def get_latex_occupants_row(unit_no, occupants):
     """
 
     members = get_members_for_latex_row(occupants)
-    children = get_children_for_latex_row(occupants)
-    phone_nos = get_phone_nos_for_latex_row(occupants)
+    children = get_children_for_latex_row(occupants, snapshot)
+    phone_nos = get_phone_nos_for_latex_row(occupants, snapshot)
     emails = get_emails_for_latex_row(occupants)
-    committees, chairships = get_cmtes_chrs_for_latex_row(occupants)
+    committees, chairships = get_cmtes_chrs_for_latex_row(occupants, snapshot)
     return (r'%s & %s & %s & %s & %s & \scriptsize {\scshape %s} & \scriptsize'
             r' {\scshape %s} \\ \hline' % (
                 unit_no,
@@ -1904,17 +2392,17 @@ def get_members_for_latex_row(occupants):
             occupants)
 
 
-def get_children_for_latex_row(occupants):
+def get_children_for_latex_row(occupants, snapshot):
     """Return a string representing the children in `occupants`, a list of
-    persons in a given unit.
+    persons in a given unit, according to `snapshot`.
 
     """
 
-    children = set()
+    children = {}
     for person in occupants:
-        for child in person.children.all():
-            children.add(child)
-    children = list(children)
+        for child in snapshot.children.get(person.id, ()):
+            children[child.id] = child
+    children = children.values()
     if len(children) == 0:
         return ''
     elif len(children) == 1:
@@ -1926,15 +2414,17 @@ def get_children_for_latex_row(occupants):
                 children[-1].first_name)
 
 
-def get_phone_nos_for_latex_row(occupants):
+def get_phone_nos_for_latex_row(occupants, snapshot, space='~'):
     """Return a string representing the phone numbers of `occupants`, a list of
-    persons in a given unit.
+    persons in a given unit, according to `snapshot`. Each number is separated
+    from its type and owners by `space` (by default, LaTeX's non-breaking
+    space).
 
     """
 
     phone_nos_tmp = {}
     for person in occupants:
-        for phone_no in person.phone_numbers.all():
+        for phone_no in snapshot.phone_numbers.get(person.id, ()):
             phone_nos_tmp.setdefault(phone_no.number, {})
             phone_nos_tmp[phone_no.number]['type'] = phone_no.phone_type
             phone_nos_tmp[phone_no.number].setdefault('owner',
@@ -1943,14 +2433,14 @@ def get_phone_nos_for_latex_row(occupants):
     for number, meta in phone_nos_tmp.items():
         if meta['type']:
             if len(meta['owner']) != len(occupants):
-                phone_nos.append('%s~(%s, %s)' % (
-                    number, meta['type'], ' & '.join(meta['owner'])))
+                phone_nos.append('%s%s(%s, %s)' % (
+                    number, space, meta['type'], ' & '.join(meta['owner'])))
             else:
-                phone_nos.append('%s~(%s)' % (number, meta['type']))
+                phone_nos.append('%s%s(%s)' % (number, space, meta['type']))
         else:
             if len(meta['owner']) != len(occupants):
-                phone_nos.append('%s~(%s)' % (
-                    number, ' & '.join(meta['owner'])))
+                phone_nos.append('%s%s(%s)' % (
+                    number, space, ' & '.join(meta['owner'])))
             else:
                 phone_nos.append('%s' % (number,))
     return ', '.join(phone_nos)
@@ -1962,18 +2452,32 @@ def get_emails_for_latex_row(occupants):
 
     """
 
+    emails = get_emails_for_row(occupants)
+    if len(emails) == 1 and emails[0][1] is None:
+        return r'\href{mailto:%s}{%s}' % (tex_escape(emails[0][0]),
+            tex_escape(emails[0][0]))
+    else:
+        return ', '.join(r'\href{mailto:%s}{%s} (%s)' % (tex_escape(email),
+            tex_escape(email), first_name) for email, first_name in emails)
+
+
+def get_emails_for_row(occupants):
+    """Return the emails of `occupants`, a list of persons in a given unit, as
+    a list of (email, first name) pairs. If they all share one email, it is
+    returned on its own, with `None` for the first name.
+
+    """
+
     emails = list(set(p.email for p in occupants if p.email))
     if len(emails) == 1:
-        return r'\href{mailto:%s}{%s}' % (tex_escape(emails[0]),
-            tex_escape(emails[0]))
-    else:
-        return ', '.join(r'\href{mailto:%s}{%s} (%s)' % (tex_escape(p.email),
-            tex_escape(p.email), p.first_name) for p in occupants if p.email)
+        return [(emails[0], None)]
+    return [(p.email, p.first_name) for p in occupants if p.email]
 
 
-def get_cmtes_chrs_for_latex_row(occupants):
+def get_cmtes_chrs_for_latex_row(occupants, snapshot):
     """Return a 2-tuple of strings representing the committees and chairships
-    of `occupants`, a list of persons in a given unit.
+    of `occupants`, a list of persons in a given unit, according to
+    `snapshot`.
 
     """
 
@@ -1982,70 +2486,64 @@ def get_cmtes_chrs_for_latex_row(occupants):
     if len(occupants) == 1:
         if occupants[0].committee_excused:
             committees.append('excused by board')
-        for committee in occupants[0].committees.all():
+        for committee in snapshot.committees.get(occupants[0].id, ()):
             if committee.name != 'Co-op':
                 committees.append('%s' % committee.name)
-            if committee.chair and committee.chair.id == occupants[0].id:
+            if committee.chair_id == occupants[0].id:
                 chairships.append('Yes-%s' % committee.name)
     else:
         for person in occupants:
             if person.committee_excused:
                 committees.append('excused by board (%s)' % person.first_name)
-            for committee in person.committees.all():
+            for committee in snapshot.committees.get(person.id, ()):
                 if committee.name != 'Co-op':
                     committees.append('%s (%s)' % (committee.name,
                         person.first_name))
-                if committee.chair and committee.chair.id == person.id:
+                if committee.chair_id == person.id:
                     chairships.append('Yes-%s-%s' % (committee.name,
                         person.first_name))
     return (' / '.join(committees).lower(), ', '.join(chairships).lower())
 
 
-def get_maintenance_rep(block_no, block_reps):
-    """Return the maintenance representative for block `block_no`, if
+def get_block_rep_for_latex(block_no, role, snapshot):
+    """Return the person with `role` for block `block_no` in `snapshot`, if
     exists. Return as '<First Name> <Last Name> - <Phone Number>'.
 
     """
 
-    try:
-        rep = [r for r in block_reps if r.block_number == block_no and
-                r.role == 'maintenance'][0].person
-    except IndexError:
-        return 'POSITION AVAILABLE'
+    rep = snapshot.get_block_rep(block_no, role)
+    if rep:
+        return '%s %s - %s' % (rep.first_name, rep.last_name,
+            get_phone_numbers_string(snapshot.phone_numbers.get(rep.id, ())))
     else:
-        if rep:
-            return '%s %s - %s' % (rep.first_name, rep.last_name,
-                get_person_phone_numbers_string(rep))
-        else:
-            return 'POSITION AVAILABLE'
+        return 'POSITION AVAILABLE'
+
+
+def get_maintenance_rep(block_no, snapshot):
+    """Return the maintenance representative for block `block_no`, if
+    exists. Return as '<First Name> <Last Name> - <Phone Number>'.
 
+    """
+
+    return get_block_rep_for_latex(block_no, 'maintenance', snapshot)
 
-def get_roof_monitor(block_no, block_reps):
+
+def get_roof_monitor(block_no, snapshot):
     """Return the roof monitor for block `block_no`, if
     exists. Return as '<First Name> <Last Name> - <Phone Number>'.
 
     """
 
-    try:
-        rep = [r for r in block_reps if r.block_number == block_no and
-                r.role == 'roof monitor'][0].person
-    except IndexError:
-        return 'POSITION AVAILABLE'
-    else:
-        if rep:
-            return '%s %s - %s' % (rep.first_name, rep.last_name,
-                get_person_phone_numbers_string(rep))
-        else:
-            return 'POSITION AVAILABLE'
+    return get_block_rep_for_latex(block_no, 'roof monitor', snapshot)
 
 
-def get_participation_chair():
+def get_participation_chair(snapshot):
     """Return the chair of the participation committee, if exists. Return as
     '<First Name> <Last Name> <Address> or <Email>'.
 
     """
 
-    participation_cmte = Committee.objects.filter(name='Participation').first()
+    participation_cmte = snapshot.participation_committee
     if participation_cmte:
         if participation_cmte.chair:
             return '%s %s #%s - %s or %s' % (
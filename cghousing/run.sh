@@ -2,4 +2,11 @@
 
 python cghousing/manage.py collectstatic --noinput
 python cghousing/manage.py migrate --database=prod --noinput
-python cghousing/manage.py runserver 0.0.0.0:8000
+# The shared cache (see CG_CACHE_BACKEND in the Dockerfile); a no-op once the
+# table exists.
+python cghousing/manage.py createcachetable --database=prod
+# Delete the uploads that no file references, e.g., because the last shutdown
+# cut their release short; see coop/storage.py. Also worth running daily.
+python cghousing/manage.py sweep_uploads
+# See cghousing/cghousing/gunicorn_conf.py; `kill -HUP` the master to reload.
+exec gunicorn -c cghousing/cghousing/gunicorn_conf.py cghousing.wsgi:application